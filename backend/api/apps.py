@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import create_search_indexes
+        from .stats import seed_totals
+
+        post_migrate.connect(create_search_indexes, sender=self)
+        post_migrate.connect(seed_totals, sender=self)
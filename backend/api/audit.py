@@ -0,0 +1,123 @@
+"""
+Security audit logging.
+
+`record()` only builds an unsaved AuditEvent and puts it on an in-process
+queue; a daemon thread drains the queue and writes events with bulk_create,
+so request handlers never wait on the insert. Set AUDIT_LOG_BUFFERED = False
+to write synchronously instead (e.g. in tests or one-off scripts).
+"""
+
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .models import AuditEvent
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, "AUDIT_LOG_BATCH_SIZE", 500)
+FLUSH_INTERVAL = getattr(settings, "AUDIT_LOG_FLUSH_INTERVAL", 1.0)
+QUEUE_SIZE = getattr(settings, "AUDIT_LOG_QUEUE_SIZE", 10000)
+
+
+def client_ip(request):
+    """Address of the client, or of the closest proxy in front of the app"""
+    return request.META.get("REMOTE_ADDR") or None
+
+
+class BufferedWriter:
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                # Started lazily so forked worker processes get their own thread
+                self._thread = threading.Thread(
+                    target=self._run, name="audit-writer", daemon=True
+                )
+                self._thread.start()
+
+    def put(self, event):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Never block a request on the audit log
+            self.dropped += 1
+            logger.warning("Audit queue full, dropped %s event", event.action)
+
+    def _take_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            AuditEvent.objects.bulk_create(batch)
+        except Exception:
+            logger.exception("Failed to write %d audit events", len(batch))
+            # Start the next batch on a fresh connection
+            connection.close()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            # No request cycle runs on this thread to expire its connection,
+            # so drop it here once it is broken or past CONN_MAX_AGE
+            close_old_connections()
+            self._write(batch)
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+
+writer = BufferedWriter()
+atexit.register(writer.flush)
+
+
+def record(action, request=None, actor=None, target="", **detail):
+    """
+    Log a security event. `actor` is the acting user (defaults to the
+    request's authenticated user); `target` names what the action was aimed
+    at; any extra keyword arguments are stored as JSON detail.
+    """
+    if actor is None and request is not None and request.user.is_authenticated:
+        actor = request.user
+    event = AuditEvent(
+        action=action,
+        actor_id=actor.pk if actor is not None else None,
+        ip=client_ip(request) if request is not None else None,
+        target=str(target or "")[:254],
+        detail=detail,
+    )
+    if getattr(settings, "AUDIT_LOG_BUFFERED", True):
+        writer.put(event)
+    else:
+        AuditEvent.objects.bulk_create([event])
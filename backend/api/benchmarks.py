@@ -0,0 +1,278 @@
+"""
+Latency, query-count and throughput benchmarks for the API's hot paths.
+
+`seed` fills an empty database with a configurable volume of users, friends,
+chats, groups and listings around one benchmark user; `run` then replays
+each scenario through the test client against the full middleware and
+authentication stack. Run it through `manage.py benchmark` with
+backend.settings_bench.
+"""
+
+import statistics
+import time
+from collections import namedtuple
+
+import pyotp
+from django.contrib.auth.hashers import make_password
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .cache import catalog_cache
+from .models import (
+    Chat,
+    CustomUser,
+    FriendEdge,
+    Friendship,
+    Group,
+    GroupMessage,
+    MarketPlace,
+    Message,
+)
+
+PASSWORD = "benchmark-password"
+BATCH_SIZE = 500
+
+DEFAULT_VOLUMES = {
+    "users": 500,
+    "friends": 50,
+    "chats": 20,
+    "messages": 50,
+    "groups": 10,
+    "group_size": 20,
+    "group_messages": 20,
+    "items": 1000,
+}
+
+# `request` sends one request with the client; `before` runs untimed first
+Scenario = namedtuple("Scenario", "request expected before", defaults=(None,))
+
+
+def seed(users, friends, chats, messages, groups, group_size, group_messages, items):
+    """
+    Create the benchmark dataset and return the benchmark user and the peer
+    of its first chat. Keys are generated once and shared by every user and
+    group, and each message reuses one ciphertext, so seeding never pays
+    for per-row RSA work.
+    """
+    if not max(friends, chats, group_size) < users:
+        raise ValueError("friends, chats and group_size must be below users.")
+    if chats < 1 or groups < 1:
+        raise ValueError("At least one chat and one group are needed.")
+
+    user = CustomUser.objects.create_user(
+        email="bench@example.com",
+        username="bench",
+        password=PASSWORD,
+        first_name="Bench",
+        last_name="User",
+        is_verified=True,
+        totp_secret=pyotp.random_base32(),
+    )
+    user.generate_keys()
+    password = make_password(PASSWORD)
+    CustomUser.objects.bulk_create(
+        (
+            CustomUser(
+                email=f"user{i}@example.com",
+                username=f"user{i}",
+                first_name=f"First{i}",
+                last_name=f"Last{i}",
+                password=password,
+                is_verified=True,
+                private_key=user.private_key,
+                public_key=user.public_key,
+            )
+            for i in range(users - 1)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    others = list(CustomUser.objects.exclude(pk=user.pk).order_by("id"))
+
+    Friendship.objects.bulk_create(
+        Friendship(user=user, friend=friend, is_accepted=True)
+        for friend in others[:friends]
+    )
+    FriendEdge.objects.bulk_create(
+        [FriendEdge(user=user, friend=friend) for friend in others[:friends]]
+        + [FriendEdge(user=friend, friend=user) for friend in others[:friends]]
+    )
+
+    # The benchmark user has the lowest id, so it is always user1
+    peers = others[:chats]
+    chat_rows = Chat.objects.bulk_create(Chat(user1=user, user2=peer) for peer in peers)
+    content = str(Message.encrypt_message("Benchmark message", user, peers[0]))
+    Message.objects.bulk_create(
+        (
+            Message(
+                chat=chat,
+                sender=user if i % 2 else peer,
+                receiver=peer if i % 2 else user,
+                content=content,
+            )
+            for chat, peer in zip(chat_rows, peers)
+            for i in range(messages)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    keyed = Group(name="Group 0", created_by=user)
+    keyed.generate_keys()
+    group_rows = [keyed] + Group.objects.bulk_create(
+        Group(
+            name=f"Group {i}",
+            created_by=user,
+            private_key=keyed.private_key,
+            public_key=keyed.public_key,
+        )
+        for i in range(1, groups)
+    )
+    member_ids = [user.pk] + [other.pk for other in others[: group_size - 1]]
+    for group in group_rows:
+        group.add_members(member_ids)
+    group_content = str(GroupMessage.encrypt_message("Benchmark message", user, keyed))
+    GroupMessage.objects.bulk_create(
+        (
+            GroupMessage(group=group, sender=user, content=group_content)
+            for group in group_rows
+            for _ in range(group_messages)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    MarketPlace.objects.bulk_create(
+        (
+            MarketPlace(
+                name=f"Item {i}",
+                description="Benchmark listing",
+                created_by=others[i % len(others)],
+                price=str(10 + i % 90),
+                is_sold=i % 10 == 0,
+            )
+            for i in range(items)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    return user, peers[0]
+
+
+def scenarios(user, peer):
+    """Scenario name -> Scenario for the seeded benchmark user"""
+
+    def authenticated(method, path, **kwargs):
+        # A fresh token per request: the access token lifetime is short
+        def request(client):
+            token = AccessToken.for_user(user)
+            return getattr(client, method)(
+                path, HTTP_AUTHORIZATION=f"Bearer {token}", **kwargs
+            )
+
+        return request
+
+    def verify_totp(client):
+        code = pyotp.TOTP(user.totp_secret).now()
+        return client.post(
+            "/api/verify-2fa/",
+            {"email": user.email, "totp_code": code},
+            format="json",
+        )
+
+    return {
+        "message_history": Scenario(
+            authenticated("get", "/api/messages/", data={"receiver": peer.username}),
+            200,
+        ),
+        "chats_and_groups": Scenario(authenticated("get", "/api/allChats/"), 200),
+        "list_users": Scenario(authenticated("get", "/api/users/"), 200),
+        "marketplace_list": Scenario(
+            authenticated("get", "/api/marketplace/"),
+            200,
+            before=catalog_cache.invalidate,
+        ),
+        "marketplace_list_cached": Scenario(
+            authenticated("get", "/api/marketplace/"), 200
+        ),
+        "login": Scenario(
+            lambda client: client.post(
+                "/api/login/",
+                {"email": user.email, "password": PASSWORD},
+                format="json",
+            ),
+            200,
+        ),
+        "verify_totp": Scenario(verify_totp, 200),
+    }
+
+
+def _percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    index = max(0, round(fraction * len(sorted_values) + 0.5) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def run(scenario, iterations, warmup=2):
+    """
+    Send the scenario's request `warmup` times untimed, then `iterations`
+    times, and summarise latency (ms), queries per request and sequential
+    single-client throughput.
+    """
+    client = APIClient()
+    latencies = []
+    queries = []
+    for i in range(warmup + iterations):
+        if scenario.before:
+            scenario.before()
+        # The query log is capped; start each request with an empty one
+        reset_queries()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = scenario.request(client)
+            elapsed = time.perf_counter() - started
+        if response.status_code != scenario.expected:
+            raise RuntimeError(
+                f"Expected HTTP {scenario.expected}, got {response.status_code}: "
+                f"{response.content[:200]!r}"
+            )
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured))
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p95_ms": round(_percentile(latencies, 0.95), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "min_ms": round(latencies[0], 3),
+        "max_ms": round(latencies[-1], 3),
+        "queries": int(statistics.median(queries)),
+        "queries_max": max(queries),
+        "throughput_rps": round(iterations / (sum(latencies) / 1000), 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline run. Returns (lines, regressions): a
+    scenario regresses when its median latency grew by more than
+    `tolerance` (a fraction) or it issues more queries than before.
+    """
+    lines = []
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            lines.append(f"{name}: not in baseline")
+            continue
+        change = current["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] else 0
+        regressed = change > tolerance or current["queries"] > before["queries"]
+        lines.append(
+            f"{name}: p50 {before['p50_ms']:.1f} -> {current['p50_ms']:.1f} ms "
+            f"({change:+.0%}), queries {before['queries']} -> {current['queries']}"
+            + ("  REGRESSION" if regressed else "")
+        )
+        if regressed:
+            regressions.append(name)
+    return lines, regressions
@@ -0,0 +1,159 @@
+"""
+Per-view query budgets.
+
+Views declare how many database queries a request may take, and how many
+of those may repeat a statement already run in the same request (the
+telltale of an N+1 loop):
+
+    class ChatListView(APIView):
+        query_budget = QueryBudget(max_queries=10, max_duplicates=0)
+
+or, for a single method, with the `query_budget` decorator. With
+QUERY_BUDGET_MODE set to "log" or "raise", QueryBudgetMiddleware counts
+the queries of each request to a view with a budget. When a budget is
+exceeded it logs a warning, or raises QueryBudgetExceeded, with each
+duplicated statement and the lines of project code that issued it.
+Statements count as duplicates when their SQL matches, whatever the
+parameters. The mode defaults to "log" with DEBUG on and "off" otherwise;
+when off, the middleware removes itself at startup.
+"""
+
+import logging
+import os
+import traceback
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
+from django.urls import Resolver404, get_resolver
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "log", "raise")
+REPORT_STATEMENTS = 10
+REPORT_SQL_LENGTH = 300
+
+_ignored_files = (os.path.abspath(__file__),)
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    max_queries: int
+    max_duplicates: int = 0
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries, max_duplicates=0):
+    """Give a single view method its own budget"""
+
+    def decorator(func):
+        func.query_budget = QueryBudget(max_queries, max_duplicates)
+        return func
+
+    return decorator
+
+
+def budget_for(request):
+    """The budget declared for the view and method handling `request`"""
+    try:
+        match = get_resolver(getattr(request, "urlconf", None)).resolve(
+            request.path_info
+        )
+    except Resolver404:
+        return None
+    view_class = getattr(match.func, "view_class", None)
+    if view_class is None:
+        return getattr(match.func, "query_budget", None)
+    handler = getattr(view_class, request.method.lower(), None)
+    return getattr(handler, "query_budget", None) or getattr(
+        view_class, "query_budget", None
+    )
+
+
+def _call_site():
+    """The innermost frame of project code, outside installed packages"""
+    root = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        filename = frame.filename
+        if (
+            filename.startswith(root)
+            and "site-packages" not in filename
+            and filename not in _ignored_files
+        ):
+            path = os.path.relpath(filename, root)
+            return f"{path}:{frame.lineno} in {frame.name}"
+    return "<outside project code>"
+
+
+class QueryLog:
+    """Statements run during one request, with the call sites of each"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = Counter()
+        self.sites = defaultdict(Counter)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.statements[sql] += 1
+        self.sites[sql][_call_site()] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def duplicates(self):
+        return self.count - len(self.statements)
+
+    def report(self, label, budget):
+        lines = [
+            f"{label} ran {self.count} queries ({self.duplicates} duplicates); "
+            f"budget is {budget.max_queries} queries "
+            f"({budget.max_duplicates} duplicates)."
+        ]
+        repeated = [
+            (sql, count) for sql, count in self.statements.most_common() if count > 1
+        ]
+        for sql, count in repeated[:REPORT_STATEMENTS]:
+            shown = sql
+            if len(shown) > REPORT_SQL_LENGTH:
+                shown = shown[:REPORT_SQL_LENGTH] + "..."
+            lines.append(f"  {count}x {shown}")
+            for site, site_count in self.sites[sql].most_common():
+                lines.append(f"      {site_count}x {site}")
+        if len(repeated) > REPORT_STATEMENTS:
+            lines.append(f"  ... {len(repeated) - REPORT_STATEMENTS} more")
+        return "\n".join(lines)
+
+
+class QueryBudgetMiddleware:
+    """Place last in MIDDLEWARE, so that only the view's queries are counted"""
+
+    def __init__(self, get_response):
+        self.mode = getattr(
+            settings, "QUERY_BUDGET_MODE", "log" if settings.DEBUG else "off"
+        )
+        if self.mode not in MODES:
+            raise ImproperlyConfigured(
+                f"QUERY_BUDGET_MODE must be one of {', '.join(MODES)}"
+            )
+        if self.mode == "off":
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        budget = budget_for(request)
+        if budget is None:
+            return self.get_response(request)
+        log = QueryLog()
+        with connections["default"].execute_wrapper(log):
+            response = self.get_response(request)
+        if log.count > budget.max_queries or log.duplicates > budget.max_duplicates:
+            report = log.report(f"{request.method} {request.path}", budget)
+            if self.mode == "raise":
+                raise QueryBudgetExceeded(report)
+            logger.warning("Query budget exceeded: %s", report)
+        return response
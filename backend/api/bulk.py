@@ -0,0 +1,277 @@
+import csv
+import io
+import json
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+
+from . import stats
+from .cache import catalog_cache
+from .exports import keyset_values
+from .models import CustomUser, MarketPlace, MarketPlaceChange
+from .storage import (
+    InlineImage,
+    decode_inline_image,
+    inline_image_reference,
+    marketplace_image_url,
+    store_images_on_commit,
+)
+
+IMPORT_FORMATS = ("csv", "ndjson")
+EXPORT_FIELDS = [
+    "id",
+    "name",
+    "description",
+    "price",
+    "image",
+    "upi_id",
+    "created_by",
+    "is_sold",
+    "created_at",
+]
+
+# Keep IN (...) lists below SQLite's default limit of 999 parameters
+LOOKUP_CHUNK_SIZE = 900
+
+TRUE_VALUES = {"1", "true", "yes", "y"}
+FALSE_VALUES = {"", "0", "false", "no", "n"}
+
+
+def _field_limit(name):
+    return MarketPlace._meta.get_field(name).max_length
+
+
+def _chunks(values, size=LOOKUP_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def read_rows(stream, data_format):
+    """Parse an uploaded binary stream into row dicts, one at a time"""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if data_format == "csv":
+        yield from csv.DictReader(text)
+    elif data_format == "ndjson":
+        for line in text:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {"__error__": f"Invalid JSON: {str(e)}"}
+            if not isinstance(row, dict):
+                row = {"__error__": "Each line must be a JSON object."}
+            yield row
+    else:
+        raise ValueError(f"Unsupported import format: {data_format}")
+
+
+def _clean_row(row):
+    """Validate one row without touching the database; returns (data, errors)"""
+    if "__error__" in row:
+        return None, [row["__error__"]]
+
+    errors = []
+    data = {}
+    for field, required in (
+        ("name", True),
+        ("description", False),
+        ("price", False),
+        ("upi_id", True),
+    ):
+        value = row.get(field)
+        value = "" if value is None else str(value).strip()
+        if required and not value:
+            errors.append(f"{field}: This field is required.")
+        limit = _field_limit(field)
+        if limit and len(value) > limit:
+            errors.append(
+                f"{field}: Ensure this field has at most {limit} characters."
+            )
+        data[field] = value
+
+    is_sold = row.get("is_sold")
+    if isinstance(is_sold, bool):
+        data["is_sold"] = is_sold
+    elif str(is_sold or "").strip().lower() in TRUE_VALUES:
+        data["is_sold"] = True
+    elif str(is_sold or "").strip().lower() in FALSE_VALUES:
+        data["is_sold"] = False
+    else:
+        errors.append("is_sold: Must be a boolean.")
+
+    image = row.get("image") or None
+    if image:
+        # Inline images are decoded and verified here but only written to
+        # storage once the import commits
+        image = str(image).strip()
+        try:
+            image = decode_inline_image(image) or image
+        except ValueError as e:
+            errors.append(f"image: {str(e)}")
+        else:
+            if isinstance(image, str) and len(image) > _field_limit("image"):
+                errors.append("image: Image URL is too long.")
+    data["image"] = image
+
+    data["created_by"] = str(row.get("created_by") or "").strip()
+    return data, errors
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, row_number, messages):
+        self.errors.append({"row": row_number, "errors": messages})
+
+    def as_dict(self):
+        return {
+            "created": self.created,
+            "failed": len(self.errors),
+            "errors": self.errors,
+        }
+
+
+def _read_back_ids(chunk, last_id):
+    """
+    Set the ids of rows just inserted by one bulk_create on backends such as
+    MySQL that don't report them. A multi-row INSERT assigns increasing ids
+    in row order, so the chunk's rows read back in id order line up with it.
+    """
+    ids = list(
+        MarketPlace.objects.filter(
+            id__gt=last_id,
+            created_by_id__in={item.created_by_id for item in chunk},
+            name__in=[item.name for item in chunk],
+        )
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    if len(ids) != len(chunk):
+        raise IntegrityError("Listings with the same names were created meanwhile.")
+    for item, item_id in zip(chunk, ids):
+        item.pk = item_id
+
+
+def import_listings(rows, seller=None, chunk_size=1000, strict=False, dry_run=False):
+    """
+    Validate and insert marketplace rows in bulk.
+
+    Field checks run per row in Python; seller and name-uniqueness checks
+    run as a handful of set-based queries over the whole file. Valid rows
+    are inserted with bulk_create in chunks inside a single transaction.
+    When `seller` is given every row is created for that user, otherwise
+    rows name their seller in a `created_by` column. With `strict`, any
+    invalid row aborts the whole import.
+    """
+    result = ImportResult()
+    candidates = []
+    for row_number, row in enumerate(rows, start=1):
+        data, errors = _clean_row(row)
+        if errors:
+            result.add_error(row_number, errors)
+        else:
+            candidates.append((row_number, data))
+
+    # Resolve sellers in one query per chunk of usernames
+    if seller is None:
+        usernames = {data["created_by"] for _, data in candidates}
+        sellers = {}
+        for chunk in _chunks(usernames - {""}):
+            for user in CustomUser.objects.filter(username__in=chunk).only(
+                "id", "username", "is_verified"
+            ):
+                sellers[user.username] = user
+
+    # Find names already taken, again one query per chunk
+    names = [data["name"] for _, data in candidates]
+    taken = set()
+    for chunk in _chunks(set(names)):
+        taken.update(
+            MarketPlace.objects.filter(name__in=chunk).values_list("name", flat=True)
+        )
+
+    valid = []
+    seen_names = set()
+    for row_number, data in candidates:
+        errors = []
+        owner = seller
+        if owner is None:
+            owner = sellers.get(data["created_by"])
+            if not data["created_by"]:
+                errors.append("created_by: This field is required.")
+            elif owner is None:
+                errors.append("created_by: User does not exist.")
+        if owner is not None and not owner.is_verified:
+            errors.append("created_by: User is not verified.")
+        if data["name"] in taken or data["name"] in seen_names:
+            errors.append("name: Marketplace item with this name already exists.")
+        seen_names.add(data["name"])
+
+        if errors:
+            result.add_error(row_number, errors)
+            continue
+        data.pop("created_by")
+        valid.append(MarketPlace(created_by=owner, **data))
+    result.errors.sort(key=lambda error: error["row"])
+
+    if dry_run or (strict and result.errors) or not valid:
+        return result
+
+    returns_ids = connection.features.can_return_rows_from_bulk_insert
+    images = {}
+    with transaction.atomic():
+        for chunk in _chunks(valid, chunk_size):
+            for item in chunk:
+                if isinstance(item.image, InlineImage):
+                    # Files are written only once the rows commit
+                    name, data = inline_image_reference(item.image)
+                    images[name] = data
+                    item.image = name
+                    item.image_variants_ready = False
+            if not returns_ids:
+                last_id = MarketPlace.objects.aggregate(last_id=Max("id"))["last_id"]
+            MarketPlace.objects.bulk_create(chunk)
+            if not returns_ids:
+                _read_back_ids(chunk, last_id or 0)
+            MarketPlaceChange.objects.bulk_create(
+                MarketPlaceChange(item_id=item.pk, action=MarketPlaceChange.CREATED)
+                for item in chunk
+            )
+        store_images_on_commit(images)
+        # bulk_create doesn't send post_save, so update what the signals would
+        sold = sum(item.is_sold for item in valid)
+        stats.adjust(
+            totals={stats.ITEMS: len(valid), stats.SOLD_ITEMS: sold},
+            daily={stats.LISTINGS_CREATED: len(valid)},
+        )
+        transaction.on_commit(catalog_cache.invalidate)
+
+    result.created = len(valid)
+    return result
+
+
+def export_rows(queryset, request=None):
+    """Lazily yield export dicts for a MarketPlace queryset"""
+    rows = keyset_values(
+        queryset,
+        [
+            "id",
+            "name",
+            "description",
+            "price",
+            "image",
+            "upi_id",
+            "created_by__username",
+            "is_sold",
+            "created_at",
+        ],
+    )
+    for row in rows:
+        data = dict(zip(EXPORT_FIELDS, row))
+        data["image"] = marketplace_image_url(data["image"], request)
+        yield data
@@ -0,0 +1,108 @@
+import hashlib
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+
+
+class SharedResponseCache:
+    """
+    Cache of serialized response bodies shared by all users.
+
+    Entries are keyed by a generation number plus the request parameters.
+    `invalidate()` bumps the generation, which orphans every entry at once
+    without having to know their keys. When an entry is missing only one
+    caller rebuilds it; concurrent callers wait briefly for that result
+    instead of all hitting the database at the same time.
+    """
+
+    def __init__(self, namespace, timeout=300, lock_timeout=10, wait_timeout=2.0):
+        self.namespace = namespace
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = 0.05
+        self._stats_lock = threading.Lock()
+        self._stats = dict.fromkeys(
+            ["hits", "misses", "rebuilds", "waits", "wait_timeouts", "invalidations"],
+            0,
+        )
+
+    @property
+    def generation_key(self):
+        return f"{self.namespace}:generation"
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _generation(self):
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            # Start from a fresh, never used value if the key was evicted so
+            # entries from an older generation can't be picked up again
+            cache.add(self.generation_key, time.time_ns(), timeout=None)
+            generation = cache.get(self.generation_key)
+        return generation
+
+    def key_for(self, params):
+        encoded = urlencode(sorted(params.items()), doseq=True)
+        digest = hashlib.md5(encoded.encode(), usedforsecurity=False).hexdigest()
+        return f"{self.namespace}:{self._generation()}:{digest}"
+
+    def get_or_build(self, params, builder):
+        key = self.key_for(params)
+        value = cache.get(key)
+        if value is not None:
+            self._count("hits")
+            return value
+        self._count("misses")
+
+        lock_key = f"{key}:lock"
+        if cache.add(lock_key, 1, timeout=self.lock_timeout):
+            try:
+                value = builder()
+                cache.set(key, value, timeout=self.timeout)
+                self._count("rebuilds")
+            finally:
+                cache.delete(lock_key)
+            return value
+
+        # Another worker is rebuilding this entry; wait for its result
+        self._count("waits")
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        self._count("wait_timeouts")
+        return builder()
+
+    def invalidate(self):
+        self._count("invalidations")
+        try:
+            cache.incr(self.generation_key)
+        except ValueError:
+            cache.set(self.generation_key, time.time_ns(), timeout=None)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        return stats
+
+
+# Serialized marketplace listings; identical for every user
+catalog_cache = SharedResponseCache("marketplace:catalog")
+
+
+def catalog_cache_params(request, view_name):
+    """Cache key parameters for a catalog request"""
+    params = {key: request.query_params.getlist(key) for key in request.query_params}
+    # Image URLs are absolute, so responses differ per host
+    params["_host"] = request.get_host()
+    params["_view"] = view_name
+    return params
@@ -0,0 +1,44 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+
+def conditional_get(method):
+    """
+    Decorator for APIView.get implementing conditional GET.
+
+    The view provides `get_version(request, *args, **kwargs)` returning
+    `(last_modified, parts)`: the newest modification time in the response's
+    scope (or None) and a tuple of cheap aggregates (counts, max ids...)
+    that change whenever the response would. Both are computed without
+    serializing anything; a matching If-None-Match / If-Modified-Since
+    short-circuits to 304 Not Modified, otherwise ETag and Last-Modified
+    are attached to the full response.
+    """
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        last_modified, parts = self.get_version(request, *args, **kwargs)
+        # Responses are scoped per user, so the user is part of the version
+        token = repr((request.user.pk, last_modified, tuple(parts)))
+        etag = '"%s"' % hashlib.md5(token.encode(), usedforsecurity=False).hexdigest()
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp
+        )
+        if response is None:
+            response = method(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response["ETag"] = etag
+        if timestamp is not None:
+            response["Last-Modified"] = http_date(timestamp)
+        # Clients may keep the copy but must revalidate it on every use
+        response["Cache-Control"] = "private, no-cache"
+        patch_vary_headers(response, ["Authorization"])
+        return response
+
+    return wrapper
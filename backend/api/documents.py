@@ -0,0 +1,188 @@
+"""
+Encrypted, resumable storage for identity documents.
+
+Every chunk a client uploads is encrypted on its own with AES-GCM and
+appended to the document's file as one record:
+
+    nonce (12 bytes) | plaintext length (8 bytes) | ciphertext | tag (16 bytes)
+
+The upload id and the chunk's plaintext offset are authenticated with each
+record, so records can't be reordered or moved between files. Request
+bodies are encrypted, and files decrypted, in PIECE_SIZE pieces, so memory
+use per request stays constant whatever the chunk or file size.
+
+Writers hold an exclusive advisory lock on the file rather than a row lock,
+so no transaction stays open while a chunk streams in.
+"""
+
+import base64
+import fcntl
+import functools
+import hashlib
+import os
+import struct
+from contextlib import contextmanager
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from django.conf import settings
+
+PIECE_SIZE = 64 * 1024
+NONCE_SIZE = 12
+TAG_SIZE = 16
+LENGTH = struct.Struct(">Q")
+
+ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png", "application/pdf"}
+MAX_SIZE = getattr(settings, "DOCUMENT_MAX_SIZE", 20 * 1024 * 1024)
+MAX_CHUNK_SIZE = getattr(settings, "DOCUMENT_MAX_CHUNK_SIZE", 8 * 1024 * 1024)
+MAX_OPEN_UPLOADS = getattr(settings, "DOCUMENT_MAX_OPEN_UPLOADS", 3)
+UPLOAD_EXPIRY_HOURS = getattr(settings, "DOCUMENT_UPLOAD_EXPIRY_HOURS", 24)
+DOCUMENT_ROOT = getattr(
+    settings, "DOCUMENT_ROOT", os.path.join(settings.MEDIA_ROOT, "documents")
+)
+
+
+class OffsetMismatch(ValueError):
+    """A chunk didn't start where the previous one ended"""
+
+
+class UploadBusy(Exception):
+    """Another request is writing to the same upload"""
+
+
+@functools.lru_cache(maxsize=1)
+def _key():
+    configured = getattr(settings, "DOCUMENT_ENCRYPTION_KEY", "")
+    if configured:
+        key = base64.urlsafe_b64decode(configured)
+        if len(key) != 32:
+            raise ValueError("DOCUMENT_ENCRYPTION_KEY must encode 32 bytes.")
+        return key
+    # Without a dedicated key, derive one from SECRET_KEY
+    return HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=None, info=b"api.documents"
+    ).derive(settings.SECRET_KEY.encode())
+
+
+def _associated_data(document, offset):
+    return f"{document.upload_id}:{offset}".encode()
+
+
+def document_path(document):
+    return os.path.join(DOCUMENT_ROOT, f"{document.upload_id}.enc")
+
+
+def validate_upload(content_type, size):
+    """Check the metadata a client declares when starting an upload"""
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        allowed = ", ".join(sorted(ALLOWED_CONTENT_TYPES))
+        raise ValueError(f"Unsupported content type. Allowed: {allowed}.")
+    if size <= 0 or size > MAX_SIZE:
+        raise ValueError(f"size must be between 1 and {MAX_SIZE} bytes.")
+
+
+@contextmanager
+def locked_file(document):
+    """
+    Open the document's file for writing, creating it if needed, under an
+    exclusive lock. Raises UploadBusy rather than wait for another holder.
+    """
+    path = document_path(document)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), "r+b") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadBusy("Another chunk of this upload is being written.")
+        # Closing the file releases the lock
+        yield f
+
+
+def append_chunk(document, f, stream, offset, length):
+    """
+    Read `length` bytes from `stream`, encrypt them and append them to the
+    document's file `f`, opened with locked_file, as one record. Updates
+    `received` and `stored_size`; the caller saves the document afterwards.
+    """
+    if offset != document.received:
+        raise OffsetMismatch(f"Expected offset {document.received}.")
+    if length <= 0:
+        raise ValueError("Chunk is empty.")
+    if length > MAX_CHUNK_SIZE:
+        raise ValueError(f"Chunks may be at most {MAX_CHUNK_SIZE} bytes.")
+    if offset + length > document.size:
+        raise ValueError("Chunk extends past the declared document size.")
+
+    nonce = os.urandom(NONCE_SIZE)
+    encryptor = Cipher(algorithms.AES(_key()), modes.GCM(nonce)).encryptor()
+    encryptor.authenticate_additional_data(_associated_data(document, offset))
+
+    # Anything past the stored size is left over from an interrupted chunk
+    f.seek(document.stored_size)
+    f.truncate()
+    f.write(nonce + LENGTH.pack(length))
+    remaining = length
+    while remaining:
+        piece = stream.read(min(PIECE_SIZE, remaining))
+        if not piece:
+            f.truncate(document.stored_size)
+            raise ValueError("Request body ended before Content-Length bytes.")
+        f.write(encryptor.update(piece))
+        remaining -= len(piece)
+    f.write(encryptor.finalize() + encryptor.tag)
+    f.flush()
+    document.stored_size = f.tell()
+    document.received += length
+
+
+def iter_plaintext(document):
+    """
+    Yield the decrypted document in pieces. Each record's tag is checked
+    once the record has been read, raising InvalidTag on tampering; uploads
+    are fully verified by finish_upload before they reach review.
+    """
+    with open(document_path(document), "rb") as f:
+        offset = 0
+        while offset < document.received:
+            header = f.read(NONCE_SIZE + LENGTH.size)
+            if len(header) < NONCE_SIZE + LENGTH.size:
+                raise ValueError("Stored document is truncated.")
+            nonce = header[:NONCE_SIZE]
+            (length,) = LENGTH.unpack(header[NONCE_SIZE:])
+            decryptor = Cipher(algorithms.AES(_key()), modes.GCM(nonce)).decryptor()
+            decryptor.authenticate_additional_data(
+                _associated_data(document, offset)
+            )
+            remaining = length
+            while remaining:
+                piece = f.read(min(PIECE_SIZE, remaining))
+                if not piece:
+                    raise ValueError("Stored document is truncated.")
+                yield decryptor.update(piece)
+                remaining -= len(piece)
+            decryptor.finalize_with_tag(f.read(TAG_SIZE))
+            offset += length
+
+
+def finish_upload(document):
+    """Verify every stored record and return the plaintext's SHA-256"""
+    if document.received != document.size:
+        raise ValueError(
+            f"Upload incomplete: {document.received} of {document.size} bytes."
+        )
+    digest = hashlib.sha256()
+    try:
+        for piece in iter_plaintext(document):
+            digest.update(piece)
+    except InvalidTag:
+        raise ValueError("Stored document failed its integrity check.")
+    return digest.hexdigest()
+
+
+def delete_file(document):
+    try:
+        os.remove(document_path(document))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,134 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+
+from . import suggestions
+from .models import CustomUser, FriendEdge, Friendship, FriendSuggestion
+
+FRIEND_IDS_TIMEOUT = 60 * 60
+# Keep IN (...) lists below SQLite's default limit of 999 parameters
+LOOKUP_CHUNK_SIZE = 900
+# Above this many accepted requests in one call, mutual-friend counts are
+# left to the next compute_friend_suggestions run instead of being adjusted
+# pair by pair inside the request
+SUGGESTION_SYNC_LIMIT = 200
+
+
+def _friend_ids_key(user_id):
+    return f"friends:{user_id}:ids"
+
+
+def _chunks(values, size=LOOKUP_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def get_friend_ids(user):
+    """
+    Ids of the user's accepted friends, cached per user. Sets are stored
+    with the friends_version of the user row they were read for, so a
+    worker whose local cache missed an invalidation still won't use a set
+    older than the freshly loaded user.
+    """
+    key = _friend_ids_key(user.pk)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == user.friends_version:
+        return cached[1]
+    friend_ids = frozenset(
+        FriendEdge.objects.filter(user_id=user.pk).values_list("friend_id", flat=True)
+    )
+    cache.set(key, (user.friends_version, friend_ids), timeout=FRIEND_IDS_TIMEOUT)
+    return friend_ids
+
+
+def invalidate_friend_ids(*user_ids):
+    """
+    Bump the users' friends_version. Call it inside the transaction that
+    changes their friendships; this worker's entries go once it commits.
+    """
+    user_ids = set(user_ids)
+    for chunk in _chunks(user_ids):
+        CustomUser.objects.filter(pk__in=chunk).update(
+            friends_version=F("friends_version") + 1
+        )
+    keys = [_friend_ids_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _pending_requester_ids(user, requester_ids):
+    """Lock and return the ids of users with a pending request to `user`"""
+    pending = Friendship.objects.select_for_update().filter(
+        friend=user, is_accepted=False
+    )
+    if requester_ids is None:
+        return list(pending.values_list("user_id", flat=True))
+    found = []
+    for chunk in _chunks(set(requester_ids)):
+        found.extend(
+            pending.filter(user_id__in=chunk).values_list("user_id", flat=True)
+        )
+    return found
+
+
+def accept_requests(user, requester_ids=None):
+    """
+    Accept pending requests sent to `user`, or all of them when no ids are
+    given, and return the ids of the accepted requesters.
+
+    The pending rows are locked first, so of two concurrent accepts of the
+    same request only one performs the transition.
+    """
+    with transaction.atomic():
+        accepted = _pending_requester_ids(user, requester_ids)
+        if not accepted:
+            return []
+        for chunk in _chunks(accepted):
+            Friendship.objects.filter(
+                friend=user, is_accepted=False, user_id__in=chunk
+            ).update(is_accepted=True)
+        if len(accepted) <= SUGGESTION_SYNC_LIMIT:
+            # Each incremental update expects only its own pair's edges to be new
+            for requester_id in accepted:
+                FriendEdge.connect(user.pk, requester_id)
+                suggestions.record_friendship(user.pk, requester_id)
+        else:
+            FriendEdge.objects.bulk_create(
+                [
+                    edge
+                    for requester_id in accepted
+                    for edge in (
+                        FriendEdge(user_id=user.pk, friend_id=requester_id),
+                        FriendEdge(user_id=requester_id, friend_id=user.pk),
+                    )
+                ],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            # New friends must never be suggested to each other; the mutual
+            # counts catch up on the next batch run
+            for chunk in _chunks(accepted):
+                FriendSuggestion.objects.filter(
+                    Q(user_id=user.pk, suggested_id__in=chunk)
+                    | Q(user_id__in=chunk, suggested_id=user.pk)
+                ).delete()
+        # update() doesn't send post_save, so move the cached sets on here
+        invalidate_friend_ids(user.pk, *accepted)
+    return accepted
+
+
+def decline_requests(user, requester_ids=None):
+    """
+    Delete pending requests sent to `user`, or all of them when no ids are
+    given, and return how many were declined.
+    """
+    declined = 0
+    with transaction.atomic():
+        pending = Friendship.objects.filter(friend=user, is_accepted=False)
+        if requester_ids is None:
+            declined, _ = pending.delete()
+        else:
+            for chunk in _chunks(set(requester_ids)):
+                count, _ = pending.filter(user_id__in=chunk).delete()
+                declined += count
+    return declined
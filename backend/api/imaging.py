@@ -0,0 +1,173 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Fixed-size variants generated for every uploaded image: name -> (width, height)
+IMAGE_VARIANTS = {
+    "thumb": (64, 64),
+    "small": (160, 160),
+    "medium": (480, 480),
+}
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+DEFAULT_VARIANT = "small"
+DEFAULT_FORMAT = "webp"
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "IMAGE_VARIANT_WORKERS", 2),
+    thread_name_prefix="image-variants",
+)
+
+
+def variant_name(original_name, variant, extension):
+    """Storage name of one variant, e.g. variants/profile_pictures/me/thumb.webp"""
+    stem, _ = os.path.splitext(original_name)
+    return f"variants/{stem}/{variant}.{extension}"
+
+
+def generate_variants(original_name, storage=default_storage):
+    """Render every fixed-size variant of a stored image"""
+    with storage.open(original_name, "rb") as f:
+        source = Image.open(f)
+        source.load()
+
+    # Apply the EXIF orientation before discarding the metadata
+    source = ImageOps.exif_transpose(source)
+    if source.mode not in ("RGB", "RGBA"):
+        source = source.convert("RGBA" if "transparency" in source.info else "RGB")
+
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = ImageOps.fit(source, size, Image.Resampling.LANCZOS)
+        for extension, (image_format, options) in VARIANT_FORMATS.items():
+            image = resized
+            if image_format == "JPEG" and image.mode != "RGB":
+                image = image.convert("RGB")
+            # A freshly rendered image carries no EXIF/ICC/XMP metadata,
+            # and none is passed to save()
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format, **options)
+            name = variant_name(original_name, variant, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+    mark_variants_ready(original_name)
+
+
+def mark_variants_ready(original_name):
+    """
+    Record on the rows showing an image that its variants exist, so lists
+    need not ask the storage backend row by row
+    """
+    from .cache import catalog_cache
+    from .models import CustomUser, MarketPlace
+
+    # update() skips auto_now; bump updated_at so conditional GETs see the URLs
+    now = timezone.now()
+    CustomUser.objects.filter(profile_picture=original_name).update(
+        profile_picture_variants_ready=True, updated_at=now
+    )
+    updated = MarketPlace.objects.filter(image=original_name).update(
+        image_variants_ready=True, updated_at=now
+    )
+    if updated:
+        # Nor does it send the signals that drop cached catalog pages
+        transaction.on_commit(catalog_cache.invalidate)
+
+
+def strip_metadata(data):
+    """
+    Re-encode image bytes without their EXIF (including GPS position) and
+    XMP metadata, applying the EXIF orientation first. Images carrying
+    neither are returned unchanged.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if not (image.getexif() or "xmp" in image.info):
+            return data
+        image_format = image.format
+        icc_profile = image.info.get("icc_profile")
+        buffer = io.BytesIO()
+        if getattr(image, "is_animated", False):
+            # Frames are kept as they are; only the metadata goes
+            image.info.pop("exif", None)
+            image.info.pop("xmp", None)
+            image.save(buffer, format=image_format, save_all=True)
+        else:
+            cleaned = ImageOps.exif_transpose(image)
+            cleaned.info = {}
+            options = {"icc_profile": icc_profile} if icc_profile else {}
+            if image_format in ("JPEG", "WEBP"):
+                options["quality"] = 95
+            cleaned.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def delete_variants(original_name, storage=default_storage):
+    """Remove every generated variant of an image"""
+    for variant in IMAGE_VARIANTS:
+        for extension in VARIANT_FORMATS:
+            name = variant_name(original_name, variant, extension)
+            if storage.exists(name):
+                storage.delete(name)
+
+
+def _generate_safely(original_name, storage):
+    try:
+        generate_variants(original_name, storage)
+    except Exception:
+        logger.exception("Failed to generate image variants for %s", original_name)
+    finally:
+        # Pool threads outlive requests; don't let their connections go stale
+        connection.close()
+
+
+def schedule_variants(original_name, storage=default_storage):
+    """
+    Queue variant generation in the worker pool once the current transaction
+    commits, so requests never wait on image resizing.
+    """
+    if not original_name:
+        return
+    transaction.on_commit(
+        lambda: _executor.submit(_generate_safely, original_name, storage)
+    )
+
+
+def variant_urls(original_name, ready, request=None, storage=default_storage):
+    """
+    URLs of all generated variants keyed by variant and format, or None when
+    the row does not record its variants as ready yet.
+    """
+    if not (original_name and ready):
+        return None
+    urls = {}
+    for variant in IMAGE_VARIANTS:
+        urls[variant] = {}
+        for extension in VARIANT_FORMATS:
+            url = storage.url(variant_name(original_name, variant, extension))
+            if request:
+                url = request.build_absolute_uri(url)
+            urls[variant][extension] = url
+    return urls
+
+
+def preferred_variant_url(original_name, ready, request=None, storage=default_storage):
+    """URL of the default list-size variant, falling back to the original"""
+    urls = variant_urls(original_name, ready, request, storage)
+    if urls:
+        return urls[DEFAULT_VARIANT][DEFAULT_FORMAT]
+    if not original_name:
+        return None
+    url = storage.url(original_name)
+    return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,136 @@
+import json
+import platform
+import time
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a disposable database and measure latency, query count and "
+        "throughput of the API's hot paths. Run with "
+        "--settings=backend.settings_bench; results can be written as JSON "
+        "and compared against an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in benchmarks.DEFAULT_VOLUMES.items():
+            parser.add_argument(
+                f"--{name.replace('_', '-')}",
+                type=int,
+                default=default,
+                help=f"Number of {name.replace('_', ' ')} to seed (default {default}).",
+            )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=20,
+            help="Timed requests per scenario.",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=2,
+            help="Untimed requests per scenario before measuring.",
+        )
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            dest="selected",
+            help="Only run this scenario; repeat for several.",
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument(
+            "--compare",
+            help="Compare with the JSON results of an earlier run and fail on "
+            "regressions.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed growth of median latency before --compare fails "
+            "(default 0.25 = 25%%).",
+        )
+
+    def handle(self, *args, **options):
+        if not getattr(settings, "BENCHMARK", False):
+            raise CommandError(
+                "The benchmark flushes the database; run it with "
+                "--settings=backend.settings_bench."
+            )
+        volumes = {name: options[name] for name in benchmarks.DEFAULT_VOLUMES}
+
+        call_command("migrate", run_syncdb=True, verbosity=0)
+        call_command("flush", interactive=False, verbosity=0)
+        started = time.perf_counter()
+        try:
+            user, peer = benchmarks.seed(**volumes)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+        available = benchmarks.scenarios(user, peer)
+        selected = options["selected"] or list(available)
+        unknown = set(selected) - set(available)
+        if unknown:
+            raise CommandError(
+                f"Unknown scenario(s): {', '.join(sorted(unknown))}. "
+                f"Available: {', '.join(available)}."
+            )
+
+        results = {}
+        for name in selected:
+            try:
+                result = benchmarks.run(
+                    available[name], options["iterations"], options["warmup"]
+                )
+            except RuntimeError as e:
+                raise CommandError(f"{name}: {e}")
+            results[name] = result
+            self.stdout.write(
+                f"{name:<24} p50 {result['p50_ms']:8.2f} ms  "
+                f"p95 {result['p95_ms']:8.2f} ms  "
+                f"{result['queries']:4d} queries  "
+                f"{result['throughput_rps']:8.1f} req/s"
+            )
+
+        if options["output"]:
+            report = {
+                "created_at": timezone.now().isoformat(),
+                "environment": {
+                    "python": platform.python_version(),
+                    "django": django.get_version(),
+                    "database": connection.vendor,
+                    "machine": platform.machine(),
+                },
+                "volumes": volumes,
+                "iterations": options["iterations"],
+                "results": results,
+            }
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+            if baseline.get("volumes") != volumes:
+                self.stdout.write(
+                    self.style.WARNING("Baseline was seeded with different volumes")
+                )
+            lines, regressions = benchmarks.compare(
+                results, baseline["results"], options["tolerance"]
+            )
+            for line in lines:
+                self.stdout.write(line)
+            if regressions:
+                raise CommandError(f"Regressed: {', '.join(regressions)}")
+            self.stdout.write(self.style.SUCCESS("No regressions"))
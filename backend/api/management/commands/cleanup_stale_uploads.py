@@ -0,0 +1,84 @@
+import os
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import documents
+from api.models import DocumentVerification
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete document uploads left unfinished past the expiry period, and "
+        "encrypted files that no upload refers to."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=documents.UPLOAD_EXPIRY_HOURS,
+            help="Remove uploads started more than this many hours ago.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        stale = DocumentVerification.objects.filter(
+            status=DocumentVerification.UPLOADING, created_at__lt=cutoff
+        )
+        deleted = busy = 0
+        for document in stale.iterator():
+            try:
+                with documents.locked_file(document):
+                    documents.delete_file(document)
+                    document.delete()
+                deleted += 1
+            except documents.UploadBusy:
+                # A chunk is arriving right now; leave it for the next run
+                busy += 1
+
+        # Files of uploads whose row is gone, e.g. after a crash between
+        # creating the file and recording the first chunk
+        try:
+            names = os.listdir(documents.DOCUMENT_ROOT)
+        except FileNotFoundError:
+            names = []
+        candidates = {}
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            path = os.path.join(documents.DOCUMENT_ROOT, name)
+            if extension != ".enc":
+                continue
+            try:
+                upload_id = uuid.UUID(stem)
+                # Recent files may belong to an upload still being created
+                if os.path.getmtime(path) >= cutoff.timestamp():
+                    continue
+            except (ValueError, FileNotFoundError):
+                continue
+            candidates[upload_id] = path
+
+        orphans = 0
+        upload_ids = list(candidates)
+        for start in range(0, len(upload_ids), 900):
+            chunk = upload_ids[start : start + 900]
+            known = set(
+                DocumentVerification.objects.filter(upload_id__in=chunk).values_list(
+                    "upload_id", flat=True
+                )
+            )
+            for upload_id in set(chunk) - known:
+                try:
+                    os.remove(candidates[upload_id])
+                except FileNotFoundError:
+                    continue
+                orphans += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Deleted {deleted} stale uploads and {orphans} orphaned files"
+                + (f"; {busy} busy uploads skipped" if busy else "")
+            )
+        )
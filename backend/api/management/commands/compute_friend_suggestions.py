@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.suggestions import DEFAULT_TOP_K, compute_all, sparse
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute friend-of-friend suggestions for every user from the "
+        "friendship graph. Run periodically; friendship changes keep the "
+        "table approximately current in between."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+        parser.add_argument(
+            "--no-scipy",
+            action="store_true",
+            help="Use the pure Python implementation even if SciPy is installed.",
+        )
+
+    def handle(self, *args, **options):
+        use_scipy = not options["no_scipy"]
+        if use_scipy and sparse is None:
+            self.stderr.write("SciPy is not installed; using the Python fallback.")
+            use_scipy = False
+
+        started = time.perf_counter()
+        written = compute_all(top_k=options["top_k"], use_scipy=use_scipy)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {written} suggestions in {elapsed:.2f}s")
+        )
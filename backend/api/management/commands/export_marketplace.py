@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.bulk import EXPORT_FIELDS, export_rows
+from api.exports import EXPORT_FORMATS, export_lines
+from api.models import MarketPlace
+
+
+class Command(BaseCommand):
+    help = "Export marketplace listings as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            dest="data_format",
+            choices=list(EXPORT_FORMATS),
+            default="csv",
+        )
+        parser.add_argument(
+            "--output", help="File to write to; defaults to standard output."
+        )
+
+    def handle(self, *args, **options):
+        lines = export_lines(
+            EXPORT_FIELDS, export_rows(MarketPlace.objects.all()), options["data_format"]
+        )
+        if options["output"]:
+            with open(options["output"], "w", newline="", encoding="utf-8") as f:
+                f.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import catalog_cache
+from api.models import MarketPlace
+from api.storage import decode_inline_image, save_inline_image
+
+
+class Command(BaseCommand):
+    help = (
+        "Move inline (data URI) marketplace images out of the database rows "
+        "into content-addressed storage under MEDIA_ROOT. Run this before "
+        "applying the migration that shrinks MarketPlace.image to a reference."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Number of rows loaded and updated per batch.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be extracted without writing anything.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+
+        last_id = 0
+        extracted = failed = 0
+        while True:
+            # Only the id and image columns are loaded, one batch at a time,
+            # so memory stays bounded no matter how large the inline images are.
+            rows = list(
+                MarketPlace.objects.filter(id__gt=last_id, image__startswith="data:")
+                .order_by("id")
+                .values_list("id", "image")[:batch_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            decoded = []
+            for item_id, image in rows:
+                try:
+                    inline = decode_inline_image(image)
+                    if inline is None:
+                        raise ValueError("not a base64 data URI")
+                except ValueError as e:
+                    failed += 1
+                    self.stderr.write(f"Item {item_id}: skipped ({str(e)})")
+                    continue
+                decoded.append((item_id, inline))
+            if dry_run:
+                extracted += len(decoded)
+            elif decoded:
+                # Stored the way uploads are: without EXIF metadata and with
+                # variants queued once the rows point at the file
+                with transaction.atomic():
+                    updates = []
+                    for item_id, inline in decoded:
+                        name, ready = save_inline_image(inline)
+                        updates.append(
+                            MarketPlace(
+                                id=item_id, image=name, image_variants_ready=ready
+                            )
+                        )
+                    MarketPlace.objects.bulk_update(
+                        updates, ["image", "image_variants_ready"]
+                    )
+                extracted += len(updates)
+
+            self.stdout.write(f"Processed items up to id {last_id}")
+
+        if extracted and not dry_run:
+            # bulk_update bypasses the model signals that usually do this
+            catalog_cache.invalidate()
+
+        if dry_run:
+            summary = f"Would extract {extracted} images ({failed} unreadable)"
+        else:
+            summary = f"Extracted {extracted} images ({failed} unreadable)"
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,54 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.imaging import generate_variants
+from api.models import CustomUser, MarketPlace
+from api.storage import marketplace_image_storage
+
+
+class Command(BaseCommand):
+    help = "Render thumbnail variants for existing profile and marketplace images."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--only",
+            choices=["profiles", "marketplace"],
+            help="Restrict the backfill to one kind of image.",
+        )
+
+    def handle(self, *args, **options):
+        only = options["only"]
+        done = failed = 0
+
+        sources = []
+        if only in (None, "profiles"):
+            names = (
+                CustomUser.objects.exclude(profile_picture="")
+                .exclude(profile_picture__isnull=True)
+                .values_list("profile_picture", flat=True)
+                .iterator(chunk_size=1000)
+            )
+            sources.append((names, default_storage))
+        if only in (None, "marketplace"):
+            names = (
+                MarketPlace.objects.filter(
+                    image__startswith=f"{marketplace_image_storage.prefix}/"
+                )
+                .values_list("image", flat=True)
+                .distinct()
+                .iterator(chunk_size=1000)
+            )
+            sources.append((names, marketplace_image_storage))
+
+        for names, storage in sources:
+            for name in names:
+                try:
+                    generate_variants(name, storage)
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{name}: {str(e)}")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Generated variants for {done} images ({failed} failed)")
+        )
@@ -0,0 +1,72 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from api.bulk import IMPORT_FORMATS, import_listings, read_rows
+from api.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import marketplace listings from a CSV or NDJSON file. Rows name "
+        "their seller in a created_by column unless --seller is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import.")
+        parser.add_argument(
+            "--format",
+            dest="data_format",
+            choices=IMPORT_FORMATS,
+            help="File format; guessed from the extension when omitted.",
+        )
+        parser.add_argument("--seller", help="Username that owns every row.")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--strict",
+            action="store_true",
+            help="Import nothing if any row is invalid.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Validate the file without inserting anything.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        data_format = options["data_format"] or path.rsplit(".", 1)[-1].lower()
+        if data_format not in IMPORT_FORMATS:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format.")
+
+        seller = None
+        if options["seller"]:
+            try:
+                seller = CustomUser.objects.get(username=options["seller"])
+            except CustomUser.DoesNotExist:
+                raise CommandError(f"User {options['seller']} does not exist.")
+
+        started = time.perf_counter()
+        with open(path, "rb") as f:
+            try:
+                result = import_listings(
+                    read_rows(f, data_format),
+                    seller=seller,
+                    chunk_size=options["chunk_size"],
+                    strict=options["strict"],
+                    dry_run=options["dry_run"],
+                )
+            except IntegrityError as e:
+                raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        for error in result.errors:
+            self.stderr.write(json.dumps(error))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {result.created} listings, {len(result.errors)} rows "
+                f"failed ({elapsed:.2f}s)"
+            )
+        )
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import AuditEvent
+
+
+class Command(BaseCommand):
+    help = "Delete audit events older than the retention period, oldest first."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=getattr(settings, "AUDIT_LOG_RETENTION_DAYS", 180),
+            help="Keep events from this many most recent days.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=900,
+            help="Rows deleted per statement, keeping each lock short.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        batch_size = options["batch_size"]
+        expired = AuditEvent.objects.filter(created_at__lt=cutoff)
+
+        deleted = 0
+        while True:
+            ids = list(expired.values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            count, _ = AuditEvent.objects.filter(id__in=ids).delete()
+            deleted += count
+            self.stdout.write(f"Deleted {deleted} events")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Pruned {deleted} audit events older than {cutoff:%Y-%m-%d}"
+            )
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api import stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the admin dashboard rollups from the base tables. Run once "
+        "after deploying them, and after any write that bypassed the signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--totals-only",
+            action="store_true",
+            help="Only recount the running totals, not the daily buckets.",
+        )
+
+    def handle(self, *args, **options):
+        totals = stats.rebuild_totals()
+        summary = ", ".join(f"{name}={value}" for name, value in totals.items())
+        self.stdout.write(f"Totals: {summary}")
+        if not options["totals_only"]:
+            written = stats.rebuild_daily()
+            self.stdout.write(f"Wrote {written} daily buckets")
+        self.stdout.write(self.style.SUCCESS("Dashboard statistics rebuilt"))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.friends import invalidate_friend_ids
+from api.models import FriendEdge, Friendship
+
+
+class Command(BaseCommand):
+    help = "Rebuild the symmetric friend adjacency table from accepted friendships."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        pairs = (
+            Friendship.objects.filter(is_accepted=True)
+            .values_list("user_id", "friend_id")
+            .iterator(chunk_size=batch_size)
+        )
+
+        created = 0
+        user_ids = set()
+        with transaction.atomic():
+            FriendEdge.objects.all().delete()
+            batch = []
+            for user_id, friend_id in pairs:
+                batch.append(FriendEdge(user_id=user_id, friend_id=friend_id))
+                batch.append(FriendEdge(user_id=friend_id, friend_id=user_id))
+                user_ids.update((user_id, friend_id))
+                if len(batch) >= batch_size:
+                    FriendEdge.objects.bulk_create(batch, ignore_conflicts=True)
+                    created += len(batch)
+                    batch = []
+            FriendEdge.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+
+        invalidate_friend_ids(*user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {created} friend edges"))
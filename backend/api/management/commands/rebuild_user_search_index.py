@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api.models import CustomUser
+from api.user_search import index_users
+
+
+class Command(BaseCommand):
+    help = "Rebuild the user search index (prefix tokens and trigrams)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        users = CustomUser.objects.only("id", "username", "first_name", "last_name")
+        last_id = 0
+        indexed = 0
+        while True:
+            batch = list(users.filter(id__gt=last_id).order_by("id")[:batch_size])
+            if not batch:
+                break
+            index_users(batch)
+            indexed += len(batch)
+            last_id = batch[-1].id
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} users"))
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.seeding import DEFAULTS, Seeder
+
+HELP = {
+    "users": "Users to create.",
+    "friends_min": "Smallest number of friends a user asks for.",
+    "friends_max": "Largest number of friends a user asks for.",
+    "friend_alpha": "Power-law exponent of friend counts (lower: heavier tail).",
+    "pending": "Fraction of friendships left as pending requests.",
+    "chats": "Direct-message chats, mostly between friends.",
+    "messages": "Direct messages in total, spread over chats by a power law.",
+    "chat_alpha": "Power-law exponent of chat and group conversation lengths.",
+    "groups": "Groups to create.",
+    "group_size_max": "Largest group size; sizes follow a power law from 3.",
+    "group_messages": "Group messages in total.",
+    "listings": "Marketplace listings, sellers chosen by a power law.",
+    "sold": "Fraction of listings marked sold.",
+    "days": "Spread timestamps over this many past days.",
+    "key_pool": "RSA key pairs shared round-robin by users and groups.",
+    "batch_size": "Rows per bulk insert.",
+    "workers": "Processes inserting messages (not with SQLite).",
+    "seed": "Random seed, for reproducible datasets.",
+    "prefix": "Prefix of generated usernames and emails.",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Populate the database with a large synthetic dataset: users, "
+        "friendships, chats, encrypted messages, groups and listings. Meant "
+        "for scale and performance testing, not for production databases."
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULTS.items():
+            kind = type(default) if default is not None else int
+            parser.add_argument(
+                f"--{name.replace('_', '-')}",
+                type=kind,
+                default=default,
+                help=f"{HELP[name]} Default: {default}.",
+            )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Seed even though DEBUG is off.",
+        )
+
+    def handle(self, *args, **options):
+        if not (settings.DEBUG or getattr(settings, "BENCHMARK", False)):
+            if not options["force"]:
+                raise CommandError(
+                    "DEBUG is off; this may be a production database. Pass "
+                    "--force to seed it anyway."
+                )
+        seeder = Seeder(
+            log=self.stdout.write, **{name: options[name] for name in DEFAULTS}
+        )
+        try:
+            counts = seeder.run()
+        except ValueError as e:
+            raise CommandError(str(e))
+        summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Created {summary}"))
+        self.stdout.write(
+            "Run compute_friend_suggestions to build suggestions for the new users."
+        )
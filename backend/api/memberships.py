@@ -0,0 +1,55 @@
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Group
+
+MEMBERSHIP_TIMEOUT = 60 * 60
+
+
+def _membership_key(group_id, user_id):
+    return f"groups:{group_id}:member:{user_id}"
+
+
+def has_member(group, user):
+    """
+    Whether `user` belongs to `group`. Answers are cached per (group, user),
+    so a repeated check costs no query and a first check is a single lookup
+    on the through table's (group, user) unique index.
+    """
+    key = _membership_key(group.pk, user.pk)
+    # Membership changes bump Group.updated_at. Answers are stored with the
+    # version they were read at, so a worker whose local cache missed the
+    # invalidation below still won't use an answer older than the group.
+    version = group.updated_at.isoformat()
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    is_member = Group.members.through.objects.filter(
+        group_id=group.pk, customuser_id=user.pk
+    ).exists()
+    cache.set(key, (version, is_member), timeout=MEMBERSHIP_TIMEOUT)
+    return is_member
+
+
+def invalidate_memberships(pairs):
+    """Drop cached answers for an iterable of (group_id, user_id) pairs"""
+    keys = [_membership_key(group_id, user_id) for group_id, user_id in pairs]
+    if keys:
+        cache.delete_many(keys)
+
+
+def with_member_count(groups):
+    """
+    Annotate `member_count` on a Group queryset. The count is a correlated
+    subquery, so it stays correct when the queryset is itself filtered on
+    members (e.g. a user's own groups).
+    """
+    counts = (
+        Group.members.through.objects.filter(group_id=OuterRef("pk"))
+        .order_by()
+        .values("group_id")
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    return groups.annotate(member_count=Coalesce(Subquery(counts), 0))
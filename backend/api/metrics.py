@@ -0,0 +1,393 @@
+"""
+Operational metrics in the Prometheus text format.
+
+Each process keeps its counters, gauges and histograms in memory; updating
+one is a dict operation under a lock. Every METRICS_FLUSH_INTERVAL seconds
+(checked at the end of a request) the process writes a snapshot to its own
+JSON file in METRICS_DIR. /metrics sums the snapshots of all processes, so
+any worker can answer for the whole server. The counters and histograms of
+exited processes are folded into one archive file and their snapshots
+deleted; their gauges are dropped. Empty METRICS_DIR when deploying, as with
+Prometheus' own multiprocess mode.
+"""
+
+import atexit
+import fcntl
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+ENABLED = getattr(settings, "METRICS_ENABLED", False)
+METRICS_DIR = getattr(
+    settings,
+    "METRICS_DIR",
+    os.path.join(tempfile.gettempdir(), "rivr-metrics"),
+)
+FLUSH_INTERVAL = getattr(settings, "METRICS_FLUSH_INTERVAL", 5.0)
+ARCHIVE = "archive.json"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "http_requests_total": (
+        "counter",
+        "Requests handled, by view, method and status code.",
+        None,
+    ),
+    "http_request_duration_seconds": (
+        "histogram",
+        "Request latency by view and method.",
+        LATENCY_BUCKETS,
+    ),
+    "http_request_queries": (
+        "histogram",
+        "Database queries per request, by view.",
+        QUERY_BUCKETS,
+    ),
+    "operation_duration_seconds": (
+        "histogram",
+        "Duration of timed operations such as RSA encryption, by category "
+        "and function.",
+        LATENCY_BUCKETS,
+    ),
+    "emails_sent_total": ("counter", "Emails sent, by outcome.", None),
+    "email_send_duration_seconds": (
+        "histogram",
+        "Time spent handing an email to the mail server.",
+        LATENCY_BUCKETS,
+    ),
+    "emails_in_flight": ("gauge", "Emails currently being sent.", None),
+    "login_rate_limited_total": (
+        "counter",
+        "Login attempts rejected by the rate limit.",
+        None,
+    ),
+    "audit_queue_depth": ("gauge", "Audit events waiting to be written.", None),
+    "audit_events_dropped_total": (
+        "counter",
+        "Audit events dropped because the queue was full.",
+        None,
+    ),
+    "cache_events_total": (
+        "counter",
+        "Shared response cache events (hits, misses, rebuilds, ...).",
+        None,
+    ),
+}
+
+
+class Registry:
+    """The metrics of this process"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> value, or [bucket counts..., sum, count]
+        self.values = {}
+        self.pid = os.getpid()
+        self.file = os.path.join(METRICS_DIR, f"{self.pid}-{uuid.uuid4().hex}.json")
+        self.flushed_at = 0.0
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name, labels, value):
+        with self.lock:
+            self.values[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self):
+        """Refresh the values that are read from elsewhere rather than counted"""
+        from .audit import writer
+        from .cache import catalog_cache
+
+        self.set("audit_queue_depth", (), writer.queue.qsize())
+        self.set("audit_events_dropped_total", (), writer.dropped)
+        for event, count in catalog_cache.stats().items():
+            if event != "hit_rate":
+                labels = (("cache", "catalog"), ("event", event))
+                self.set("cache_events_total", labels, count)
+
+    def flush(self):
+        """Write this process's snapshot for /metrics to aggregate"""
+        self.collect()
+        with self.lock:
+            rows = [
+                [name, list(labels), value]
+                for (name, labels), value in self.values.items()
+            ]
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        temporary = f"{self.file}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"pid": self.pid, "rows": rows}, f)
+        os.replace(temporary, self.file)
+        self.flushed_at = time.monotonic()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+
+registry = Registry()
+if ENABLED:
+    atexit.register(registry.flush)
+    # Workers forked from a preloaded master start with a file of their own
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+def inc(name, labels=(), amount=1):
+    if ENABLED:
+        registry.inc(name, labels, amount)
+
+
+def observe(name, labels, value):
+    if ENABLED:
+        registry.observe(name, labels, value)
+
+
+@contextmanager
+def track_email():
+    """Count, time and track an email being sent inside the block"""
+    if not ENABLED:
+        yield
+        return
+    registry.inc("emails_in_flight")
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "sent"
+    finally:
+        registry.inc("emails_in_flight", amount=-1)
+        registry.observe(
+            "email_send_duration_seconds", (), time.perf_counter() - started
+        )
+        registry.inc("emails_sent_total", (("outcome", outcome),))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _add(totals, name, labels, value):
+    key = (name, tuple(tuple(pair) for pair in labels))
+    if isinstance(value, list):
+        current = totals.setdefault(key, [0] * len(value))
+        for i, part in enumerate(value):
+            current[i] += part
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _compact(names):
+    """
+    Fold the snapshots of exited processes into the archive and delete
+    them, so METRICS_DIR doesn't grow with every worker restart. The
+    archive lists the files it absorbed until they are gone, so a crash
+    between writing it and deleting them can't count them twice.
+    Returns the snapshot file names left to read.
+    """
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE)
+    archive = _read_snapshot(archive_path) or {"rows": [], "merged": []}
+    for filename in archive["merged"]:
+        _remove(os.path.join(METRICS_DIR, filename))
+    absorbed = set(archive["merged"])
+
+    totals = {}
+    for name, labels, value in archive["rows"]:
+        _add(totals, name, labels, value)
+    live, dead = [], []
+    for filename in names:
+        if filename == ARCHIVE or filename in absorbed:
+            continue
+        snapshot = _read_snapshot(os.path.join(METRICS_DIR, filename))
+        if snapshot is None:
+            continue
+        if _alive(snapshot["pid"]):
+            live.append(filename)
+            continue
+        dead.append(filename)
+        for name, labels, value in snapshot["rows"]:
+            if name in METRICS and METRICS[name][0] != "gauge":
+                _add(totals, name, labels, value)
+    if dead or archive["merged"]:
+        rows = [[name, list(labels), value] for (name, labels), value in totals.items()]
+        temporary = f"{archive_path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"rows": rows, "merged": dead}, f)
+        os.replace(temporary, archive_path)
+        for filename in dead:
+            _remove(os.path.join(METRICS_DIR, filename))
+    return [ARCHIVE, *live]
+
+
+def aggregate():
+    """Sum the snapshots of every process: (name, labels) -> value"""
+    totals = {}
+    try:
+        names = [name for name in os.listdir(METRICS_DIR) if name.endswith(".json")]
+    except FileNotFoundError:
+        return totals
+    # Scrapes from several workers would otherwise race on the archive
+    with open(os.path.join(METRICS_DIR, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        for filename in _compact(names):
+            snapshot = _read_snapshot(os.path.join(METRICS_DIR, filename))
+            if snapshot is None:
+                continue
+            for name, labels, value in snapshot["rows"]:
+                if name in METRICS:
+                    _add(totals, name, labels, value)
+    return totals
+
+
+def _escape(value):
+    value = str(value).replace("\\", r"\\")
+    return value.replace('"', r"\"").replace("\n", r"\n")
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(f'{key}="{_escape(value)}"' for key, value in pairs)
+
+
+def render(totals):
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted(
+            (labels, value)
+            for (metric, labels), value in totals.items()
+            if metric == name
+        )
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in series:
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(
+                    f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}"
+                )
+            lines.append(
+                f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {value[-1]}"
+            )
+            lines.append(f"{name}_sum{_labels(labels)} {value[-2]}")
+            lines.append(f"{name}_count{_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. METRICS_TOKEN is the bearer token scrapers
+    must send; without one, metrics are only served with DEBUG on.
+    """
+    if not ENABLED:
+        raise Http404
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if not token and not settings.DEBUG:
+        return HttpResponse(
+            "Set METRICS_TOKEN to serve metrics\n",
+            status=403,
+            content_type="text/plain",
+        )
+    if token:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            return HttpResponse(
+                "Unauthorized\n", status=401, content_type="text/plain"
+            )
+    registry.flush()
+    return HttpResponse(
+        render(aggregate()), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connections["default"].execute_wrapper(count_query):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = (match.view_name or match._func_path) if match else "unmatched"
+        registry.inc(
+            "http_requests_total",
+            (
+                ("method", request.method),
+                ("status", str(response.status_code)),
+                ("view", view),
+            ),
+        )
+        labels = (("method", request.method), ("view", view))
+        registry.observe("http_request_duration_seconds", labels, elapsed)
+        registry.observe("http_request_queries", (("view", view),), queries)
+        registry.maybe_flush()
+        return response
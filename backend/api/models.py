@@ -1,14 +1,22 @@
+import uuid
+from datetime import timedelta
+
 import pyotp
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import padding, rsa
 from decouple import config
+from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
 from django.db import models
 from django.db.models import Q, UniqueConstraint
+from django.db.models.signals import m2m_changed
+from django.db.models.functions import Greatest, Least
 from django.utils import timezone
 
+from .profiling import timed
+
 # Generate a key for encryption
 key = Fernet.generate_key()
 cipher = Fernet(key)
@@ -37,7 +45,44 @@ class CustomUserManager(BaseUserManager):
         return self.create_user(email, username, password, **extra_fields)
 
 
-class CustomUser(AbstractBaseUser, PermissionsMixin):
+class TracksLoadedValues:
+    """
+    Remembers the values a row was loaded or last saved with, so signal
+    handlers can tell which fields a save changed.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Reading a deferred field would load it with a query of its own
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred
+        }
+
+    def field_changed(self, field_name):
+        """
+        Whether a field differs from its stored value. Fields whose stored
+        value is unknown are reported as changed.
+        """
+        loaded = getattr(self, "_loaded_values", {})
+        if field_name not in loaded:
+            return True
+        return loaded[field_name] != getattr(self, field_name)
+
+    def loaded_value(self, field_name, default=None):
+        """The stored value of a field, or `default` when it is unknown"""
+        return getattr(self, "_loaded_values", {}).get(field_name, default)
+
+
+class CustomUser(TracksLoadedValues, AbstractBaseUser, PermissionsMixin):
     username = models.CharField(max_length=150, unique=True)
     email = models.EmailField(unique=True)
     first_name = models.CharField(max_length=30)
@@ -48,6 +93,8 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     profile_picture = models.ImageField(
         upload_to="profile_pictures/", null=True, blank=True
     )
+    # Set once the thumbnails of the current picture are rendered
+    profile_picture_variants_ready = models.BooleanField(default=False)
     is_verified = models.BooleanField(default=False)
     totp_secret = models.CharField(max_length=32, null=True, blank=True)
     private_key = models.TextField(null=True, blank=True)
@@ -56,6 +103,12 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     date_joined = models.DateTimeField(auto_now_add=True)
+    # Part of the conditional GET version of every list showing users;
+    # writers using update() must set it themselves
+    updated_at = models.DateTimeField(auto_now=True)
+    # Bumped in SQL whenever the user's friendships change; cached friend
+    # sets are only used while it matches (see api.friends)
+    friends_version = models.PositiveIntegerField(default=0)
 
     objects = CustomUserManager()
 
@@ -65,6 +118,24 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        if not (
+            self._state.adding
+            or kwargs.get("force_insert")
+            or kwargs.get("update_fields") is not None
+        ):
+            # An instance loaded before a friendship change must not write
+            # its older friends_version back
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in deferred
+                and field.name != "friends_version"
+            ]
+        super().save(*args, **kwargs)
+
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}"
 
@@ -92,6 +163,7 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         totp = pyotp.TOTP(self.totp_secret)
         return totp.verify(code)
 
+    @timed("crypto")
     def generate_keys(self):
         if not self.private_key or not self.public_key:
             private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
@@ -112,6 +184,35 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
             self.save()
 
 
+class UserSearchTerm(models.Model):
+    """
+    Search index over usernames and names. Each user has one TOKEN row per
+    lowercased name (for prefix matching) and one TRIGRAM row per distinct
+    trigram of those names (for fuzzy matching).
+    """
+
+    TOKEN = "t"
+    TRIGRAM = "g"
+    KIND_CHOICES = [(TOKEN, "Token"), (TRIGRAM, "Trigram")]
+
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    term = models.CharField(max_length=150)
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="search_terms"
+    )
+
+    class Meta:
+        constraints = [
+            # Doubles as the (kind, term, user) index every search scans
+            UniqueConstraint(
+                fields=["kind", "term", "user"], name="unique_user_search_term"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.user_id}"
+
+
 class Friendship(models.Model):
     user = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE, related_name="friendship_user1"
@@ -128,9 +229,11 @@ class Friendship(models.Model):
                 fields=["user", "friend"],
                 name="unique_friendship",
             ),
+            # At most one row per unordered pair, whichever side sent it
             UniqueConstraint(
-                fields=["friend", "user"],
-                name="unique_friendship_mirror",
+                Least("user", "friend"),
+                Greatest("user", "friend"),
+                name="unique_friendship_pair",
             ),
         ]
 
@@ -138,6 +241,72 @@ class Friendship(models.Model):
         return f"{self.user} ↔ {self.friend}"
 
 
+class FriendEdge(models.Model):
+    """
+    Symmetric adjacency list of accepted friendships: one row per direction,
+    so a user's friends are a single range scan over (user, friend).
+    """
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="friend_edges"
+    )
+    friend = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=["user", "friend"], name="unique_friend_edge"),
+        ]
+
+    @classmethod
+    def connect(cls, user_id, friend_id):
+        cls.objects.bulk_create(
+            [
+                cls(user_id=user_id, friend_id=friend_id),
+                cls(user_id=friend_id, friend_id=user_id),
+            ],
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def disconnect(cls, user_id, friend_id):
+        cls.objects.filter(
+            Q(user_id=user_id, friend_id=friend_id)
+            | Q(user_id=friend_id, friend_id=user_id)
+        ).delete()
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.friend_id}"
+
+
+class FriendSuggestion(models.Model):
+    """Precomputed "people you may know": non-friends ranked by mutual friends"""
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="friend_suggestions"
+    )
+    suggested = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="+"
+    )
+    mutual_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["user", "suggested"], name="unique_friend_suggestion"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-mutual_count"], name="suggestion_rank_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.suggested_id} ({self.mutual_count})"
+
+
 class Chat(models.Model):
     user1 = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE, related_name="chats_as_user1"
@@ -184,6 +353,7 @@ class Message(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
 
     @staticmethod
+    @timed("crypto")
     def encrypt_message(plain_text, sender, receiver):
         """Encrypt a message using the receiver's public key and sign it with the sender's private key."""
         try:
@@ -223,6 +393,7 @@ class Message(models.Model):
         return {"ciphertext": ciphertext.hex(), "signature": signature.hex()}
 
     @staticmethod
+    @timed("crypto")
     def decrypt_message(ciphertext_hex, signature_hex, sender, receiver):
         """Decrypt a message using the receiver's private key and verify with the sender's public key."""
         try:
@@ -304,7 +475,9 @@ class Group(models.Model):
         CustomUser, related_name="group_members", null=True
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
+    @timed("crypto")
     def generate_keys(self):
         private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
         public_key = private_key.public_key()
@@ -325,10 +498,61 @@ class Group(models.Model):
         self.save()
 
     def add_member(self, user_list):
-        for user in user_list:
-            if user not in self.members.all():
-                self.members.add(user)
-                self.save()
+        self.add_members(user.pk for user in user_list)
+
+    def add_members(self, user_ids):
+        """
+        Add users by id: one query reads the current member ids and the
+        difference is written with a single bulk insert into the through
+        table. Returns the set of ids that were added.
+        """
+        through = Group.members.through
+        current = set(
+            through.objects.filter(group_id=self.pk).values_list(
+                "customuser_id", flat=True
+            )
+        )
+        added = set(user_ids) - current
+        if added:
+            through.objects.bulk_create(
+                [through(group_id=self.pk, customuser_id=user_id) for user_id in added],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            # bulk_create bypasses the related manager, so notify receivers
+            m2m_changed.send(
+                sender=through,
+                instance=self,
+                action="post_add",
+                reverse=False,
+                model=CustomUser,
+                pk_set=added,
+                using=self._state.db,
+            )
+        return added
+
+    def remove_members(self, user_ids):
+        """Remove users by id with set-based deletes; returns the ids removed"""
+        through = Group.members.through
+        user_ids = list(set(user_ids))
+        removed = set()
+        for start in range(0, len(user_ids), 900):
+            rows = through.objects.filter(
+                group_id=self.pk, customuser_id__in=user_ids[start : start + 900]
+            )
+            removed.update(rows.values_list("customuser_id", flat=True))
+            rows.delete()
+        if removed:
+            m2m_changed.send(
+                sender=through,
+                instance=self,
+                action="post_remove",
+                reverse=False,
+                model=CustomUser,
+                pk_set=removed,
+                using=self._state.db,
+            )
+        return removed
 
     def __str__(self):
         return self.name
@@ -343,6 +567,7 @@ class GroupMessage(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
 
     @staticmethod
+    @timed("crypto")
     def encrypt_message(plain_text, sender, receiver):
         from cryptography.hazmat.primitives import hashes, serialization
         from cryptography.hazmat.primitives.asymmetric import padding
@@ -380,6 +605,7 @@ class GroupMessage(models.Model):
         return {"ciphertext": ciphertext.hex(), "signature": signature.hex()}
 
     @staticmethod
+    @timed("crypto")
     def decrypt_message(ciphertext_hex, signature_hex, sender, receiver):
         from cryptography.exceptions import InvalidSignature
         from cryptography.hazmat.primitives import hashes, serialization
@@ -423,18 +649,23 @@ class GroupMessage(models.Model):
             raise ValueError("Signature verification failed!")
 
 
-class MarketPlace(models.Model):
+class MarketPlace(TracksLoadedValues, models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     created_by = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE, related_name="created_marketplaces"
     )
-    image = models.TextField(null=True, blank=True)
+    # Reference into content-addressed storage (see api.storage) or an
+    # external image URL; inline image data is never stored on the row.
+    image = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    # Set once the thumbnails of a stored image are rendered
+    image_variants_ready = models.BooleanField(default=False)
     price = models.CharField(max_length=20, null=True, blank=True)
     upi_id = models.CharField(max_length=100, null=True, blank=True)
     is_sold = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def create(self, **kwargs):
         super().create(**kwargs)
@@ -443,6 +674,193 @@ class MarketPlace(models.Model):
         return self.name
 
 
+class MarketPlaceChange(models.Model):
+    """
+    Append-only log of marketplace writes. The auto-incrementing id is the
+    sequence number clients pass back as `since` to fetch only newer changes.
+    Ids are allocated at insert rather than at commit, so a cursor is only
+    handed out for changes older than MARKETPLACE_SYNC_SAFETY_WINDOW, by which
+    time any transaction holding a lower id has committed.
+    """
+
+    CREATED = "create"
+    UPDATED = "update"
+    SOLD = "sold"
+    DELETED = "delete"
+    ACTION_CHOICES = [
+        (CREATED, "Created"),
+        (UPDATED, "Updated"),
+        (SOLD, "Sold"),
+        (DELETED, "Deleted"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    # Plain integer rather than a foreign key so tombstones outlive the item
+    item_id = models.IntegerField(db_index=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    @classmethod
+    def record(cls, item_id, action):
+        return cls.objects.create(item_id=item_id, action=action)
+
+    @classmethod
+    def settled_before(cls):
+        """Changes created before this time are safe to move a cursor past"""
+        return timezone.now() - timedelta(
+            seconds=settings.MARKETPLACE_SYNC_SAFETY_WINDOW
+        )
+
+    @classmethod
+    def settled_sequence(cls):
+        """The cursor for a snapshot of the marketplace taken now"""
+        last = (
+            cls.objects.filter(created_at__lt=cls.settled_before())
+            .order_by("-id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        return last or 0
+
+    def __str__(self):
+        return f"#{self.id} {self.action} item {self.item_id}"
+
+
+class DocumentVerification(models.Model):
+    """
+    An identity document uploaded in chunks for admin review. The file is
+    stored encrypted under DOCUMENT_ROOT; see api.documents.
+    """
+
+    UPLOADING = "uploading"
+    PENDING = "pending"
+    APPROVED = "approved"
+    REJECTED = "rejected"
+    STATUS_CHOICES = [
+        (UPLOADING, "Uploading"),
+        (PENDING, "Pending review"),
+        (APPROVED, "Approved"),
+        (REJECTED, "Rejected"),
+    ]
+    DOCUMENT_TYPES = [
+        ("id_card", "ID card"),
+        ("passport", "Passport"),
+        ("driving_license", "Driving license"),
+        ("other", "Other"),
+    ]
+
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="document_verifications"
+    )
+    document_type = models.CharField(max_length=20, choices=DOCUMENT_TYPES)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    # Plaintext bytes received so far: the offset the next chunk must start at
+    received = models.BigIntegerField(default=0)
+    # Bytes of the encrypted file, which carries per-chunk framing
+    stored_size = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=UPLOADING
+    )
+    review_note = models.TextField(blank=True)
+    reviewed_by = models.ForeignKey(
+        CustomUser,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    submitted_at = models.DateTimeField(null=True, blank=True)
+    reviewed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "submitted_at"], name="document_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.get_document_type_display()} of {self.user_id} ({self.status})"
+
+
+class StatCounter(models.Model):
+    """Running total behind the admin dashboard, one row per metric"""
+
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}={self.value}"
+
+
+class DailyStat(models.Model):
+    """Count of dashboard events of one kind on one day"""
+
+    day = models.DateField()
+    name = models.CharField(max_length=50)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=["day", "name"], name="unique_daily_stat"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.name}={self.value}"
+
+
+class AuditEvent(models.Model):
+    """
+    Append-only security audit trail. Rows are written in batches by
+    api.audit and are never updated; old rows are pruned by age.
+    """
+
+    LOGIN_PASSWORD_OK = "login.password_ok"
+    LOGIN_FAILED = "login.failed"
+    LOGIN_RATE_LIMITED = "login.rate_limited"
+    TOTP_OK = "totp.ok"
+    TOTP_FAILED = "totp.failed"
+    PASSWORD_RESET_REQUESTED = "password_reset.requested"
+    PASSWORD_RESET_CODE_FAILED = "password_reset.code_failed"
+    PASSWORD_RESET_COMPLETED = "password_reset.completed"
+    ADMIN_USER_DEACTIVATED = "admin.user_deactivated"
+    ADMIN_USER_REACTIVATED = "admin.user_reactivated"
+    ADMIN_USERS_BULK = "admin.users_bulk"
+    ADMIN_ITEM_DELETED = "admin.item_deleted"
+    ADMIN_ITEMS_BULK = "admin.items_bulk"
+    ADMIN_EXPORT = "admin.export"
+    DOCUMENT_SUBMITTED = "document.submitted"
+    ADMIN_DOCUMENT_REVIEWED = "admin.document_reviewed"
+    ADMIN_DOCUMENT_DOWNLOADED = "admin.document_downloaded"
+
+    id = models.BigAutoField(primary_key=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    action = models.CharField(max_length=32)
+    # Plain integer rather than a foreign key so the trail outlives the user
+    actor_id = models.IntegerField(null=True, blank=True)
+    ip = models.GenericIPAddressField(null=True, blank=True)
+    # What the action was aimed at, e.g. the email of a failed login
+    target = models.CharField(max_length=254, blank=True)
+    detail = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="audit_time_idx"),
+            models.Index(fields=["actor_id", "created_at"], name="audit_actor_idx"),
+            models.Index(fields=["action", "created_at"], name="audit_action_idx"),
+            models.Index(fields=["ip", "created_at"], name="audit_ip_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d %H:%M:%S} {self.action} {self.target}"
+
+
 class VerificationCode(models.Model):
     email = models.EmailField(unique=True)
     code = models.CharField(max_length=6)
@@ -0,0 +1,206 @@
+"""
+Bulk moderation of users and marketplace listings.
+
+Targets are given either as explicit id lists or as a whitelisted filter
+spec. Changes are applied as set-based statements over chunks of ids inside
+one transaction, followed by the bookkeeping that per-row saves would have
+triggered: change-log entries, dashboard statistics and cache invalidation.
+"""
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import stats
+from .cache import catalog_cache
+from .friends import invalidate_friend_ids
+from .models import CustomUser, FriendEdge, MarketPlace, MarketPlaceChange
+from .signals import bulk_write
+from .storage import release_marketplace_image
+
+# Keep IN (...) lists below SQLite's default limit of 999 parameters
+CHUNK_SIZE = 900
+MAX_IDS = 100000
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("true", "1"):
+        return True
+    if str(value).lower() in ("false", "0"):
+        return False
+    raise ValueError("must be true or false")
+
+
+def _datetime(value):
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        raise ValueError("must be an ISO 8601 datetime")
+    return parsed
+
+
+def _text(value):
+    value = str(value).strip()
+    if not value:
+        raise ValueError("must not be empty")
+    return value
+
+
+# Filter name -> (ORM lookup, value parser)
+USER_FILTERS = {
+    "email_domain": ("email__iendswith", lambda value: "@" + _text(value)),
+    "username_prefix": ("username__startswith", _text),
+    "joined_after": ("date_joined__gte", _datetime),
+    "joined_before": ("date_joined__lt", _datetime),
+    "is_verified": ("is_verified", _boolean),
+    "is_active": ("is_active", _boolean),
+}
+LISTING_FILTERS = {
+    "seller": ("created_by__username", _text),
+    "seller_id": ("created_by_id", int),
+    "name_contains": ("name__icontains", _text),
+    "created_after": ("created_at__gte", _datetime),
+    "created_before": ("created_at__lt", _datetime),
+    "is_sold": ("is_sold", _boolean),
+}
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def select_ids(queryset, ids=None, filters=None, allowed=None):
+    """
+    Resolve a moderation target to a sorted list of ids: either the given
+    ids that exist in `queryset`, or every row matching the filter spec.
+    Raises ValueError for an empty, unknown or malformed target.
+    """
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise ValueError("ids must be a non-empty list.")
+        if len(ids) > MAX_IDS:
+            raise ValueError(f"At most {MAX_IDS} ids can be moderated at once.")
+        try:
+            ids = {int(value) for value in ids}
+        except (TypeError, ValueError):
+            raise ValueError("ids must be integers.")
+        found = []
+        for chunk in _chunks(ids):
+            found.extend(
+                queryset.filter(id__in=chunk).values_list("id", flat=True)
+            )
+        return sorted(found)
+
+    if not isinstance(filters, dict) or not filters:
+        raise ValueError("Provide a list of ids or a non-empty filter.")
+    lookups = {}
+    for name, value in filters.items():
+        if name not in allowed:
+            raise ValueError(
+                f"Unknown filter '{name}'. Allowed: {', '.join(sorted(allowed))}."
+            )
+        lookup, parse = allowed[name]
+        try:
+            lookups[lookup] = parse(value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Filter '{name}' {str(e)}.")
+    # One row past the limit is enough to refuse the filter
+    found = list(
+        queryset.filter(**lookups)
+        .order_by("id")
+        .values_list("id", flat=True)[: MAX_IDS + 1]
+    )
+    if len(found) > MAX_IDS:
+        raise ValueError(
+            f"The filter matches more than {MAX_IDS} rows; at most {MAX_IDS} "
+            "can be moderated at once."
+        )
+    return found
+
+
+def set_users_active(user_ids, active):
+    """
+    Activate or deactivate users with one UPDATE per chunk of ids and
+    return how many actually changed state.
+    """
+    changed_ids = []
+    with transaction.atomic():
+        for chunk in _chunks(user_ids):
+            # Only rows in the other state are touched, so counts stay exact
+            rows = CustomUser.objects.select_for_update().filter(
+                id__in=chunk, is_active=not active
+            )
+            ids = list(rows.values_list("id", flat=True))
+            # Setting updated_at moves the conditional GET versions of every
+            # list showing these users
+            CustomUser.objects.filter(id__in=ids).update(
+                is_active=active, updated_at=timezone.now()
+            )
+            changed_ids.extend(ids)
+        changed = len(changed_ids)
+        if changed_ids:
+            # The users and everyone who has them as a friend
+            affected = set(changed_ids)
+            for chunk in _chunks(changed_ids):
+                affected.update(
+                    FriendEdge.objects.filter(friend_id__in=chunk).values_list(
+                        "user_id", flat=True
+                    )
+                )
+            invalidate_friend_ids(*affected)
+        # update() doesn't send post_save, so book the statistics here
+        if active:
+            stats.adjust(
+                totals={stats.ACTIVE_USERS: changed},
+                daily={stats.REACTIVATIONS: changed},
+            )
+        else:
+            stats.adjust(
+                totals={stats.ACTIVE_USERS: -changed},
+                daily={stats.DEACTIVATIONS: changed},
+            )
+    return changed
+
+
+def delete_listings(item_ids):
+    """
+    Delete listings in chunks, leaving a tombstone in the change log for
+    each, and return how many were deleted.
+    """
+    deleted = sold = 0
+    images = set()
+    with transaction.atomic(), bulk_write():
+        for chunk in _chunks(item_ids):
+            items = MarketPlace.objects.filter(id__in=chunk)
+            counts = items.aggregate(
+                total=Count("id"), sold=Count("id", filter=Q(is_sold=True))
+            )
+            images.update(
+                items.exclude(image__isnull=True)
+                .exclude(image="")
+                .values_list("image", flat=True)
+                .distinct()
+            )
+            MarketPlaceChange.objects.bulk_create(
+                MarketPlaceChange(item_id=item_id, action=MarketPlaceChange.DELETED)
+                for item_id in items.values_list("id", flat=True)
+            )
+            items.delete()
+            deleted += counts["total"]
+            sold += counts["sold"]
+        stats.adjust(totals={stats.ITEMS: -deleted, stats.SOLD_ITEMS: -sold})
+        if deleted:
+            transaction.on_commit(catalog_cache.invalidate)
+        if images:
+            # Listings often share a file; each is checked and released once
+            transaction.on_commit(lambda: _release_images(images))
+    return deleted
+
+
+def _release_images(images):
+    for image in images:
+        release_marketplace_image(image)
@@ -0,0 +1,42 @@
+import base64
+import binascii
+import json
+
+from rest_framework.pagination import PageNumberPagination
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+def encode_cursor(values):
+    """Opaque keyset cursor for the last row of a page"""
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, types=None):
+    """
+    Values of a keyset cursor, or None if it is missing. `types`, if given,
+    is the type of each value; ValueError if the cursor doesn't match.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor.")
+    if types is None:
+        return values
+    if len(values) != len(types):
+        raise ValueError("Invalid cursor.")
+    for value, expected in zip(values, types):
+        # JSON true/false decode to bools, which are ints to isinstance
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise ValueError("Invalid cursor.")
+    return values
@@ -0,0 +1,182 @@
+"""
+Per-request profiling.
+
+With PROFILING_ENABLED on, ProfilingMiddleware times every request. It
+breaks the time down into database queries, RSA work (functions decorated
+with `timed("crypto")`), serializer output and JSON rendering, and reports
+them in a Server-Timing header that browser dev tools display. Staff can
+add ?profile=1 to a request to get a cProfile report in place of the
+response. The categories can overlap; queries issued while serializing,
+for example, count towards both.
+
+With profiling off the middleware removes itself at startup; if metrics
+are off too, `timed` functions cost one context variable lookup per call.
+"""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import time
+import uuid
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+
+from . import metrics
+
+PROFILE_LIMIT = 60
+
+_timings = ContextVar("request_timings", default=None)
+_instrumented = False
+
+
+class Timings:
+    """Accumulated seconds and call counts per category for one request"""
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        self.active = set()
+
+    def add(self, name, seconds, count=1):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def server_timing(self, total):
+        parts = []
+        for name, seconds in self.seconds.items():
+            unit = "queries" if name == "db" else "calls"
+            parts.append(
+                f'{name};dur={seconds * 1000:.2f};desc="{self.counts[name]} {unit}"'
+            )
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+def timed(name):
+    """
+    Count a function's run time towards `name` in the current request's
+    profile. Nested calls under the same name are only counted once. With
+    metrics on, every call is also recorded in operation_duration_seconds.
+    """
+
+    def decorator(func):
+        operation = (("category", name), ("operation", func.__qualname__))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timings = _timings.get()
+            counted = timings is not None and name not in timings.active
+            if not counted and not metrics.ENABLED:
+                return func(*args, **kwargs)
+            if counted:
+                timings.active.add(name)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                if counted:
+                    timings.active.discard(name)
+                    timings.add(name, elapsed)
+                metrics.observe("operation_duration_seconds", operation, elapsed)
+
+        return wrapper
+
+    return decorator
+
+
+def _time_queries(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _timings.get().add("db", time.perf_counter() - started)
+
+
+def _instrument_drf():
+    """Time serializer output and JSON rendering (once, when enabled)"""
+    global _instrumented
+    if _instrumented:
+        return
+    from rest_framework import renderers, serializers
+
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        cls.data = property(timed("serialize")(cls.data.fget))
+    renderers.JSONRenderer.render = timed("render")(renderers.JSONRenderer.render)
+    _instrumented = True
+
+
+def _is_staff(request):
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    # API clients authenticate with JWTs, which DRF only checks in the view
+    from rest_framework.exceptions import AuthenticationFailed
+
+    from .authentication import CustomJWTAuthentication
+
+    try:
+        result = CustomJWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return bool(result and result[0] and result[0].is_staff)
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, "PROFILING_ENABLED", False):
+            raise MiddlewareNotUsed
+        _instrument_drf()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = Timings()
+        token = _timings.set(timings)
+        profiler = None
+        if request.GET.get("profile") == "1" and _is_staff(request):
+            profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_queries))
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            _timings.reset(token)
+        total = time.perf_counter() - started
+
+        if profiler is not None:
+            response = self.profile_report(profiler, response)
+        response["Server-Timing"] = timings.server_timing(total)
+        return response
+
+    def profile_report(self, profiler, response):
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats("cumulative").print_stats(PROFILE_LIMIT)
+        report = HttpResponse(
+            stream.getvalue(),
+            content_type="text/plain; charset=utf-8",
+            status=response.status_code,
+        )
+        dump_dir = getattr(settings, "PROFILING_DUMP_DIR", "")
+        if dump_dir:
+            # Full profile for tools like snakeviz
+            os.makedirs(dump_dir, exist_ok=True)
+            path = os.path.join(dump_dir, f"{uuid.uuid4().hex}.prof")
+            profiler.dump_stats(path)
+            report["X-Profile-Dump"] = os.path.basename(path)
+        return report
@@ -0,0 +1,154 @@
+import re
+
+from django.db import connections, transaction
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import MarketPlace
+
+FTS_TABLE = "api_marketplace_fts"
+MYSQL_FULLTEXT_INDEX = "marketplace_fulltext"
+
+# Column weights for SQLite's bm25(): a match in the name outranks the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+
+def ensure_marketplace_search_index(using="default"):
+    """
+    Create the full-text index over MarketPlace.name/description if it does
+    not exist yet. Both backends keep the index current on every insert,
+    update and delete, so it never needs to be rebuilt afterwards.
+    """
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        _ensure_sqlite_fts(connection)
+    elif connection.vendor == "mysql":
+        _ensure_mysql_fulltext(connection)
+
+
+def _table_exists(connection, table):
+    with connection.cursor() as cursor:
+        return table in connection.introspection.table_names(cursor)
+
+
+def _ensure_sqlite_fts(connection):
+    table = MarketPlace._meta.db_table
+    if not _table_exists(connection, table):
+        # Migrating before the api tables exist; a later migrate sets it up
+        return
+    triggers = [f"{FTS_TABLE}_ai", f"{FTS_TABLE}_ad", f"{FTS_TABLE}_au"]
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE "
+            "(type = 'table' AND name = %s) OR (type = 'trigger' AND name IN "
+            "(%s, %s, %s))",
+            [FTS_TABLE, *triggers],
+        )
+        if len(cursor.fetchall()) == 1 + len(triggers):
+            return
+        # Missing or half-built: start over so no trigger is left out
+        for trigger in triggers:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        # External-content FTS5 table: the text lives only in api_marketplace
+        # and the triggers below keep the index in step with it.
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"name, description, content='{table}', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description) "
+            "VALUES (new.id, new.name, new.description); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) "
+            "VALUES ('delete', old.id, old.name, old.description); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF name, description "
+            f"ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) "
+            "VALUES ('delete', old.id, old.name, old.description); "
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description) "
+            "VALUES (new.id, new.name, new.description); END"
+        )
+        # Index the rows that existed before the index did
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def _ensure_mysql_fulltext(connection):
+    table = MarketPlace._meta.db_table
+    if not _table_exists(connection, table):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = %s "
+            "AND index_name = %s",
+            [table, MYSQL_FULLTEXT_INDEX],
+        )
+        if cursor.fetchone():
+            return
+        cursor.execute(
+            f"ALTER TABLE {connection.ops.quote_name(table)} "
+            f"ADD FULLTEXT INDEX {MYSQL_FULLTEXT_INDEX} (name, description)"
+        )
+
+
+def _fts5_query(terms):
+    # Quote every term so user input can't inject FTS5 syntax, and match
+    # each as a prefix so partially typed words still find results.
+    return " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def search_marketplace(queryset, query):
+    """
+    Restrict a MarketPlace queryset to full-text matches for `query` and
+    annotate it with `search_rank`, where lower values rank better.
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return queryset.none()
+
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(MarketPlace._meta.db_table)
+
+    if connection.vendor == "sqlite":
+        # The rowid lookup lets FTS5 seek straight to each listing's entry
+        rank = RawSQL(
+            f"SELECT bm25({FTS_TABLE}, %s, %s) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id",
+            [NAME_WEIGHT, DESCRIPTION_WEIGHT, _fts5_query(terms)],
+            output_field=FloatField(),
+        )
+        matches = RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+            [_fts5_query(terms)],
+        )
+        return queryset.filter(id__in=matches).annotate(search_rank=rank)
+
+    if connection.vendor == "mysql":
+        match = (
+            f"MATCH ({table}.name, {table}.description) "
+            "AGAINST (%s IN NATURAL LANGUAGE MODE)"
+        )
+        # Relevance is positive exactly for the matching rows
+        rank = RawSQL(f"-({match})", [" ".join(terms)], output_field=FloatField())
+        return queryset.annotate(search_rank=rank).filter(search_rank__lt=0)
+
+    # Other backends have no index configured; fall back to a plain scan
+    condition = Q()
+    for term in terms:
+        condition &= Q(name__icontains=term) | Q(description__icontains=term)
+    return queryset.filter(condition).annotate(
+        search_rank=Value(0.0, output_field=FloatField())
+    )
+
+
+def create_search_indexes(sender, using="default", **kwargs):
+    """post_migrate hook: make sure the full-text index exists"""
+    ensure_marketplace_search_index(using)
@@ -0,0 +1,581 @@
+"""
+Synthetic data for scale and performance testing.
+
+Real writes are dominated by RSA work: every user and group generates a
+2048-bit key pair, and every message is encrypted and signed. The seeder
+instead generates a small pool of key pairs and assigns them round-robin.
+It encrypts a few sample texts once per (sender key, receiver key) pair, so
+every seeded message still decrypts and verifies with its participants'
+keys. Rows are inserted with bulk_create in chunks, and the message phases
+can be spread over several processes. Friend counts, chat lengths, group
+sizes and listings per seller follow power-law distributions.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from multiprocessing import get_context
+
+import django
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from decouple import config
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import stats
+from .cache import catalog_cache
+from .models import (
+    Chat,
+    CustomUser,
+    FriendEdge,
+    Friendship,
+    Group,
+    GroupMessage,
+    MarketPlace,
+    MarketPlaceChange,
+    Message,
+)
+from .user_search import index_users
+
+DEFAULTS = {
+    "users": 10000,
+    "friends_min": 2,
+    "friends_max": 1000,
+    "friend_alpha": 1.5,
+    "pending": 0.05,
+    "chats": 20000,
+    "messages": 500000,
+    "chat_alpha": 1.2,
+    "groups": 500,
+    "group_size_max": 500,
+    "group_messages": 50000,
+    "listings": 20000,
+    "sold": 0.2,
+    "days": 365,
+    "key_pool": 4,
+    "batch_size": 5000,
+    "workers": 1,
+    "seed": None,
+    "prefix": "seed",
+}
+
+SAMPLE_TEXTS = (
+    "Hey, are you around later?",
+    "Sounds good to me!",
+    "Is this still available?",
+    "Thanks, see you tomorrow.",
+    "Can you send me the details?",
+    "Haha, that's great",
+    "On my way",
+    "Let me check and get back to you.",
+)
+FIRST_NAMES = (
+    "Aarav Ananya Arjun Diya Ishaan Kavya Meera Neha "
+    "Priya Rahul Riya Rohan Sanya Tanvi Vihaan Zara"
+).split()
+LAST_NAMES = (
+    "Agarwal Bose Chopra Das Gupta Iyer Jain Kapoor "
+    "Khan Menon Nair Patel Rao Reddy Shah Singh"
+).split()
+LISTING_NAMES = (
+    "Bicycle",
+    "Desk lamp",
+    "Textbook",
+    "Headphones",
+    "Mini fridge",
+    "Guitar",
+    "Backpack",
+    "Monitor",
+    "Office chair",
+    "Calculator",
+)
+
+# Mean gap between consecutive messages of one conversation
+MESSAGE_GAP_SECONDS = 600
+
+# Ciphertext pool of a worker process, set by _init_worker
+_ciphertexts = None
+
+
+def generate_key_pool(size):
+    """`size` RSA key pairs as (encrypted private PEM, public PEM) strings"""
+    passphrase = config("RSA_PASSPHRASE").encode()
+    keys = []
+    for _ in range(size):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        keys.append(
+            (
+                private_key.private_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PrivateFormat.PKCS8,
+                    encryption_algorithm=serialization.BestAvailableEncryption(
+                        passphrase
+                    ),
+                ).decode(),
+                private_key.public_key()
+                .public_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PublicFormat.SubjectPublicKeyInfo,
+                )
+                .decode(),
+            )
+        )
+    return keys
+
+
+def encrypt_pool(keys):
+    """
+    (sender key index, receiver key index) -> message contents in the stored
+    format, one per sample text. Group messages are encrypted to the group's
+    key just like direct messages to the receiver's, so both use this pool.
+    """
+    holders = [
+        CustomUser(private_key=private, public_key=public) for private, public in keys
+    ]
+    return {
+        (sender, receiver): [
+            str(Message.encrypt_message(text, holders[sender], holders[receiver]))
+            for text in SAMPLE_TEXTS
+        ]
+        for sender in range(len(keys))
+        for receiver in range(len(keys))
+    }
+
+
+def power_law(rng, alpha, minimum, maximum):
+    """Pareto-distributed integer in [minimum, maximum]"""
+    return min(maximum, int(minimum * rng.paretovariate(alpha)))
+
+
+def split_total(rng, total, parts, alpha):
+    """Split `total` into `parts` power-law distributed counts"""
+    if not parts:
+        return []
+    weights = [rng.paretovariate(alpha) for _ in range(parts)]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for _ in range(total - sum(counts)):
+        counts[rng.randrange(parts)] += 1
+    return counts
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Keep the timestamps set on new instances instead of letting auto_now and
+    auto_now_add stamp every row of a bulk_create with the same moment.
+    Every such field must then be set explicitly.
+    """
+    fields = [
+        field
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now = auto_now
+            field.auto_now_add = auto_now_add
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for value in iterable:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _last_id(model):
+    return model.objects.aggregate(last=Max("id"))["last"] or 0
+
+
+def _ids_after(model, last_id):
+    # Not every backend reports ids from bulk_create (MySQL doesn't), so read
+    # them back; with a single writer they come out in insertion order.
+    return list(
+        model.objects.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)
+    )
+
+
+def _init_worker(ciphertexts):
+    global _ciphertexts
+    # A no-op in forked workers; spawned ones have to load the apps first
+    django.setup()
+    _ciphertexts = ciphertexts
+
+
+def _insert_sql(model, field_names):
+    quote = connection.ops.quote_name
+    columns = ", ".join(
+        quote(model._meta.get_field(name).column) for name in field_names
+    )
+    placeholders = ", ".join(["%s"] * len(field_names))
+    table = quote(model._meta.db_table)
+    return f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+
+
+def insert_messages(specs, seed, batch_size, days, ciphertexts=None):
+    """
+    Insert the messages of a list of conversation specs and return how many
+    were written. Specs are all ("chat", chat_id, participants, count), or
+    all ("group", group_id, participants, count, group_key), where
+    participants are (user id, key index) pairs.
+
+    These are by far the largest tables, and building model instances for
+    bulk_create costs an order of magnitude more than the inserts
+    themselves, so rows go to executemany as plain tuples instead.
+    """
+    if not specs:
+        return 0
+    ciphertexts = ciphertexts or _ciphertexts
+    rng = random.Random(seed)
+    now = timezone.now()
+    adapt = connection.ops.adapt_datetimefield_value
+    if specs[0][0] == "chat":
+        statement = _insert_sql(
+            Message, ["chat", "sender", "receiver", "content", "timestamp"]
+        )
+    else:
+        statement = _insert_sql(
+            GroupMessage, ["group", "sender", "content", "timestamp"]
+        )
+
+    def rows():
+        for kind, target_id, participants, count, *group_key in specs:
+            moment = now - timedelta(seconds=rng.random() * days * 86400)
+            for _ in range(count):
+                gap = rng.expovariate(1 / MESSAGE_GAP_SECONDS)
+                moment = min(now, moment + timedelta(seconds=gap))
+                if kind == "chat":
+                    sender, receiver = participants
+                    if rng.random() < 0.5:
+                        sender, receiver = receiver, sender
+                    content = rng.choice(ciphertexts[sender[1], receiver[1]])
+                    yield target_id, sender[0], receiver[0], content, adapt(moment)
+                else:
+                    sender = rng.choice(participants)
+                    content = rng.choice(ciphertexts[sender[1], group_key[0]])
+                    yield target_id, sender[0], content, adapt(moment)
+
+    written = 0
+    for chunk in _chunks(rows(), batch_size):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(statement, chunk)
+        written += len(chunk)
+    return written
+
+
+class Seeder:
+    """Generates one dataset; `run` inserts it and returns the row counts"""
+
+    def __init__(self, log=print, **options):
+        unknown = set(options) - set(DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown options: {', '.join(sorted(unknown))}")
+        for name, value in {**DEFAULTS, **options}.items():
+            setattr(self, name, value)
+        self.log = log
+        self.rng = random.Random(self.seed)
+        self.counts = {}
+
+    def validate(self):
+        if self.users < 2:
+            raise ValueError("Seed at least two users.")
+        if self.workers > 1 and connection.vendor == "sqlite":
+            raise ValueError("SQLite allows one writer at a time; use --workers 1.")
+        if CustomUser.objects.filter(username__startswith=self.prefix).exists():
+            raise ValueError(
+                f"Users named {self.prefix}* already exist; choose another prefix."
+            )
+
+    def run(self):
+        self.validate()
+        started = time.perf_counter()
+        for phase in (
+            self.seed_keys,
+            self.seed_users,
+            self.seed_friendships,
+            self.seed_chats,
+            self.seed_groups,
+            self.seed_listings,
+            self.update_derived_data,
+        ):
+            phase_started = time.perf_counter()
+            phase()
+            self.log(f"{phase.__name__}: {time.perf_counter() - phase_started:.1f}s")
+        self.log(f"Seeded in {time.perf_counter() - started:.1f}s")
+        return self.counts
+
+    def _moment(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.days * 86400)
+
+    def _key(self, position):
+        return position % len(self.keys)
+
+    def _participant(self, position):
+        return (self.user_ids[position], self._key(position))
+
+    def seed_keys(self):
+        self.now = timezone.now()
+        self.keys = generate_key_pool(self.key_pool)
+        self.ciphertexts = encrypt_pool(self.keys)
+
+    def seed_users(self):
+        password = make_password("seed-password")
+        rng = self.rng
+
+        def users():
+            for n in range(self.users):
+                private_key, public_key = self.keys[self._key(n)]
+                date_joined = self._moment()
+                yield CustomUser(
+                    username=f"{self.prefix}{n}",
+                    email=f"{self.prefix}{n}@example.com",
+                    first_name=rng.choice(FIRST_NAMES),
+                    last_name=rng.choice(LAST_NAMES),
+                    password=password,
+                    is_verified=True,
+                    private_key=private_key,
+                    public_key=public_key,
+                    date_joined=date_joined,
+                    updated_at=date_joined,
+                )
+
+        last_id = _last_id(CustomUser)
+        with explicit_timestamps(CustomUser):
+            for chunk in _chunks(users(), self.batch_size):
+                CustomUser.objects.bulk_create(chunk)
+        self.user_ids = _ids_after(CustomUser, last_id)
+        self.counts["users"] = len(self.user_ids)
+
+    def seed_friendships(self):
+        """
+        Pair up "stubs" (one per wanted friend) at random, the configuration
+        model, so friend counts follow the drawn power-law degrees. Self
+        pairs and repeated pairs are dropped.
+        """
+        rng = self.rng
+        stubs = []
+        for position in range(self.users):
+            degree = power_law(
+                rng, self.friend_alpha, self.friends_min, self.friends_max
+            )
+            stubs.extend([position] * min(degree, self.users - 1))
+        rng.shuffle(stubs)
+
+        seen = set()
+        self.accepted_pairs = []
+
+        def pairs():
+            for i in range(0, len(stubs) - 1, 2):
+                a, b = stubs[i], stubs[i + 1]
+                pair = (min(a, b), max(a, b))
+                if a == b or pair in seen:
+                    continue
+                seen.add(pair)
+                yield a, b, rng.random() >= self.pending
+
+        friendships = edges = 0
+        for chunk in _chunks(pairs(), self.batch_size):
+            Friendship.objects.bulk_create(
+                Friendship(
+                    user_id=self.user_ids[a],
+                    friend_id=self.user_ids[b],
+                    is_accepted=accepted,
+                )
+                for a, b, accepted in chunk
+            )
+            accepted = [(a, b) for a, b, is_accepted in chunk if is_accepted]
+            FriendEdge.objects.bulk_create(
+                FriendEdge(user_id=self.user_ids[x], friend_id=self.user_ids[y])
+                for a, b in accepted
+                for x, y in ((a, b), (b, a))
+            )
+            self.accepted_pairs.extend(accepted)
+            friendships += len(chunk)
+            edges += 2 * len(accepted)
+        self.counts["friendships"] = friendships
+        self.counts["friend_edges"] = edges
+
+    def seed_chats(self):
+        """Chats mostly between friends, topped up with random pairs"""
+        rng = self.rng
+        wanted = min(self.chats, self.users * (self.users - 1) // 2)
+        if wanted <= len(self.accepted_pairs):
+            pairs = rng.sample(self.accepted_pairs, wanted)
+        else:
+            pairs = list(self.accepted_pairs)
+            seen = {(min(a, b), max(a, b)) for a, b in pairs}
+            while len(pairs) < wanted:
+                a, b = rng.sample(range(self.users), 2)
+                if (min(a, b), max(a, b)) not in seen:
+                    seen.add((min(a, b), max(a, b)))
+                    pairs.append((a, b))
+        # Chat.get_or_create_chat keeps the lower user id in user1
+        pairs = [(min(a, b), max(a, b)) for a, b in pairs]
+        del self.accepted_pairs
+
+        last_id = _last_id(Chat)
+        for chunk in _chunks(pairs, self.batch_size):
+            Chat.objects.bulk_create(
+                Chat(user1_id=self.user_ids[a], user2_id=self.user_ids[b])
+                for a, b in chunk
+            )
+        chat_ids = _ids_after(Chat, last_id)
+        self.counts["chats"] = len(chat_ids)
+
+        lengths = split_total(rng, self.messages, len(chat_ids), self.chat_alpha)
+        specs = [
+            ("chat", chat_id, [self._participant(a), self._participant(b)], length)
+            for chat_id, (a, b), length in zip(chat_ids, pairs, lengths)
+            if length
+        ]
+        self.counts["messages"] = self._insert_messages(specs)
+
+    def seed_groups(self):
+        rng = self.rng
+        last_id = _last_id(Group)
+        group_keys = [self._key(n) for n in range(self.groups)]
+        members = [
+            rng.sample(
+                range(self.users),
+                min(self.users, power_law(rng, 1.5, 3, self.group_size_max)),
+            )
+            for _ in range(self.groups)
+        ]
+        for chunk in _chunks(range(self.groups), self.batch_size):
+            Group.objects.bulk_create(
+                Group(
+                    name=f"Group {n}",
+                    description="Seeded group",
+                    is_public=rng.random() < 0.3,
+                    created_by_id=self.user_ids[members[n][0]],
+                    private_key=self.keys[group_keys[n]][0],
+                    public_key=self.keys[group_keys[n]][1],
+                )
+                for n in chunk
+            )
+        group_ids = _ids_after(Group, last_id)
+
+        Membership = Group.members.through
+        rows = (
+            Membership(group_id=group_id, customuser_id=self.user_ids[position])
+            for group_id, positions in zip(group_ids, members)
+            for position in positions
+        )
+        memberships = 0
+        for chunk in _chunks(rows, self.batch_size):
+            Membership.objects.bulk_create(chunk)
+            memberships += len(chunk)
+        self.counts["groups"] = len(group_ids)
+        self.counts["group_memberships"] = memberships
+
+        lengths = split_total(rng, self.group_messages, len(group_ids), self.chat_alpha)
+        specs = [
+            (
+                "group",
+                group_id,
+                [self._participant(position) for position in positions],
+                length,
+                key,
+            )
+            for group_id, positions, length, key in zip(
+                group_ids, members, lengths, group_keys
+            )
+            if length
+        ]
+        self.counts["group_messages"] = self._insert_messages(specs)
+
+    def _insert_messages(self, specs):
+        if self.workers <= 1 or len(specs) < self.workers:
+            return insert_messages(
+                specs, self.rng.random(), self.batch_size, self.days, self.ciphertexts
+            )
+        jobs = [
+            (specs[i :: self.workers], self.rng.random(), self.batch_size, self.days)
+            for i in range(self.workers)
+        ]
+        # Workers must open their own connections rather than share ours
+        connections.close_all()
+        with get_context().Pool(
+            self.workers, initializer=_init_worker, initargs=(self.ciphertexts,)
+        ) as pool:
+            return sum(pool.starmap(insert_messages, jobs))
+
+    def seed_listings(self):
+        rng = self.rng
+        # A few prolific sellers and a long tail
+        weights = [rng.paretovariate(1.2) for _ in range(self.users)]
+        cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+
+        def listings():
+            for n in range(self.listings):
+                created_at = self._moment()
+                yield MarketPlace(
+                    name=f"{rng.choice(LISTING_NAMES)} #{n}",
+                    description="Seeded listing",
+                    created_by_id=rng.choices(self.user_ids, cum_weights=cumulative)[0],
+                    price=str(rng.randint(1, 500) * 10),
+                    is_sold=rng.random() < self.sold,
+                    created_at=created_at,
+                    updated_at=created_at,
+                )
+
+        created = 0
+        with explicit_timestamps(MarketPlace, MarketPlaceChange):
+            for chunk in _chunks(listings(), self.batch_size):
+                last_id = _last_id(MarketPlace)
+                MarketPlace.objects.bulk_create(chunk)
+                changes = []
+                for item, item_id in zip(chunk, _ids_after(MarketPlace, last_id)):
+                    changes.append(
+                        MarketPlaceChange(
+                            item_id=item_id,
+                            action=MarketPlaceChange.CREATED,
+                            created_at=item.created_at,
+                        )
+                    )
+                    if item.is_sold:
+                        changes.append(
+                            MarketPlaceChange(
+                                item_id=item_id,
+                                action=MarketPlaceChange.SOLD,
+                                created_at=min(
+                                    self.now,
+                                    item.created_at
+                                    + timedelta(days=rng.expovariate(1 / 7)),
+                                ),
+                            )
+                        )
+                MarketPlaceChange.objects.bulk_create(changes)
+                created += len(chunk)
+        self.counts["listings"] = created
+
+    def update_derived_data(self):
+        """
+        bulk_create bypasses the signals, so rebuild what they would have
+        maintained: the user search index and the dashboard rollups.
+        """
+        users = CustomUser.objects.only("id", "username", "first_name", "last_name")
+        for chunk in _chunks(self.user_ids, 1000):
+            index_users(users.filter(id__in=chunk))
+        stats.rebuild_totals()
+        stats.rebuild_daily()
+        catalog_cache.invalidate()
@@ -1,13 +1,22 @@
 from datetime import datetime
 
 import pyotp
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework import serializers
 
-from .models import (Chat, CustomUser, Friendship, Group, GroupMessage,
-                     MarketPlace, Message)
+from .models import (Chat, CustomUser, DocumentVerification, FriendEdge,
+                     Friendship, Group, GroupMessage, MarketPlace,
+                     MarketPlaceChange, Message)
+from . import suggestions
+from .friends import accept_requests, get_friend_ids
+from .imaging import preferred_variant_url, strip_metadata, variant_urls
+from .storage import (InlineImage, decode_inline_image,
+                      marketplace_image_storage, marketplace_image_url,
+                      save_inline_image)
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -185,15 +194,25 @@ class FriendshipSerializer(serializers.ModelSerializer):
     user_id = serializers.IntegerField(source="user.id", read_only=True)
     user_bio = serializers.CharField(source="user.bio", read_only=True, allow_null=True)
     user_profile_pic = serializers.CharField(source="user.profile_picture", read_only=True, allow_null=True)
+    user_profile_thumbnail = serializers.SerializerMethodField()
 
     class Meta:
         model = Friendship
         fields = [
             "user", "friend", "user_username", "friend_username",
-            "user_id", "user_bio", "user_profile_pic",
+            "user_id", "user_bio", "user_profile_pic", "user_profile_thumbnail",
             "created_at", "is_accepted"
         ]
 
+    def get_user_profile_thumbnail(self, obj):
+        if not obj.user.profile_picture:
+            return None
+        return preferred_variant_url(
+            obj.user.profile_picture.name,
+            obj.user.profile_picture_variants_ready,
+            self.context.get("request"),
+        )
+
     def validate(self, data):
         user = data.get("user")
         friend = data.get("friend")
@@ -213,51 +232,46 @@ class FriendshipSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = validated_data["user"]
         friend = validated_data["friend"]
-        # Check for existing friendships in either direction
-        if Friendship.objects.filter(
-            user=user, friend=friend, is_accepted=True
-        ).exists():
-            raise serializers.ValidationError("You are already friends with this user.")
-        if Friendship.objects.filter(
-            user=friend, friend=user, is_accepted=True
-        ).exists():
-            raise serializers.ValidationError("You are already friends with this user.")
-        if Friendship.objects.filter(
-            user=user, friend=friend, is_accepted=False
-        ).exists():
-            raise serializers.ValidationError("Accept pending friend request.")
-        if Friendship.objects.filter(
-            user=friend, friend=user, is_accepted=False
-        ).exists():
+        # One query finds the pair's row in either direction, if any
+        existing = Friendship.objects.filter(
+            Q(user=user, friend=friend) | Q(user=friend, friend=user)
+        ).values_list("user_id", "is_accepted")
+        for requester_id, is_accepted in existing:
+            if is_accepted:
+                raise serializers.ValidationError(
+                    "You are already friends with this user."
+                )
+            if requester_id == user.id:
+                raise serializers.ValidationError("Accept pending friend request.")
+            raise serializers.ValidationError("Friend request already sent.")
+        try:
+            with transaction.atomic():
+                return Friendship.objects.create(
+                    user=user, friend=friend, is_accepted=False
+                )
+        except IntegrityError:
+            # A concurrent request for the same pair was created first
             raise serializers.ValidationError("Friend request already sent.")
-        friendship = Friendship.objects.create(
-            user=user, friend=friend, is_accepted=False
-        )
-        return friendship
 
     def update_friendship(self, validated_data):
         user = validated_data["user"]
         friend = validated_data["friend"]
-        try:
-            friendship = Friendship.objects.get(
-                user=friend, friend=user, is_accepted=False
-            )
-            friendship.is_accepted = True
-            friendship.save()
-            return friendship
-        except Friendship.DoesNotExist:
+        if not accept_requests(user, [friend.id]):
             raise serializers.ValidationError("No pending friendship request exists.")
 
     def delete(self, instance):
         user = self.validated_data["user"]
         friend = self.validated_data["friend"]
         try:
-            print("trying to get friendship")
             friendship = Friendship.objects.get(
                 Q(user=user, friend=friend) | Q(user=friend, friend=user)
             )
-            print("trying to delete friendship")
-            friendship.delete()
+            with transaction.atomic():
+                was_accepted = friendship.is_accepted
+                friendship.delete()
+                FriendEdge.disconnect(user.id, friend.id)
+                if was_accepted:
+                    suggestions.remove_friendship(user.id, friend.id)
             return {"message": "Friendship deleted successfully."}
         except Friendship.DoesNotExist:
             raise serializers.ValidationError("Friendship does not exist.")
@@ -331,23 +345,24 @@ class GroupSerializer(serializers.ModelSerializer):
                     }
                 )
 
-            instance.add_member(users)
+            instance.add_members(users.values_list("id", flat=True))
 
         return instance
 
-    def remove_member_by_name(self, group_name, member_username):
-        """Remove a specific member from the group using group name and member username"""
+    def remove_member_by_name(self, group, member_username):
+        """Remove a specific member from a group, given as an instance or by name"""
+        if not isinstance(group, Group):
+            group = get_object_or_404(Group, name=group)
 
-        group = get_object_or_404(Group, name=group_name)
-
-        try:
-            member = CustomUser.objects.get(username=member_username)
-        except CustomUser.DoesNotExist:
+        member_id = (
+            CustomUser.objects.filter(username=member_username)
+            .values_list("id", flat=True)
+            .first()
+        )
+        if member_id is None:
             raise serializers.ValidationError("User does not exist.")
 
-        if member in group.members.all():
-            group.members.remove(member)
-        else:
+        if not group.remove_members([member_id]):
             raise serializers.ValidationError("Member not in group.")
 
         return group
@@ -379,6 +394,46 @@ class GroupSerializer(serializers.ModelSerializer):
         return data
 
 
+class GroupListSerializer(GroupSerializer):
+    """
+    Groups without their member list, for sidebars and other list views.
+    Querysets must be annotated with memberships.with_member_count.
+    """
+
+    member_count = serializers.IntegerField(read_only=True)
+
+    class Meta(GroupSerializer.Meta):
+        fields = ["id", "name", "member_count", "created_by"]
+
+
+class DocumentVerificationSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source="user.username", read_only=True)
+    reviewed_by = serializers.CharField(
+        source="reviewed_by.username", read_only=True, default=None
+    )
+
+    class Meta:
+        model = DocumentVerification
+        fields = [
+            "id",
+            "upload_id",
+            "username",
+            "document_type",
+            "filename",
+            "content_type",
+            "size",
+            "received",
+            "sha256",
+            "status",
+            "review_note",
+            "reviewed_by",
+            "created_at",
+            "submitted_at",
+            "reviewed_at",
+        ]
+        read_only_fields = fields
+
+
 class GroupMessageSerializer(serializers.ModelSerializer):
     sender = serializers.SlugRelatedField(
         slug_field="username", queryset=CustomUser.objects.all()
@@ -394,20 +449,8 @@ class GroupMessageSerializer(serializers.ModelSerializer):
         group = validated_data["group"]
         message = validated_data["content"]
 
-        # print(sender, group, message)
-
-        # Ensure sender and group are valid
-        try:
-            sender_user = CustomUser.objects.get(email=sender)
-            group_instance = Group.objects.get(name=group)
-        except (CustomUser.DoesNotExist, Group.DoesNotExist):
-            raise serializers.ValidationError("Sender or group does not exist.")
-
-        # Create the group message instance
-        validated_data["sender"] = sender_user
-        validated_data["group"] = group_instance
-
-        message = GroupMessage().encrypt_message(message, sender_user, group_instance)
+        # The related fields already resolved both to instances
+        message = GroupMessage().encrypt_message(message, sender, group)
         # print(f"Encrypted group message: {message}")
         # print(
         #     "Decrypted group message:",
@@ -416,16 +459,42 @@ class GroupMessageSerializer(serializers.ModelSerializer):
 
         # Save the group message to the database
         validated_data["content"] = message
-        validated_data["timestamp"] = timezone.utc
+        validated_data["timestamp"] = timezone.now()
 
         group_message = GroupMessage.objects.create(**validated_data)
         return group_message
 
 
+class MarketPlaceImageField(serializers.CharField):
+    """
+    Accepts inline (data URI) images or URLs and returns the image URL.
+    Inline images are validated here but only written to storage when the
+    serializer saves, so rejected requests leave no files behind.
+    """
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        try:
+            decoded = decode_inline_image(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        if decoded is not None:
+            return decoded
+        max_length = MarketPlace._meta.get_field("image").max_length
+        if value and len(value) > max_length:
+            raise serializers.ValidationError("Image URL is too long.")
+        return value
+
+    def to_representation(self, value):
+        return marketplace_image_url(value, self.context.get("request"))
+
+
 class MarketPlaceSerializer(serializers.ModelSerializer):
+    image = MarketPlaceImageField(required=False, allow_null=True, allow_blank=True)
     created_by = serializers.SlugRelatedField(
         slug_field="username", queryset=CustomUser.objects.all()
     )
+    image_variants = serializers.SerializerMethodField()
     created_at = serializers.DateTimeField(default=timezone.now, read_only=True)
 
     class Meta:
@@ -436,6 +505,7 @@ class MarketPlaceSerializer(serializers.ModelSerializer):
             "description",
             "price",
             "image",
+            "image_variants",
             "upi_id",
             "created_by",
             "created_at",
@@ -460,21 +530,57 @@ class MarketPlaceSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({"created_by": "User does not exist."})
 
         validated_data["created_by"] = created_by_user
-        item = MarketPlace.objects.create(**validated_data)
-        print(validated_data)
+        with transaction.atomic():
+            # Variants are rendered after commit, once the row exists to mark
+            self.store_image(validated_data)
+            item = MarketPlace.objects.create(**validated_data)
+            MarketPlaceChange.record(item.id, MarketPlaceChange.CREATED)
         return item
 
+    def store_image(self, validated_data):
+        if "image" not in validated_data:
+            return
+        image = validated_data["image"]
+        ready = False
+        if isinstance(image, InlineImage):
+            image, ready = save_inline_image(image)
+        validated_data["image"] = image
+        validated_data["image_variants_ready"] = ready
+
+    def get_image_variants(self, obj):
+        if not marketplace_image_storage.owns(obj.image):
+            return None
+        return variant_urls(
+            obj.image,
+            obj.image_variants_ready,
+            self.context.get("request"),
+            marketplace_image_storage,
+        )
+
     def update(self, instance, validated_data):
         """Update an existing marketplace item"""
-        instance.name = validated_data.get("name", instance.name)
-        instance.description = validated_data.get("description", instance.description)
-        instance.price = validated_data.get("price", instance.price)
-        # Use existing image if not provided in validated_data
-        instance.image = validated_data.get("image", instance.image)
-        print(validated_data.get("image"))
-        instance.upi_id = validated_data.get("upi_id", instance.upi_id)
-        instance.is_sold = validated_data.get("is_sold", instance.is_sold)
-        instance.save()
+        with transaction.atomic():
+            # Variants are rendered after commit, once the row is updated
+            self.store_image(validated_data)
+            instance.name = validated_data.get("name", instance.name)
+            instance.description = validated_data.get(
+                "description", instance.description
+            )
+            instance.price = validated_data.get("price", instance.price)
+            # Use existing image if not provided in validated_data
+            instance.image = validated_data.get("image", instance.image)
+            instance.image_variants_ready = validated_data.get(
+                "image_variants_ready", instance.image_variants_ready
+            )
+            instance.upi_id = validated_data.get("upi_id", instance.upi_id)
+            was_sold = instance.is_sold
+            instance.is_sold = validated_data.get("is_sold", instance.is_sold)
+            if instance.is_sold and not was_sold:
+                action = MarketPlaceChange.SOLD
+            else:
+                action = MarketPlaceChange.UPDATED
+            instance.save()
+            MarketPlaceChange.record(instance.id, action)
         return instance
 
     def validate(self, data):
@@ -522,6 +628,7 @@ class TOTPVerificationSerializer(serializers.Serializer):
 
 class UserProfileSerializer(serializers.ModelSerializer):
     profile_picture_url = serializers.SerializerMethodField()
+    profile_picture_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = CustomUser
@@ -537,6 +644,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
             "is_verified",
             "profile_picture",
             "profile_picture_url",
+            "profile_picture_variants",
             "bio",
             "address",
             "dob",
@@ -550,6 +658,13 @@ class UserProfileSerializer(serializers.ModelSerializer):
             "is_verified",
         ]
 
+    def validate_profile_picture(self, value):
+        """Drop EXIF metadata, such as where the photo was taken, before storing"""
+        if not value:
+            return value
+        value.seek(0)
+        return ContentFile(strip_metadata(value.read()), name=value.name)
+
     def get_profile_picture_url(self, obj):
         if obj.profile_picture:
             request = self.context.get("request")
@@ -558,30 +673,59 @@ class UserProfileSerializer(serializers.ModelSerializer):
             return obj.profile_picture.url
         return None
 
+    def get_profile_picture_variants(self, obj):
+        if not obj.profile_picture:
+            return None
+        return variant_urls(
+            obj.profile_picture.name,
+            obj.profile_picture_variants_ready,
+            self.context.get("request"),
+        )
+
 
 class UserListSerializer(serializers.ModelSerializer):
     profile_picture_url = serializers.SerializerMethodField()
+    profile_picture_variants = serializers.SerializerMethodField()
     is_friend = serializers.SerializerMethodField()
 
     class Meta:
         model = CustomUser
-        fields = ["id", "username", "profile_picture_url", "bio", "is_friend"]
+        fields = [
+            "id",
+            "username",
+            "profile_picture_url",
+            "profile_picture_variants",
+            "bio",
+            "is_friend",
+        ]
 
     def get_profile_picture_url(self, obj):
+        """Lists link to the small thumbnail rather than the full-size original"""
         if obj.profile_picture:
-            request = self.context.get("request")
-            if request:
-                return request.build_absolute_uri(obj.profile_picture.url)
-            return obj.profile_picture.url
+            return preferred_variant_url(
+                obj.profile_picture.name,
+                obj.profile_picture_variants_ready,
+                self.context.get("request"),
+            )
         return None
 
+    def get_profile_picture_variants(self, obj):
+        if not obj.profile_picture:
+            return None
+        return variant_urls(
+            obj.profile_picture.name,
+            obj.profile_picture_variants_ready,
+            self.context.get("request"),
+        )
+
     def get_is_friend(self, obj):
         request = self.context.get("request")
         if not request or not request.user.is_authenticated:
             return False
 
-        # Check if there's an accepted friendship between the users
-        return Friendship.objects.filter(
-            (Q(user=request.user, friend=obj) | Q(user=obj, friend=request.user)),
-            is_accepted=True,
-        ).exists()
+        # The friend ids are looked up once and shared by every listed user
+        friend_ids = self.context.get("friend_ids")
+        if friend_ids is None:
+            friend_ids = get_friend_ids(request.user)
+            self.context["friend_ids"] = friend_ids
+        return obj.id in friend_ids
@@ -0,0 +1,178 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import stats
+from .cache import catalog_cache
+from .friends import invalidate_friend_ids
+from .memberships import invalidate_memberships
+from .models import CustomUser, Friendship, Group, MarketPlace, MarketPlaceChange
+from .storage import release_marketplace_image
+from .user_search import INDEXED_FIELDS, index_users
+
+_bulk_write = ContextVar("bulk_write", default=False)
+
+
+@contextmanager
+def bulk_write():
+    """
+    Silence the per-row marketplace bookkeeping below while a bulk operation
+    makes Django send signals row by row; the caller invalidates the catalog,
+    releases images and adjusts the statistics once for the whole batch.
+    """
+    token = _bulk_write.set(True)
+    try:
+        yield
+    finally:
+        _bulk_write.reset(token)
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def touch_group_on_membership_change(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """Bump Group.updated_at so membership changes invalidate cached listings"""
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # Changed from the user side: instance is a user, pk_set holds group ids
+        groups = Group.objects.filter(pk__in=pk_set or [])
+    else:
+        groups = Group.objects.filter(pk=instance.pk)
+    groups.update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def invalidate_membership_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """Forget cached membership answers for every (group, user) pair changed"""
+    if action == "pre_clear":
+        # clear() reports no ids afterwards, so collect them beforehand
+        if reverse:
+            pk_set = set(instance.group_members.values_list("pk", flat=True))
+        else:
+            pk_set = set(instance.members.values_list("pk", flat=True))
+    elif action not in ("post_add", "post_remove"):
+        return
+    if reverse:
+        pairs = [(group_id, instance.pk) for group_id in pk_set]
+    else:
+        pairs = [(instance.pk, user_id) for user_id in pk_set]
+    transaction.on_commit(lambda: invalidate_memberships(pairs))
+
+
+@receiver(post_save, sender=MarketPlace)
+@receiver(post_delete, sender=MarketPlace)
+def invalidate_catalog_on_item_change(sender, instance, **kwargs):
+    if _bulk_write.get():
+        return
+    # Invalidate after commit so a concurrent rebuild can't cache the old rows
+    transaction.on_commit(catalog_cache.invalidate)
+
+
+@receiver(post_save, sender=MarketPlace)
+def release_replaced_image(sender, instance, created, **kwargs):
+    if created or not instance.field_changed("image"):
+        return
+    old_image = instance.loaded_value("image")
+    if old_image:
+        transaction.on_commit(lambda: release_marketplace_image(old_image))
+
+
+@receiver(post_delete, sender=MarketPlace)
+def release_deleted_image(sender, instance, **kwargs):
+    # Runs for cascaded deletes too, such as a seller's account being removed;
+    # bulk deletes release each distinct image once themselves
+    if _bulk_write.get():
+        return
+    if instance.image:
+        image = instance.image
+        transaction.on_commit(lambda: release_marketplace_image(image))
+
+
+@receiver(post_delete, sender=MarketPlace)
+def record_deleted_item(sender, instance, **kwargs):
+    # Also covers cascades such as a seller's account being removed; bulk
+    # deletes write their tombstones in one go
+    if _bulk_write.get():
+        return
+    MarketPlaceChange.record(instance.id, MarketPlaceChange.DELETED)
+
+
+@receiver(post_save, sender=CustomUser)
+def invalidate_catalog_on_rename(sender, instance, created, **kwargs):
+    # Listings show the seller's username
+    if not created and instance.field_changed("username"):
+        transaction.on_commit(catalog_cache.invalidate)
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def invalidate_friend_cache(sender, instance, **kwargs):
+    invalidate_friend_ids(instance.user_id, instance.friend_id)
+
+
+@receiver(post_save, sender=CustomUser)
+def update_user_search_index(sender, instance, created, update_fields, **kwargs):
+    if update_fields is not None and update_fields.isdisjoint(INDEXED_FIELDS):
+        # Saves of other fields, say of .only() instances, can skip the check
+        return
+    if created or any(instance.field_changed(field) for field in INDEXED_FIELDS):
+        index_users([instance])
+
+
+@receiver(post_save, sender=CustomUser)
+def count_user_save(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust(
+            totals={stats.USERS: 1, stats.ACTIVE_USERS: int(instance.is_active)},
+            daily={stats.SIGNUPS: 1},
+        )
+        return
+    was_active = instance.loaded_value("is_active")
+    if was_active is None or was_active == instance.is_active:
+        return
+    if instance.is_active:
+        stats.adjust(
+            totals={stats.ACTIVE_USERS: 1}, daily={stats.REACTIVATIONS: 1}
+        )
+    else:
+        stats.adjust(
+            totals={stats.ACTIVE_USERS: -1}, daily={stats.DEACTIVATIONS: 1}
+        )
+
+
+@receiver(post_delete, sender=CustomUser)
+def count_user_delete(sender, instance, **kwargs):
+    stats.adjust(
+        totals={stats.USERS: -1, stats.ACTIVE_USERS: -int(instance.is_active)}
+    )
+
+
+@receiver(post_save, sender=MarketPlace)
+def count_item_save(sender, instance, created, **kwargs):
+    if created:
+        stats.adjust(
+            totals={stats.ITEMS: 1, stats.SOLD_ITEMS: int(instance.is_sold)},
+            daily={stats.LISTINGS_CREATED: 1},
+        )
+        return
+    was_sold = instance.loaded_value("is_sold")
+    if was_sold is None or was_sold == instance.is_sold:
+        return
+    if instance.is_sold:
+        stats.adjust(totals={stats.SOLD_ITEMS: 1}, daily={stats.ITEMS_SOLD: 1})
+    else:
+        stats.adjust(totals={stats.SOLD_ITEMS: -1})
+
+
+@receiver(post_delete, sender=MarketPlace)
+def count_item_delete(sender, instance, **kwargs):
+    if _bulk_write.get():
+        return
+    stats.adjust(
+        totals={stats.ITEMS: -1, stats.SOLD_ITEMS: -int(instance.is_sold)}
+    )
@@ -0,0 +1,153 @@
+"""
+Materialized admin dashboard statistics.
+
+Totals live in StatCounter and per-day event counts in DailyStat. Both are
+adjusted by signal handlers as users and listings change, and by bulk
+operations that bypass signals, so the dashboard never counts base tables.
+`rebuild_totals` and `rebuild_daily` recount whatever the base tables can
+reproduce, for backfills and repairs.
+"""
+
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CustomUser, DailyStat, MarketPlace, MarketPlaceChange, StatCounter
+
+# Totals
+USERS = "users"
+ACTIVE_USERS = "active_users"
+ITEMS = "marketplace_items"
+SOLD_ITEMS = "sold_items"
+TOTALS = (USERS, ACTIVE_USERS, ITEMS, SOLD_ITEMS)
+
+# Daily events
+SIGNUPS = "signups"
+DEACTIVATIONS = "deactivations"
+REACTIVATIONS = "reactivations"
+LISTINGS_CREATED = "listings_created"
+ITEMS_SOLD = "items_sold"
+DAILY = (SIGNUPS, DEACTIVATIONS, REACTIVATIONS, LISTINGS_CREATED, ITEMS_SOLD)
+
+
+def _increment(model, delta, **lookup):
+    if not delta:
+        return
+    if model.objects.filter(**lookup).update(value=F("value") + delta):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(value=delta, **lookup)
+    except IntegrityError:
+        # Created concurrently; the row exists now
+        model.objects.filter(**lookup).update(value=F("value") + delta)
+
+
+def adjust(totals=None, daily=None, day=None):
+    """
+    Apply deltas to the rollups: `totals` and `daily` map metric names to
+    signed deltas; daily deltas are booked on `day` (default: today).
+    """
+    for name, delta in (totals or {}).items():
+        _increment(StatCounter, delta, name=name)
+    day = day or timezone.localdate()
+    for name, delta in (daily or {}).items():
+        _increment(DailyStat, delta, day=day, name=name)
+
+
+def get_totals():
+    """
+    Current totals, or None when any counter was never initialised. Signal
+    handlers create a missing counter from their delta alone, so a partial
+    set of counters can't be trusted and needs a rebuild.
+    """
+    values = dict(
+        StatCounter.objects.filter(name__in=TOTALS).values_list("name", "value")
+    )
+    if len(values) < len(TOTALS):
+        return None
+    return {name: values[name] for name in TOTALS}
+
+
+def get_daily(start, end):
+    """Per-day event counts for start..end inclusive, zero-filled"""
+    days = {}
+    day = start
+    while day <= end:
+        days[day] = dict.fromkeys(DAILY, 0)
+        day += timedelta(days=1)
+    rows = DailyStat.objects.filter(day__range=(start, end)).values_list(
+        "day", "name", "value"
+    )
+    for day, name, value in rows:
+        if name in days[day]:
+            days[day][name] = value
+    return [{"date": day.isoformat(), **counts} for day, counts in days.items()]
+
+
+def rebuild_totals():
+    """Recount the totals from the base tables"""
+    users = CustomUser.objects.aggregate(
+        total=Count("id"), active=Count("id", filter=Q(is_active=True))
+    )
+    items = MarketPlace.objects.aggregate(
+        total=Count("id"), sold=Count("id", filter=Q(is_sold=True))
+    )
+    values = {
+        USERS: users["total"],
+        ACTIVE_USERS: users["active"],
+        ITEMS: items["total"],
+        SOLD_ITEMS: items["sold"],
+    }
+    with transaction.atomic():
+        StatCounter.objects.filter(name__in=TOTALS).delete()
+        StatCounter.objects.bulk_create(
+            StatCounter(name=name, value=value) for name, value in values.items()
+        )
+    return values
+
+
+def seed_totals(sender, **kwargs):
+    """post_migrate hook: count the totals before signals start adjusting them"""
+    if get_totals() is None:
+        rebuild_totals()
+
+
+def _daily_counts(queryset, field):
+    return (
+        queryset.order_by()
+        .annotate(day=TruncDate(field))
+        .values("day")
+        .annotate(count=Count("id"))
+        .values_list("day", "count")
+    )
+
+
+def rebuild_daily():
+    """
+    Recount the daily buckets that the base tables can reproduce: signups,
+    listings created and items sold (from the marketplace change log).
+    Deleted users and listings are no longer counted. Activation changes
+    leave no trace in the base tables, so those buckets are kept as recorded.
+    """
+    sources = {
+        SIGNUPS: _daily_counts(CustomUser.objects.all(), "date_joined"),
+        LISTINGS_CREATED: _daily_counts(MarketPlace.objects.all(), "created_at"),
+        ITEMS_SOLD: _daily_counts(
+            MarketPlaceChange.objects.filter(action=MarketPlaceChange.SOLD),
+            "created_at",
+        ),
+    }
+    written = 0
+    with transaction.atomic():
+        DailyStat.objects.filter(name__in=sources).delete()
+        for name, counts in sources.items():
+            rows = [
+                DailyStat(day=day, name=name, value=count) for day, count in counts
+            ]
+            DailyStat.objects.bulk_create(rows, batch_size=1000)
+            written += len(rows)
+    return written
@@ -0,0 +1,225 @@
+import base64
+import binascii
+import fcntl
+import hashlib
+import io
+import os
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .imaging import delete_variants, schedule_variants, strip_metadata
+
+# Matches inline images such as "data:image/png;base64,iVBORw0..."
+DATA_URI_RE = re.compile(
+    r"^data:image/(?P<subtype>[a-zA-Z0-9.+-]+);base64,(?P<data>.*)$", re.DOTALL
+)
+
+IMAGE_EXTENSIONS = {
+    "jpeg": "jpg",
+    "jpg": "jpg",
+    "png": "png",
+    "gif": "gif",
+    "webp": "webp",
+    "bmp": "bmp",
+}
+# Extension stored for each format Pillow detects, whatever the data URI claims
+FORMAT_EXTENSIONS = {
+    "JPEG": "jpg",
+    "PNG": "png",
+    "GIF": "gif",
+    "WEBP": "webp",
+    "BMP": "bmp",
+}
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage under MEDIA_ROOT where each file is named after the SHA-256
+    of its contents, so identical uploads are written to disk only once.
+    """
+
+    def __init__(self, prefix="content", **kwargs):
+        self.prefix = prefix.strip("/")
+        # Names are derived from content, so a concurrent write of the same
+        # name always carries identical bytes and may safely overwrite.
+        kwargs.setdefault("allow_overwrite", True)
+        super().__init__(**kwargs)
+
+    def name_for(self, digest, extension):
+        # Fan out over two directory levels to keep directories small
+        return f"{self.prefix}/{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+    @contextmanager
+    def lock(self, name):
+        """
+        Exclusive lock on a stored name, held across checking for and
+        writing or deleting its file. Names share 256 lock files by digest.
+        """
+        digest = os.path.basename(name)[:2]
+        directory = self.path(f"{self.prefix}/.locks")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{digest}.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def save_bytes(self, data, extension):
+        """Store raw bytes and return (name, created)"""
+        digest = hashlib.sha256(data).hexdigest()
+        name = self.name_for(digest, extension)
+        with self.lock(name):
+            if self.exists(name):
+                return name, False
+            return self.save(name, ContentFile(data)), True
+
+    def restore_bytes(self, name, data):
+        """
+        Write `data` back under `name` if the file was deleted since it was
+        deduplicated onto; returns whether it had to
+        """
+        with self.lock(name):
+            if self.exists(name):
+                return False
+            self.save(name, ContentFile(data))
+            return True
+
+    def owns(self, reference):
+        """Whether a stored reference points into this storage"""
+        return bool(reference) and reference.startswith(f"{self.prefix}/")
+
+
+marketplace_image_storage = ContentAddressedStorage(prefix="marketplace")
+
+# Image bytes decoded from a data URI, not yet written to storage
+InlineImage = namedtuple("InlineImage", ["data", "extension"])
+
+
+def decode_inline_image(value):
+    """
+    Decode and verify a base64 data URI into an InlineImage.
+
+    Returns None when the value is not an inline image (e.g. a plain URL).
+    Raises ValueError for data URIs that are not a supported, readable image.
+    """
+    if not value:
+        return None
+    match = DATA_URI_RE.match(value.strip())
+    if not match:
+        return None
+    extension = IMAGE_EXTENSIONS.get(match.group("subtype").lower())
+    if not extension:
+        raise ValueError(f"Unsupported image type: {match.group('subtype')}")
+    try:
+        data = base64.b64decode(match.group("data"), validate=False)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 image data: {str(e)}")
+    if not data:
+        raise ValueError("Image data is empty.")
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            image.verify()
+    except Exception:
+        raise ValueError("Image data is not a valid image.")
+    if image_format not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unsupported image type: {image_format}")
+    return InlineImage(data, FORMAT_EXTENSIONS[image_format])
+
+
+def save_inline_image(image):
+    """
+    Write a decoded InlineImage to storage, without its EXIF metadata, and
+    return (reference, whether its variants are ready)
+    """
+    from .models import MarketPlace
+
+    data = strip_metadata(image.data)
+    name, created = marketplace_image_storage.save_bytes(data, image.extension)
+    ready = (
+        not created
+        and MarketPlace.objects.filter(image=name, image_variants_ready=True).exists()
+    )
+    if not ready:
+        schedule_variants(name, marketplace_image_storage)
+    if not created:
+        # The last listing using the file may be deleted, and the file
+        # released, before the row referring to it again commits
+        def restore():
+            if marketplace_image_storage.restore_bytes(name, data):
+                MarketPlace.objects.filter(image=name).update(
+                    image_variants_ready=False, updated_at=timezone.now()
+                )
+                schedule_variants(name, marketplace_image_storage)
+
+        transaction.on_commit(restore)
+    return name, ready
+
+
+def inline_image_reference(image):
+    """
+    The metadata-free bytes of a decoded InlineImage and the reference they
+    are stored under, without writing anything yet
+    """
+    data = strip_metadata(image.data)
+    digest = hashlib.sha256(data).hexdigest()
+    return marketplace_image_storage.name_for(digest, image.extension), data
+
+
+def store_images_on_commit(images):
+    """
+    Write {reference: data} pairs from inline_image_reference() once the
+    current transaction commits and queue their variants. Rows inserted
+    referring to them are marked not ready; a rollback writes nothing.
+    """
+    from .models import MarketPlace
+
+    def store():
+        for name, data in images.items():
+            rows = MarketPlace.objects.filter(image=name)
+            written = marketplace_image_storage.restore_bytes(name, data)
+            if not written and rows.filter(image_variants_ready=True).exists():
+                # Shared with listings whose variants are rendered already
+                rows.filter(image_variants_ready=False).update(
+                    image_variants_ready=True, updated_at=timezone.now()
+                )
+            else:
+                schedule_variants(name, marketplace_image_storage)
+
+    if images:
+        transaction.on_commit(store)
+
+
+def release_marketplace_image(reference):
+    """
+    Delete a stored image and its variants once no listing refers to it.
+    Files are shared by every listing with the same image, so they outlive
+    any single one.
+    """
+    from .models import MarketPlace
+
+    if not marketplace_image_storage.owns(reference):
+        return
+    with marketplace_image_storage.lock(reference):
+        if MarketPlace.objects.filter(image=reference).exists():
+            return
+        delete_variants(reference, marketplace_image_storage)
+        marketplace_image_storage.delete(reference)
+
+
+def marketplace_image_url(reference, request=None):
+    """Public URL for a stored image reference"""
+    if not reference:
+        return None
+    if not marketplace_image_storage.owns(reference):
+        # Externally hosted image, stored as a plain URL
+        return reference
+    url = marketplace_image_storage.url(reference)
+    if request:
+        return request.build_absolute_uri(url)
+    return url
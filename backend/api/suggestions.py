@@ -0,0 +1,192 @@
+"""
+Friend-of-friend suggestions.
+
+The batch job counts mutual friends for every pair of users at once as the
+square of the sparse adjacency matrix (A @ A), keeps the top K non-friends
+per user and stores them in FriendSuggestion. Between runs the table is
+adjusted incrementally whenever a friendship is made or removed, so online
+requests only ever read the precomputed rows.
+"""
+
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import FriendEdge, FriendSuggestion
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover - SciPy is optional
+    np = sparse = None
+
+DEFAULT_TOP_K = 50
+# Rows of the adjacency matrix multiplied at a time, bounding peak memory
+ROW_BLOCK_SIZE = 2048
+LOOKUP_CHUNK_SIZE = 900
+
+
+def _chunks(values, size=LOOKUP_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def _friend_ids(user_id):
+    return set(
+        FriendEdge.objects.filter(user_id=user_id).values_list("friend_id", flat=True)
+    )
+
+
+def _load_edges():
+    return FriendEdge.objects.values_list("user_id", "friend_id").iterator(
+        chunk_size=10000
+    )
+
+
+def _top_k_sparse(top_k):
+    """Yield (user_id, suggested_id, mutual_count) using SciPy"""
+    edges = np.fromiter(
+        (value for edge in _load_edges() for value in edge), dtype=np.int64
+    ).reshape(-1, 2)
+    if not len(edges):
+        return
+    user_ids, indices = np.unique(edges, return_inverse=True)
+    indices = indices.reshape(-1, 2)
+    size = len(user_ids)
+    adjacency = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), (indices[:, 0], indices[:, 1])),
+        shape=(size, size),
+    )
+
+    for start in range(0, size, ROW_BLOCK_SIZE):
+        block = adjacency[start : start + ROW_BLOCK_SIZE]
+        mutual = (block @ adjacency).tolil()
+        for offset, (columns, counts) in enumerate(zip(mutual.rows, mutual.data)):
+            row = start + offset
+            friends = set(
+                block.indices[block.indptr[offset] : block.indptr[offset + 1]]
+            )
+            candidates = [
+                (count, column)
+                for column, count in zip(columns, counts)
+                if column != row and column not in friends
+            ]
+            candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+            for count, column in candidates[:top_k]:
+                yield int(user_ids[row]), int(user_ids[column]), int(count)
+
+
+def _top_k_python(top_k):
+    """Yield (user_id, suggested_id, mutual_count) with plain dicts and sets"""
+    friends = defaultdict(set)
+    for user_id, friend_id in _load_edges():
+        friends[user_id].add(friend_id)
+    for user_id, own_friends in friends.items():
+        mutual = Counter()
+        for friend_id in own_friends:
+            mutual.update(friends[friend_id])
+        mutual.pop(user_id, None)
+        for friend_id in own_friends:
+            mutual.pop(friend_id, None)
+        ranked = sorted(mutual.items(), key=lambda item: (-item[1], item[0]))
+        for suggested_id, count in ranked[:top_k]:
+            yield user_id, suggested_id, count
+
+
+def compute_all(top_k=DEFAULT_TOP_K, use_scipy=True, batch_size=5000):
+    """Recompute the whole suggestion table; returns the number of rows written"""
+    rows = _top_k_sparse(top_k) if use_scipy and sparse else _top_k_python(top_k)
+    written = 0
+    with transaction.atomic():
+        FriendSuggestion.objects.all().delete()
+        batch = []
+        for user_id, suggested_id, count in rows:
+            batch.append(
+                FriendSuggestion(
+                    user_id=user_id, suggested_id=suggested_id, mutual_count=count
+                )
+            )
+            if len(batch) >= batch_size:
+                FriendSuggestion.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        FriendSuggestion.objects.bulk_create(batch)
+        written += len(batch)
+    return written
+
+
+def _adjust(user_ids, other_id, delta):
+    """Add `delta` mutual friends between `other_id` and each of `user_ids`"""
+    for chunk in _chunks(user_ids):
+        pairs = FriendSuggestion.objects.filter(
+            user_id__in=chunk, suggested_id=other_id
+        ) | FriendSuggestion.objects.filter(user_id=other_id, suggested_id__in=chunk)
+        pairs.update(mutual_count=F("mutual_count") + delta)
+        if delta > 0:
+            new_rows = []
+            for user_id in chunk:
+                new_rows.append(
+                    FriendSuggestion(
+                        user_id=user_id, suggested_id=other_id, mutual_count=delta
+                    )
+                )
+                new_rows.append(
+                    FriendSuggestion(
+                        user_id=other_id, suggested_id=user_id, mutual_count=delta
+                    )
+                )
+            # Pairs that already existed were updated above and are skipped
+            FriendSuggestion.objects.bulk_create(new_rows, ignore_conflicts=True)
+    if delta < 0:
+        # Pairs left without mutual friends are no longer suggestions
+        FriendSuggestion.objects.filter(user_id=other_id, mutual_count__lte=0).delete()
+        for chunk in _chunks(user_ids):
+            FriendSuggestion.objects.filter(
+                user_id__in=chunk, suggested_id=other_id, mutual_count__lte=0
+            ).delete()
+
+
+def _forget_pair(user_id, friend_id):
+    FriendSuggestion.objects.filter(
+        user_id__in=(user_id, friend_id), suggested_id__in=(user_id, friend_id)
+    ).delete()
+
+
+def record_friendship(user_id, friend_id):
+    """
+    Update suggestions after two users became friends. Call after the new
+    FriendEdge rows exist, inside the same transaction.
+    """
+    friends_of_user = _friend_ids(user_id) - {friend_id}
+    friends_of_friend = _friend_ids(friend_id) - {user_id}
+    _forget_pair(user_id, friend_id)
+    # `user_id` is now a mutual friend of `friend_id` and each of its friends
+    _adjust(friends_of_user - friends_of_friend - {friend_id}, friend_id, 1)
+    _adjust(friends_of_friend - friends_of_user - {user_id}, user_id, 1)
+
+
+def remove_friendship(user_id, friend_id):
+    """
+    Update suggestions after a friendship ended. Call after the FriendEdge
+    rows were deleted, inside the same transaction.
+    """
+    friends_of_user = _friend_ids(user_id)
+    friends_of_friend = _friend_ids(friend_id)
+    _adjust(friends_of_user - friends_of_friend - {friend_id}, friend_id, -1)
+    _adjust(friends_of_friend - friends_of_user - {user_id}, user_id, -1)
+    # The former friends may now suggest each other
+    mutual = len(friends_of_user & friends_of_friend)
+    if mutual:
+        FriendSuggestion.objects.bulk_create(
+            [
+                FriendSuggestion(
+                    user_id=user_id, suggested_id=friend_id, mutual_count=mutual
+                ),
+                FriendSuggestion(
+                    user_id=friend_id, suggested_id=user_id, mutual_count=mutual
+                ),
+            ],
+            ignore_conflicts=True,
+        )
@@ -1,3 +1,1338 @@
-from django.test import TestCase
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api import audit, documents, imaging, metrics, stats, suggestions
+from api.budgets import QueryBudget, QueryLog
+from api.bulk import import_listings
+from api.friends import accept_requests, get_friend_ids
+from api.models import (
+    AuditEvent,
+    Chat,
+    CustomUser,
+    DocumentVerification,
+    FriendEdge,
+    Friendship,
+    FriendSuggestion,
+    Group,
+    GroupMessage,
+    MarketPlace,
+    MarketPlaceChange,
+    Message,
+    StatCounter,
+)
+from api.pagination import encode_cursor
+from api.serializers import MarketPlaceSerializer
+from api.storage import (
+    decode_inline_image,
+    inline_image_reference,
+    marketplace_image_storage,
+    release_marketplace_image,
+    save_inline_image,
+)
+
+
+def make_user(username, **fields):
+    fields.setdefault("is_verified", True)
+    return CustomUser.objects.create_user(
+        email=f"{username}@example.com", username=username, password="pw", **fields
+    )
+
+
+def image_data_uri(color="red", camera=None):
+    """A small JPEG as a data URI, optionally carrying EXIF metadata"""
+    exif = Image.Exif()
+    if camera:
+        exif[0x0110] = camera  # Model
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), color).save(buffer, "JPEG", exif=exif)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f"data:image/jpeg;base64,{encoded}"
+
+
+@override_settings(AUDIT_LOG_BUFFERED=False)
+class APITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user("alice")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class GroupMembershipTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.group = Group.objects.create(name="hikers", created_by=self.user)
+        self.group.add_members([self.user.pk])
+
+    def test_removed_member_loses_access(self):
+        url = f"/api/groups/{self.group.pk}/"
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # The test transaction never commits, so the on_commit invalidation
+        # doesn't run, as in a worker whose local cache missed it
+        self.group.remove_members([self.user.pk])
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_added_member_gains_access(self):
+        other = make_user("bob")
+        self.client.force_authenticate(other)
+        url = f"/api/groups/{self.group.pk}/"
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.group.add_members([other.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class DashboardTotalsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+
+    def test_cleared_counters_are_rebuilt(self):
+        make_user("bob")
+        StatCounter.objects.all().delete()
+        # The signal handlers recreate a "users" counter from this delta alone
+        make_user("carol")
+        response = self.client.get("/api/admin/dashboard/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total_users"], 3)
+        self.assertEqual(stats.get_totals()[stats.USERS], 3)
+
+
+class AuditLogTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = make_user("root", is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def log(self, action, actor=None, days_ago=0, **fields):
+        audit.record(action, actor=actor, **fields)
+        event = AuditEvent.objects.latest("id")
+        if days_ago:
+            event.created_at = timezone.now() - timedelta(days=days_ago)
+            event.save()
+        return event
+
+    def test_record_writes_synchronously(self):
+        audit.record(
+            AuditEvent.LOGIN_FAILED, actor=self.user, target="x" * 300, reason="pw"
+        )
+        event = AuditEvent.objects.get()
+        self.assertEqual(event.action, AuditEvent.LOGIN_FAILED)
+        self.assertEqual(event.actor_id, self.user.pk)
+        self.assertEqual(len(event.target), 254)
+        self.assertEqual(event.detail, {"reason": "pw"})
+
+    def test_filters(self):
+        failed = self.log(AuditEvent.LOGIN_FAILED, target="a@example.com")
+        limited = self.log(AuditEvent.LOGIN_RATE_LIMITED)
+        old = self.log(AuditEvent.ADMIN_EXPORT, actor=self.admin, days_ago=10)
+
+        def ids(**params):
+            response = self.client.get("/api/admin/audit-log/", params)
+            self.assertEqual(response.status_code, 200)
+            return [row["id"] for row in response.data["results"]]
+
+        self.assertEqual(ids(action=AuditEvent.LOGIN_FAILED), [failed.id])
+        self.assertEqual(ids(action="login."), [limited.id, failed.id])
+        self.assertEqual(ids(actor=self.admin.pk), [old.id])
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        self.assertEqual(ids(since=since), [limited.id, failed.id])
+        self.assertEqual(ids(until=since), [old.id])
+
+    def test_ip_filter(self):
+        event = self.log(AuditEvent.LOGIN_FAILED)
+        AuditEvent.objects.filter(pk=event.pk).update(ip="2001:db8::1")
+        self.log(AuditEvent.LOGIN_FAILED)
+        # Matched however the address is spelled
+        response = self.client.get(
+            "/api/admin/audit-log/", {"ip": "2001:DB8:0:0:0:0:0:1"}
+        )
+        self.assertEqual([row["id"] for row in response.data["results"]], [event.id])
+        for ip in ("localhost", "300.1.1.1", "1.2.3.4/24"):
+            response = self.client.get("/api/admin/audit-log/", {"ip": ip})
+            self.assertEqual(response.status_code, 400, ip)
+
+    def test_pagination(self):
+        events = [self.log(AuditEvent.LOGIN_FAILED) for _ in range(3)]
+        response = self.client.get("/api/admin/audit-log/", {"limit": 2})
+        self.assertEqual(len(response.data["results"]), 2)
+        response = self.client.get(
+            "/api/admin/audit-log/",
+            {"limit": 2, "cursor": response.data["next_cursor"]},
+        )
+        results = response.data["results"]
+        self.assertEqual([row["id"] for row in results], [events[0].id])
+        self.assertIsNone(response.data["next_cursor"])
+
+    def test_malformed_cursor(self):
+        for values in (["x"], [], [1, 2]):
+            response = self.client.get(
+                "/api/admin/audit-log/", {"cursor": encode_cursor(values)}
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_prune_audit_log(self):
+        kept = self.log(AuditEvent.LOGIN_FAILED, days_ago=5)
+        for _ in range(3):
+            self.log(AuditEvent.LOGIN_FAILED, days_ago=40)
+        call_command("prune_audit_log", days=30, batch_size=2, stdout=StringIO())
+        remaining = AuditEvent.objects.values_list("id", flat=True)
+        self.assertEqual(list(remaining), [kept.id])
+
+    @override_settings(RATELIMIT_ENABLE=True)
+    def test_rate_limited_login_is_audited(self):
+        self.client.force_authenticate(None)
+        data = {"email": "alice@example.com", "password": "wrong"}
+        statuses = [self.client.post("/api/login/", data).status_code for _ in range(6)]
+        self.assertEqual(statuses[-1], 429)
+        event = AuditEvent.objects.get(action=AuditEvent.LOGIN_RATE_LIMITED)
+        self.assertEqual(event.target, "alice@example.com")
+
+
+class DocumentUploadTests(APITestCase):
+    def start(self, size=10):
+        response = self.client.post(
+            "/api/documents/",
+            {
+                "document_type": "passport",
+                "filename": "scan.pdf",
+                "content_type": "application/pdf",
+                "size": size,
+            },
+            format="json",
+        )
+        return response
+
+    def put(self, upload_id, offset, data):
+        return self.client.put(
+            f"/api/documents/uploads/{upload_id}/",
+            data,
+            content_type="application/octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_chunked_upload(self):
+        upload_id = self.start().data["upload_id"]
+        self.assertEqual(self.put(upload_id, 0, b"hello").status_code, 200)
+        self.assertEqual(self.put(upload_id, 0, b"hello").status_code, 409)
+        self.assertEqual(self.put(upload_id, 5, b"world").status_code, 200)
+        response = self.client.post(
+            f"/api/documents/uploads/{upload_id}/complete/",
+            {"sha256": hashlib.sha256(b"helloworld").hexdigest()},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], DocumentVerification.PENDING)
+
+    def test_chunk_refused_while_another_is_written(self):
+        upload_id = self.start().data["upload_id"]
+        document = DocumentVerification.objects.get(upload_id=upload_id)
+        with documents.locked_file(document):
+            self.assertEqual(self.put(upload_id, 0, b"hello").status_code, 409)
+        self.assertEqual(self.put(upload_id, 0, b"hello").status_code, 200)
+
+    def test_open_uploads_are_capped(self):
+        for _ in range(documents.MAX_OPEN_UPLOADS):
+            self.assertEqual(self.start().status_code, 201)
+        self.assertEqual(self.start().status_code, 409)
+
+    def test_cleanup_stale_uploads(self):
+        stale_id = self.start().data["upload_id"]
+        self.put(stale_id, 0, b"hello")
+        fresh_id = self.start().data["upload_id"]
+        DocumentVerification.objects.filter(upload_id=stale_id).update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        stale = DocumentVerification.objects.get(upload_id=stale_id)
+        path = documents.document_path(stale)
+
+        call_command("cleanup_stale_uploads", hours=24, stdout=StringIO())
+        self.assertFalse(os.path.exists(path))
+        remaining = DocumentVerification.objects.values_list("upload_id", flat=True)
+        self.assertEqual([str(upload_id) for upload_id in remaining], [fresh_id])
+
+
+class MarketplaceImageTestCase(APITestCase):
+    """Stores images under a temporary MEDIA_ROOT and renders variants inline"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        patcher = mock.patch.object(imaging, "_executor")
+        executor = patcher.start()
+        self.addCleanup(patcher.stop)
+        executor.submit.side_effect = lambda task, name, storage: (
+            imaging.generate_variants(name, storage)
+        )
+
+    def create_listing(self, image, name="lamp"):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/marketplace/",
+                {
+                    "name": name,
+                    "price": "10",
+                    "image": image,
+                    "upi_id": "alice@upi",
+                    "created_by": self.user.username,
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 201, response.data)
+        return MarketPlace.objects.get(pk=response.data["id"])
+
+    def delete_listing(self, item):
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+
+
+class MarketplaceImageTests(MarketplaceImageTestCase):
+    def test_identical_images_share_one_file(self):
+        first = self.create_listing(image_data_uri())
+        second = self.create_listing(image_data_uri(), name="chair")
+        self.assertEqual(first.image, second.image)
+        self.assertTrue(marketplace_image_storage.exists(first.image))
+        self.assertTrue(second.image_variants_ready)
+
+    def test_file_is_released_with_its_last_listing(self):
+        first = self.create_listing(image_data_uri())
+        second = self.create_listing(image_data_uri(), name="chair")
+        variant = imaging.variant_name(first.image, "thumb", "webp")
+        self.delete_listing(first)
+        self.assertTrue(marketplace_image_storage.exists(first.image))
+        self.delete_listing(second)
+        self.assertFalse(marketplace_image_storage.exists(first.image))
+        self.assertFalse(marketplace_image_storage.exists(variant))
+
+    def test_file_released_during_dedup_is_restored(self):
+        first = self.create_listing(image_data_uri())
+        with self.captureOnCommitCallbacks(execute=True):
+            name, _ = save_inline_image(decode_inline_image(image_data_uri()))
+            # The only listing goes before the new one is saved
+            MarketPlace.objects.filter(pk=first.pk).delete()
+            release_marketplace_image(name)
+            self.assertFalse(marketplace_image_storage.exists(name))
+            second = MarketPlace.objects.create(
+                name="chair", created_by=self.user, image=name
+            )
+        self.assertTrue(marketplace_image_storage.exists(name))
+        second.refresh_from_db()
+        self.assertTrue(second.image_variants_ready)
+
+    def test_extract_inline_images(self):
+        inline = image_data_uri(camera="Secret Camera")
+        item = MarketPlace.objects.create(
+            name="lamp", created_by=self.user, image=inline
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("extract_marketplace_images", stdout=StringIO())
+        item.refresh_from_db()
+        self.assertTrue(marketplace_image_storage.owns(item.image))
+        self.assertTrue(item.image_variants_ready)
+        with marketplace_image_storage.open(item.image) as f, Image.open(f) as image:
+            self.assertFalse(image.getexif())
+        # Uploading the same picture now reuses the extracted file
+        self.assertEqual(self.create_listing(inline, name="desk").image, item.image)
+
+
+class CatalogVariantTests(MarketplaceImageTestCase):
+    def test_listing_shows_variants_once_rendered(self):
+        with mock.patch.object(imaging, "generate_variants"):
+            item = self.create_listing(image_data_uri())
+        listing = self.client.get("/api/marketplace/").data
+        self.assertIsNone(listing[0]["image_variants"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            imaging.generate_variants(item.image, marketplace_image_storage)
+        listing = self.client.get("/api/marketplace/").data
+        self.assertIn("thumb", listing[0]["image_variants"])
+
+
+class MarketplaceSearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.lamp = MarketPlace.objects.create(
+            name="Desk lamp", description="Bright", price="15", created_by=self.user
+        )
+        self.chair = MarketPlace.objects.create(
+            name="Chair",
+            description="Comes with a lamp",
+            price="40",
+            created_by=self.user,
+        )
+
+    def search(self, **params):
+        response = self.client.get("/api/marketplace/search/", params)
+        self.assertEqual(response.status_code, 200)
+        return [item["id"] for item in response.data["results"]]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search(q="lamp"), [self.lamp.id, self.chair.id])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.chair.name = "Armchair"
+        self.chair.description = "Soft"
+        self.chair.save()
+        self.lamp.delete()
+        self.assertEqual(self.search(q="lamp"), [])
+        self.assertEqual(self.search(q="armchair"), [self.chair.id])
+
+    def test_price_filter(self):
+        self.assertEqual(self.search(q="lamp", max_price="20"), [self.lamp.id])
+        response = self.client.get(
+            "/api/marketplace/search/", {"q": "lamp", "min_price": "nan"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_is_required(self):
+        response = self.client.get("/api/marketplace/search/", {"q": " "})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(APITestCase):
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_marketplace_list(self):
+        item = MarketPlace.objects.create(name="lamp", created_by=self.user)
+        response = self.client.get("/api/marketplace/")
+        etag = response["ETag"]
+        self.assertEqual(self.revalidate("/api/marketplace/", etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.name = "desk lamp"
+            item.save()
+        response = self.revalidate("/api/marketplace/", etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]["name"], "desk lamp")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_friend_requests_follow_requester_profile(self):
+        bob = make_user("bob")
+        Friendship.objects.create(user=bob, friend=self.user)
+        response = self.client.get("/api/friendships/")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertEqual(self.revalidate("/api/friendships/", etag).status_code, 304)
+
+        bob.bio = "hello"
+        bob.save()
+        response = self.revalidate("/api/friendships/", etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_other_users_do_not_share_versions(self):
+        MarketPlace.objects.create(name="lamp", created_by=self.user)
+        etag = self.client.get("/api/marketplace/")["ETag"]
+        self.client.force_authenticate(make_user("bob"))
+        self.assertEqual(self.revalidate("/api/marketplace/", etag).status_code, 200)
+
+
+class MarketplaceChangeFeedTests(APITestCase):
+    def changes(self, since=0, **params):
+        response = self.client.get(
+            "/api/marketplace/changes/", {"since": since, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def create_listing(self, name):
+        response = self.client.post(
+            "/api/marketplace/",
+            {"name": name, "upi_id": "alice@upi", "created_by": "alice"},
+            format="json",
+        )
+        return response.data["id"]
+
+    @override_settings(MARKETPLACE_SYNC_SAFETY_WINDOW=0)
+    def test_feed_replays_writes_in_order(self):
+        seller = make_user("bob")
+        self.client.force_authenticate(seller)
+        response = self.client.post(
+            "/api/marketplace/",
+            {"name": "lamp", "upi_id": "bob@upi", "created_by": "bob"},
+            format="json",
+        )
+        item = MarketPlace.objects.get(pk=response.data["id"])
+        serializer = MarketPlaceSerializer(item, {"is_sold": True}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        feed = self.changes()
+        self.assertEqual(
+            [change["action"] for change in feed["changes"]],
+            [MarketPlaceChange.CREATED, MarketPlaceChange.SOLD],
+        )
+        self.assertTrue(feed["items"][0]["is_sold"])
+
+        # Deleting the seller cascades to the listing and leaves a tombstone
+        seller.delete()
+        feed = self.changes(since=feed["next_since"])
+        self.assertEqual(feed["changes"][0]["action"], MarketPlaceChange.DELETED)
+        self.assertEqual(feed["deleted"], [item.id])
+        self.assertEqual(feed["items"], [])
+
+    @override_settings(MARKETPLACE_SYNC_SAFETY_WINDOW=0)
+    def test_pages_follow_next_since(self):
+        ids = [self.create_listing(name) for name in ("lamp", "desk", "chair")]
+        first = self.changes(limit=2)
+        self.assertTrue(first["has_more"])
+        second = self.changes(since=first["next_since"], limit=2)
+        self.assertFalse(second["has_more"])
+        seen = [c["item_id"] for c in first["changes"] + second["changes"]]
+        self.assertEqual(seen, ids)
+
+    @override_settings(MARKETPLACE_SYNC_SAFETY_WINDOW=60)
+    def test_cursor_holds_back_recent_changes(self):
+        self.create_listing("lamp")
+        feed = self.changes()
+        self.assertEqual(len(feed["changes"]), 1)
+        self.assertEqual(feed["next_since"], 0)
+        self.assertEqual(self.client.get("/api/marketplace/")["X-Change-Sequence"], "0")
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/marketplace/changes/", {"since": "x"})
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogCacheTests(APITestCase):
+    url = "/api/marketplace/available/"
+
+    def setUp(self):
+        super().setUp()
+        self.item = MarketPlace.objects.create(name="lamp", created_by=self.user)
+
+    def names(self):
+        return [item["name"] for item in self.client.get(self.url).data]
+
+    def test_catalog_is_served_from_cache(self):
+        self.assertEqual(self.names(), ["lamp"])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ["lamp"])
+
+    def test_item_changes_invalidate_on_commit(self):
+        self.names()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.is_sold = True
+            self.item.save()
+            # Until the change commits, readers keep the cached listing
+            self.assertEqual(self.names(), ["lamp"])
+        self.assertEqual(self.names(), [])
+
+    def test_seller_rename_invalidates(self):
+        self.names()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = "alicia"
+            self.user.save()
+        listing = self.client.get(self.url).data
+        self.assertEqual(listing[0]["created_by"], "alicia")
+
+    def test_deleted_items_invalidate(self):
+        self.names()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.delete()
+        self.assertEqual(self.names(), [])
+
+
+class MarketplaceBulkTests(MarketplaceImageTestCase):
+    url = "/api/marketplace/bulk/"
+
+    def upload(self, content, filename="items.csv", **params):
+        query = f"?strict={params['strict']}" if "strict" in params else ""
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                self.url + query,
+                {"file": SimpleUploadedFile(filename, content.encode())},
+                format="multipart",
+            )
+
+    def test_csv_import(self):
+        MarketPlace.objects.create(name="lamp", created_by=self.user)
+        response = self.upload(
+            "name,price,upi_id\ndesk,20,alice@upi\nlamp,5,alice@upi\nchair,9,\n"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual([e["row"] for e in response.data["errors"]], [2, 3])
+        desk = MarketPlace.objects.get(name="desk")
+        self.assertEqual(desk.created_by, self.user)
+        self.assertTrue(
+            MarketPlaceChange.objects.filter(
+                item_id=desk.id, action=MarketPlaceChange.CREATED
+            ).exists()
+        )
+
+    def test_strict_import_rejects_the_whole_file(self):
+        response = self.upload("name,upi_id\ndesk,alice@upi\nchair,\n", strict="true")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MarketPlace.objects.filter(name="desk").exists())
+
+    def test_ndjson_import_stores_images_after_commit(self):
+        rows = [
+            {"name": "desk", "upi_id": "alice@upi", "image": image_data_uri()},
+            {"name": "chair", "upi_id": "alice@upi", "image": image_data_uri()},
+        ]
+        content = "".join(json.dumps(row) + "\n" for row in rows)
+        response = self.upload(content, filename="items.ndjson")
+        self.assertEqual(response.data["created"], 2)
+        desk, chair = MarketPlace.objects.order_by("id")
+        self.assertEqual(desk.image, chair.image)
+        self.assertTrue(marketplace_image_storage.exists(desk.image))
+        self.assertTrue(desk.image_variants_ready)
+
+    def test_rolled_back_import_leaves_no_files(self):
+        rows = [{"name": "desk", "upi_id": "alice@upi", "image": image_data_uri()}]
+        name, _ = inline_image_reference(decode_inline_image(image_data_uri()))
+        failing = mock.patch.object(
+            MarketPlaceChange.objects, "bulk_create", side_effect=RuntimeError
+        )
+        with self.captureOnCommitCallbacks(execute=True), failing:
+            with self.assertRaises(RuntimeError):
+                import_listings(rows, seller=self.user)
+        self.assertFalse(marketplace_image_storage.exists(name))
+
+    def test_ids_read_back_in_insert_order(self):
+        # Rows named alike by another seller must not be picked up
+        MarketPlace.objects.create(name="b", created_by=make_user("bob"))
+        rows = [{"name": name, "upi_id": "alice@upi"} for name in ("c", "a")]
+        with mock.patch.object(
+            type(connection.features),
+            "can_return_rows_from_bulk_insert",
+            new_callable=mock.PropertyMock,
+            return_value=False,
+        ):
+            import_listings(rows, seller=self.user)
+        changes = MarketPlaceChange.objects.order_by("id")
+        names = [MarketPlace.objects.get(pk=c.item_id).name for c in changes]
+        self.assertEqual(names, ["c", "a"])
+
+    def test_export(self):
+        MarketPlace.objects.create(name="lamp", price="5", created_by=self.user)
+        response = self.client.get(self.url, {"fmt": "ndjson"})
+        rows = [json.loads(line) for line in response.streaming_content]
+        self.assertEqual(rows[0]["name"], "lamp")
+        self.assertEqual(rows[0]["created_by"], "alice")
+
+        response = self.client.get(self.url)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:3], ["id", "name", "description"])
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(self.client.get(self.url, {"fmt": "xml"}).status_code, 400)
+
+
+class FriendIdsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = make_user("bob")
+        Friendship.objects.create(user=self.bob, friend=self.user)
+
+    def fresh(self, user):
+        return CustomUser.objects.get(pk=user.pk)
+
+    def test_cached_set_is_reused(self):
+        self.assertEqual(get_friend_ids(self.user), frozenset())
+        with self.assertNumQueries(0):
+            get_friend_ids(self.user)
+
+    def test_stale_set_is_not_used_once_the_user_changes(self):
+        self.assertEqual(get_friend_ids(self.fresh(self.user)), frozenset())
+        # The commit that would clear this worker's entry never comes,
+        # as in a worker other than the one accepting the request
+        accept_requests(self.user)
+        self.assertEqual(get_friend_ids(self.fresh(self.user)), {self.bob.pk})
+        self.assertEqual(get_friend_ids(self.fresh(self.bob)), {self.user.pk})
+
+    def test_saving_a_stale_instance_keeps_the_version(self):
+        stale = self.fresh(self.user)
+        accept_requests(self.user)
+        stale.bio = "hello"
+        stale.save()
+        self.assertGreater(self.fresh(self.user).friends_version, stale.friends_version)
+
+    def test_user_list_reports_friends(self):
+        self.client.get("/api/users/")
+        accept_requests(self.user)
+        # Authentication loads the user afresh on every request
+        self.client.force_authenticate(self.fresh(self.user))
+        users = self.client.get("/api/users/").data["users"]
+        is_friend = {user["username"]: user["is_friend"] for user in users}
+        self.assertTrue(is_friend["bob"])
+
+
+class UserSearchTests(APITestCase):
+    url = "/api/users/search/"
+
+    def setUp(self):
+        super().setUp()
+        self.anna = make_user("anna", first_name="Anna", last_name="Andrews")
+        self.andy = make_user("andy", first_name="Andy")
+        self.john = make_user("johnny", first_name="John")
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def usernames(self, **params):
+        return [user["username"] for user in self.search(**params)["results"]]
+
+    def test_prefix_pages_list_each_user_once(self):
+        first = self.search(q="an", limit=1)
+        second = self.search(q="an", limit=1, cursor=first["next_cursor"])
+        # Anna comes first on "andrews", and isn't repeated for "anna"
+        self.assertEqual(
+            [user["username"] for user in first["results"] + second["results"]],
+            ["anna", "andy"],
+        )
+        self.assertIsNone(second["next_cursor"])
+
+    def test_index_follows_renames_and_deactivation(self):
+        self.andy.first_name = "Bert"
+        self.andy.username = "bert"
+        self.andy.save()
+        self.anna.is_active = False
+        self.anna.save()
+        self.assertEqual(self.usernames(q="an"), [])
+        self.assertEqual(self.usernames(q="ber"), ["bert"])
+
+    def test_fuzzy_matches_typos(self):
+        self.assertEqual(self.usernames(q="jonh", mode="fuzzy"), ["johnny"])
+
+    def test_invalid_requests(self):
+        for params in (
+            {"q": ""},
+            {"q": "an", "mode": "regex"},
+            {"q": "an", "cursor": "garbage"},
+            {"q": "an", "mode": "fuzzy", "cursor": encode_cursor(["x", 1])},
+        ):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class FriendEdgeTests(APITestCase):
+    def befriend(self, *users):
+        for user in users:
+            Friendship.objects.create(user=user, friend=self.user)
+        accept_requests(self.user)
+
+    def friend_names(self, url="/api/friends/", **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return [user["username"] for user in response.data["results"]]
+
+    def test_accept_and_unfriend_through_the_api(self):
+        bob = make_user("bob")
+        self.client.force_authenticate(bob)
+        response = self.client.post(
+            "/api/friendships/", {"friend": "alice"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(FriendEdge.objects.exists())
+
+        self.client.force_authenticate(self.user)
+        response = self.client.put("/api/friendships/", {"friend": "bob"})
+        self.assertEqual(response.status_code, 204)
+        edges = FriendEdge.objects.values_list("user_id", "friend_id")
+        self.assertEqual(set(edges), {(self.user.pk, bob.pk), (bob.pk, self.user.pk)})
+        self.assertEqual(self.friend_names(), ["bob"])
+        self.assertEqual(self.friend_names(f"/api/users/{bob.pk}/friends/"), ["alice"])
+
+        response = self.client.delete("/api/friendships/", {"friend": "bob"})
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(FriendEdge.objects.exists())
+
+    def test_friend_list_pages_and_hides_inactive_friends(self):
+        bob, carol, dave = (make_user(name) for name in ("bob", "carol", "dave"))
+        self.befriend(bob, carol, dave)
+        carol.is_active = False
+        carol.save()
+
+        response = self.client.get("/api/friends/", {"limit": 1})
+        self.assertEqual(response.data["results"][0]["username"], "bob")
+        cursor = response.data["next_cursor"]
+        self.assertEqual(self.friend_names(cursor=cursor), ["dave"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/friends/", {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 400)
+
+
+class FriendSuggestionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob, self.carol, self.dave, self.erin = (
+            make_user(name) for name in ("bob", "carol", "dave", "erin")
+        )
+        for user, friend in (
+            (self.user, self.bob),
+            (self.bob, self.carol),
+            (self.bob, self.dave),
+            (self.user, self.erin),
+            (self.erin, self.carol),
+        ):
+            Friendship.objects.create(user=user, friend=friend)
+            accept_requests(friend, [user.pk])
+
+    def table(self):
+        return set(
+            FriendSuggestion.objects.values_list(
+                "user_id", "suggested_id", "mutual_count"
+            )
+        )
+
+    def test_incremental_updates_match_the_batch_job(self):
+        incremental = self.table()
+        self.assertIn((self.user.pk, self.carol.pk, 2), incremental)
+        self.assertIn((self.user.pk, self.dave.pk, 1), incremental)
+        suggestions.compute_all(use_scipy=False)
+        self.assertEqual(self.table(), incremental)
+        suggestions.compute_all(use_scipy=True)
+        self.assertEqual(self.table(), incremental)
+
+    def test_unfriending_updates_suggestions(self):
+        response = self.client.delete("/api/friendships/", {"friend": "bob"})
+        self.assertEqual(response.status_code, 204)
+        incremental = self.table()
+        self.assertIn((self.user.pk, self.carol.pk, 1), incremental)
+        suggested = {row[1] for row in incremental if row[0] == self.user.pk}
+        self.assertNotIn(self.dave.pk, suggested)
+        suggestions.compute_all(use_scipy=False)
+        self.assertEqual(self.table(), incremental)
+
+    def test_suggestions_endpoint(self):
+        self.dave.is_active = False
+        self.dave.save()
+        response = self.client.get("/api/users/suggestions/")
+        self.assertEqual(response.status_code, 200)
+        results = [
+            (user["username"], user["mutual_friends"])
+            for user in response.data["results"]
+        ]
+        self.assertEqual(results, [("carol", 2)])
+
+
+class FriendshipBulkTests(APITestCase):
+    url = "/api/friendships/bulk/"
+
+    def setUp(self):
+        super().setUp()
+        self.requesters = [make_user(name) for name in ("bob", "carol", "dave")]
+        for requester in self.requesters:
+            Friendship.objects.create(user=requester, friend=self.user)
+
+    def bulk(self, **data):
+        return self.client.post(self.url, data, format="json")
+
+    def test_accept_selected_requests_once(self):
+        response = self.bulk(action="accept", usernames=["bob", "carol", "nobody"])
+        self.assertEqual(response.data["processed"], 2)
+        self.assertEqual(
+            self.bulk(action="accept", usernames=["bob"]).data,
+            {"action": "accept", "processed": 0},
+        )
+        self.assertEqual(
+            set(get_friend_ids(CustomUser.objects.get(pk=self.user.pk))),
+            {self.requesters[0].pk, self.requesters[1].pk},
+        )
+        counts = self.client.get("/api/friendships/requests/").data["counts"]
+        self.assertEqual(counts, {"incoming": 1, "outgoing": 0})
+
+    def test_large_batches_skip_incremental_suggestions(self):
+        # A shared friend makes bob a suggestion for the user until they are
+        # friends themselves
+        erin = make_user("erin")
+        for user in (self.user, self.requesters[0]):
+            Friendship.objects.create(user=erin, friend=user)
+            accept_requests(user, [erin.pk])
+        self.assertTrue(
+            FriendSuggestion.objects.filter(
+                user=self.user, suggested=self.requesters[0]
+            ).exists()
+        )
+        with mock.patch("api.friends.SUGGESTION_SYNC_LIMIT", 1):
+            response = self.bulk(action="accept", all=True)
+        self.assertEqual(response.data["processed"], 3)
+        self.assertEqual(FriendEdge.objects.filter(user=self.user).count(), 4)
+        self.assertFalse(
+            FriendSuggestion.objects.filter(
+                user=self.user, suggested__in=self.requesters
+            ).exists()
+        )
+
+    def test_decline_all(self):
+        response = self.bulk(action="decline", all=True)
+        self.assertEqual(response.data["processed"], 3)
+        self.assertFalse(Friendship.objects.exists())
+        self.assertFalse(FriendEdge.objects.exists())
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.bulk(action="block", all=True).status_code, 400)
+        self.assertEqual(self.bulk(action="accept").status_code, 400)
+
+    def test_duplicate_requests_are_refused(self):
+        self.client.force_authenticate(self.requesters[0])
+        response = self.client.post(
+            "/api/friendships/", {"friend": "alice"}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Friendship.objects.count(), 3)
+
+
+class GroupMemberUpdateTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.group = Group.objects.create(name="hikers", created_by=self.user)
+        self.group.add_members([self.user.pk])
+        self.others = [make_user(f"user{i}") for i in range(4)]
+        self.url = f"/api/groups/{self.group.pk}/members/"
+
+    def member_ids(self):
+        return set(self.group.members.values_list("id", flat=True))
+
+    def test_queries_do_not_grow_with_the_member_count(self):
+        ids = [user.pk for user in self.others]
+        with CaptureQueriesContext(connection) as few:
+            self.group.add_members(ids[:2])
+        with CaptureQueriesContext(connection) as many:
+            added = self.group.add_members(ids)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(added, set(ids[2:]))
+
+        with CaptureQueriesContext(connection) as few:
+            self.group.remove_members(ids[:2])
+        with CaptureQueriesContext(connection) as many:
+            removed = self.group.remove_members(ids)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(removed, set(ids[2:]))
+        self.assertEqual(self.member_ids(), {self.user.pk})
+
+    def test_membership_changes_touch_the_group(self):
+        before = self.group.updated_at
+        self.group.add_members([self.others[0].pk])
+        self.group.refresh_from_db()
+        self.assertGreater(self.group.updated_at, before)
+
+    def test_add_and_remove_through_the_api(self):
+        self.group.add_members([self.others[0].pk])
+        response = self.client.post(
+            self.url,
+            {"add": ["user1", "user2", "alice"], "remove": ["user0"]},
+            format="json",
+        )
+        self.assertEqual(response.data, {"added": 2, "removed": 1})
+        expected = {self.user.pk, self.others[1].pk, self.others[2].pk}
+        self.assertEqual(self.member_ids(), expected)
+
+    def test_unknown_users_change_nothing(self):
+        response = self.client.post(
+            self.url, {"add": ["user1", "nobody"]}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("nobody", response.data["error"])
+        self.assertEqual(self.member_ids(), {self.user.pk})
+
+    def test_group_update_adds_members(self):
+        response = self.client.put(
+            f"/api/groups/{self.group.pk}/", {"members": ["user3"]}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.member_ids(), {self.user.pk, self.others[3].pk})
+
+
+class AdminExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = make_user("admin", is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_cells_are_not_run_as_formulas(self):
+        formula = '=HYPERLINK("http://x")'
+        make_user("mallory", first_name=formula, last_name="@A1")
+        content = self.export("/api/admin/users/export/")
+        rows = list(csv.DictReader(io.StringIO(content)))
+        mallory = next(row for row in rows if row["username"] == "mallory")
+        self.assertEqual(mallory["first_name"], "'" + formula)
+        self.assertEqual(mallory["last_name"], "'@A1")
+        self.assertEqual(mallory["is_active"], "True")
+
+        lines = self.export("/api/admin/users/export/", fmt="ndjson").splitlines()
+        names = {json.loads(line)["last_name"] for line in lines}
+        self.assertIn("@A1", names)
+
+    def test_marketplace_export_filters_sold_items(self):
+        MarketPlace.objects.create(name="-lamp", created_by=self.user)
+        MarketPlace.objects.create(name="desk", is_sold=True, created_by=self.user)
+        content = self.export("/api/admin/marketplace/export/", sold="false")
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([row["name"] for row in rows], ["'-lamp"])
+
+    def test_exports_are_for_admins(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get("/api/admin/users/export/")
+        self.assertEqual(response.status_code, 403)
+
+
+class ModerationTests(MarketplaceImageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = make_user("admin", is_staff=True)
+
+    def as_admin(self, url, data):
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_bulk_delete_releases_each_image_once(self):
+        items = [self.create_listing(image_data_uri(), name=n) for n in "abc"]
+        image = items[0].image
+        release = mock.patch(
+            "api.moderation.release_marketplace_image",
+            wraps=release_marketplace_image,
+        )
+        per_row = mock.patch("api.signals.release_marketplace_image")
+        with release as released, per_row as released_per_row:
+            data = self.as_admin(
+                "/api/admin/marketplace/bulk/",
+                {"action": "delete", "ids": [item.pk for item in items[:2]]},
+            )
+            self.assertEqual(data["affected"], 2)
+            released.assert_called_once_with(image)
+            released_per_row.assert_not_called()
+            # The third listing still shows the file
+            self.assertTrue(marketplace_image_storage.exists(image))
+
+            self.as_admin(
+                "/api/admin/marketplace/bulk/",
+                {"action": "delete", "filter": {"seller": "alice"}},
+            )
+        self.assertFalse(marketplace_image_storage.exists(image))
+        deleted = MarketPlaceChange.objects.filter(action=MarketPlaceChange.DELETED)
+        self.assertEqual(deleted.count(), 3)
+
+    def test_bulk_deactivation_updates_friends(self):
+        bob = make_user("bob")
+        Friendship.objects.create(user=bob, friend=self.user)
+        accept_requests(self.user)
+        alice = CustomUser.objects.get(pk=self.user.pk)
+        self.assertEqual(get_friend_ids(alice), {bob.pk})
+
+        data = self.as_admin(
+            "/api/admin/users/bulk/",
+            {"action": "deactivate", "filter": {"username_prefix": "bo"}},
+        )
+        self.assertEqual(data["affected"], 1)
+        self.assertFalse(CustomUser.objects.get(pk=bob.pk).is_active)
+        refreshed = CustomUser.objects.get(pk=self.user.pk)
+        self.assertGreater(refreshed.friends_version, alice.friends_version)
+
+    def test_unknown_filters_are_rejected(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(
+            "/api/admin/marketplace/bulk/",
+            {"action": "delete", "filter": {"image": "x"}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        # Runs last, once METRICS_DIR is restored
+        self.addCleanup(metrics.registry.reset)
+        for name, value in (("METRICS_DIR", self.dir), ("ENABLED", True)):
+            patcher = mock.patch.object(metrics, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        metrics.registry.reset()
+
+    def write_snapshot(self, filename, pid, rows):
+        with open(os.path.join(self.dir, filename), "w") as f:
+            json.dump({"pid": pid, "rows": rows}, f)
+
+    def test_exited_processes_are_folded_into_the_archive(self):
+        requests = ["http_requests_total", [["view", "a"]], 2]
+        in_flight = ["emails_in_flight", [], 1]
+        self.write_snapshot("1-a.json", 1, [requests, in_flight])
+        self.write_snapshot("2-b.json", 2, [requests])
+        live = ["http_requests_total", [["view", "a"]], 5]
+        self.write_snapshot(f"{os.getpid()}-c.json", os.getpid(), [live])
+
+        with mock.patch.object(metrics, "_alive", lambda pid: pid == os.getpid()):
+            first = metrics.aggregate()
+            second = metrics.aggregate()
+        key = ("http_requests_total", (("view", "a"),))
+        self.assertEqual(first[key], 9)
+        self.assertEqual(second, first)
+        self.assertNotIn(("emails_in_flight", ()), first)
+        self.assertEqual(
+            sorted(os.listdir(self.dir)),
+            [".lock", f"{os.getpid()}-c.json", metrics.ARCHIVE],
+        )
+
+    @override_settings(DEBUG=False, METRICS_TOKEN="")
+    def test_refused_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    @override_settings(DEBUG=False, METRICS_TOKEN="secret")
+    def test_token_required(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(QUERY_BUDGET_MODE="raise")
+class QueryBudgetTests(APITestCase):
+    """Budgeted views stay within budget however many rows they return"""
+
+    def setUp(self):
+        super().setUp()
+        self.others = [make_user(f"user{i}") for i in range(4)]
+        for other in self.others:
+            chat = Chat.objects.create(user1=self.user, user2=other)
+            for sender, receiver in ((self.user, other), (other, self.user)):
+                Message.objects.create(
+                    chat=chat, sender=sender, receiver=receiver, content="{}"
+                )
+            group = Group.objects.create(name=f"{other.username}'s", created_by=other)
+            group.add_members([self.user.pk, other.pk])
+            GroupMessage.objects.create(group=group, sender=other, content="{}")
+            MarketPlace.objects.create(
+                name=f"{other.username}'s bike", price=1, upi_id="a@b", created_by=other
+            )
+
+    def assertWithinBudget(self, url, **params):
+        # QueryBudgetExceeded propagates out of the test client
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_messages(self):
+        response = self.assertWithinBudget(
+            "/api/messages/", receiver=self.others[0].username
+        )
+        self.assertEqual(len(response.data), 2)
+
+    def test_all_chats(self):
+        self.assertWithinBudget("/api/allChats/")
+
+    def test_user_list(self):
+        response = self.assertWithinBudget("/api/users/")
+        self.assertEqual(response.data["count"], len(self.others))
+
+    def test_marketplace_list(self):
+        response = self.assertWithinBudget("/api/marketplace/")
+        self.assertEqual(len(response.data), len(self.others))
+
+    def test_group_members(self):
+        group = Group.objects.create(name="everyone", created_by=self.user)
+        group.add_members([self.user.pk, *(other.pk for other in self.others)])
+        # Thumbnails are only looked up for members with a picture
+        CustomUser.objects.update(
+            profile_picture="profile_pictures/me.jpg",
+            profile_picture_variants_ready=True,
+        )
+        response = self.assertWithinBudget(f"/api/groups/{group.pk}/members/")
+        self.assertEqual(response.data["count"], len(self.others) + 1)
+
+
+class QueryLogTests(TestCase):
+    def run_statements(self, statements):
+        log = QueryLog()
+        for sql in statements:
+            log(lambda *args: None, sql, (), False, {})
+        return log
+
+    def test_duplicates_ignore_parameters(self):
+        select = "SELECT * FROM api_customuser WHERE id = %s"
+        log = self.run_statements([select, select, select, "SELECT 1"])
+        self.assertEqual(log.count, 4)
+        self.assertEqual(log.duplicates, 2)
+
+        report = log.report("GET /api/users/", QueryBudget(max_queries=3))
+        self.assertIn("ran 4 queries (2 duplicates)", report)
+        self.assertIn(f"3x {select}", report)
+        # Statements run once are not listed
+        self.assertNotIn("SELECT 1", report)
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+    # The command migrates and flushes, which needs a real transaction
+    volumes = [
+        "--users=8",
+        "--friends=3",
+        "--chats=2",
+        "--messages=3",
+        "--groups=1",
+        "--group-size=3",
+        "--group-messages=2",
+        "--items=5",
+    ]
+
+    def test_runs_every_scenario_and_compares(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "results.json")
+            call_command(
+                "benchmark",
+                *self.volumes,
+                "--iterations=2",
+                "--warmup=0",
+                f"--output={output}",
+                stdout=StringIO(),
+            )
+            with open(output) as f:
+                report = json.load(f)
+            self.assertEqual(report["volumes"]["users"], 8)
+            self.assertIn("message_history", report["results"])
+            self.assertIn("verify_totp", report["results"])
+            self.assertEqual(report["results"]["login"]["iterations"], 2)
+
+            # Query counts are deterministic; the tolerance absorbs timing noise
+            stdout = StringIO()
+            call_command(
+                "benchmark",
+                *self.volumes,
+                "--iterations=1",
+                "--warmup=0",
+                "--scenario=list_users",
+                f"--compare={output}",
+                "--tolerance=1000",
+                stdout=stdout,
+            )
+            self.assertIn("No regressions", stdout.getvalue())
+
+    def test_rejects_impossible_volumes(self):
+        with self.assertRaisesMessage(CommandError, "below users"):
+            call_command("benchmark", "--users=2", "--friends=5", stdout=StringIO())
+
+    def test_unknown_scenario(self):
+        with self.assertRaisesMessage(CommandError, "Unknown scenario"):
+            call_command(
+                "benchmark", *self.volumes, "--scenario=nope", stdout=StringIO()
+            )
+
+
+class SeedCommandTests(TestCase):
+    def test_seeds_small_dataset(self):
+        stdout = StringIO()
+        call_command(
+            "seed",
+            "--users=12",
+            "--friends-min=1",
+            "--friends-max=4",
+            "--chats=3",
+            "--messages=10",
+            "--groups=2",
+            "--group-size-max=4",
+            "--group-messages=6",
+            "--listings=5",
+            "--key-pool=1",
+            "--seed=7",
+            stdout=stdout,
+        )
+        self.assertIn("Created 12 users", stdout.getvalue())
+        users = CustomUser.objects.filter(username__startswith="seed")
+        self.assertEqual(users.count(), 12)
+        # auto_now is off while seeding, so updated_at is set explicitly
+        for user in users:
+            self.assertEqual(user.updated_at, user.date_joined)
+        self.assertGreater(len({user.date_joined for user in users}), 1)
+        self.assertEqual(MarketPlace.objects.count(), 5)
+        self.assertEqual(Message.objects.count(), 10)
+        self.assertEqual(GroupMessage.objects.count(), 6)
+
+
+@override_settings(PROFILING_ENABLED=True)
+class ProfilingMiddlewareTests(APITestCase):
+    def get_users(self, user, query=""):
+        # The middleware checks staff before DRF authenticates, so use a JWT
+        client = APIClient()
+        token = AccessToken.for_user(user)
+        return client.get(f"/api/users/{query}", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_server_timing(self):
+        response = self.get_users(self.user)
+        self.assertEqual(response.status_code, 200)
+        timing = response["Server-Timing"]
+        for name in ("db", "serialize", "render", "total"):
+            self.assertIn(f"{name};dur=", timing)
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+
+    def test_crypto_timing(self):
+        bob = make_user("bob")
+        for user in (self.user, bob):
+            user.generate_keys()
+        chat = Chat.objects.create(user1=self.user, user2=bob)
+        content = str(Message.encrypt_message("hi", self.user, bob))
+        Message.objects.bulk_create(
+            Message(chat=chat, sender=self.user, receiver=bob, content=content)
+            for _ in range(2)
+        )
+        client = APIClient()
+        token = AccessToken.for_user(self.user)
+        response = client.get(
+            "/api/messages/",
+            {"receiver": "bob"},
+            HTTP_AUTHORIZATION=f"Bearer {token}",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["content"] for m in response.data], ["hi", "hi"])
+        # One decrypt per message; keys generated outside the request don't count
+        self.assertRegex(response["Server-Timing"], r'crypto;dur=[\d.]+;desc="2 calls"')
+
+    def test_profile_for_staff(self):
+        self.user.is_staff = True
+        self.user.save()
+        with tempfile.TemporaryDirectory() as tmp:
+            with override_settings(PROFILING_DUMP_DIR=tmp):
+                response = self.get_users(self.user, "?profile=1")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "text/plain; charset=utf-8")
+            self.assertIn(b"function calls", response.content)
+            self.assertIn("Server-Timing", response)
+            self.assertEqual(os.listdir(tmp), [response["X-Profile-Dump"]])
+
+    def test_profile_ignored_for_others(self):
+        response = self.get_users(self.user, "?profile=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertNotIn("X-Profile-Dump", response)
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled(self):
+        response = self.get_users(self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response)
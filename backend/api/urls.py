@@ -2,20 +2,37 @@ from django.urls import path
 from rest_framework_simplejwt.views import TokenBlacklistView, TokenRefreshView
 
 from .views import (
+    AdminCacheStatsView,
+    AdminDocumentDecisionView,
+    AdminDocumentDownloadView,
+    AdminDocumentQueueView,
+    AuditLogView,
     AvailableMarketPlaceListView,
     CombinedChatGroupView,
+    DocumentUploadChunkView,
+    DocumentUploadCompleteView,
+    DocumentUploadView,
+    FriendListView,
+    FriendshipBulkView,
+    FriendshipRequestsView,
     FriendshipView,
+    FriendSuggestionView,
     GroupCreateView,
     GroupDetailView,
+    GroupMembersView,
     ListUserView,
     LoginView,
     MarketPlaceDetailView,
+    MarketPlaceBulkView,
+    MarketPlaceChangesView,
     MarketPlaceListCreateView,
+    MarketPlaceSearchView,
     MessageView,
     RegisterView,
     RequestPasswordResetView,
     ResetPasswordView,
     UserProfileView,
+    UserSearchView,
     VerifyEmailView,
     VerifyPasswordResetView,
     VerifyTOTPView,
@@ -23,7 +40,11 @@ from .views import (
     UserListView,
     AdminDashboardView,
     AdminMarketplaceItemView,
+    AdminMarketplaceBulkView,
+    AdminMarketplaceExportView,
     AdminMarketplaceListView,
+    AdminUserBulkView,
+    AdminUserExportView,
     UserProfileView,
 )
 from .views import (AvailableMarketPlaceListView, ChatListCreateView,
@@ -56,15 +77,43 @@ urlpatterns = [
     path("reset-password/", ResetPasswordView.as_view(), name="reset-password"),
     # User endpoints
     path("users/", ListUserView.as_view(), name="list-users"),
+    path("users/search/", UserSearchView.as_view(), name="search-users"),
+    path(
+        "users/suggestions/",
+        FriendSuggestionView.as_view(),
+        name="friend-suggestions",
+    ),
+    path("users/<int:user_id>/friends/", FriendListView.as_view(), name="user-friends"),
+    path("friends/", FriendListView.as_view(), name="friend-list"),
     path("user/profile/", UserProfileView.as_view(), name="current-user-profile"),
     path("user/profile/<int:user_id>/", UserProfileView.as_view(), name="user-profile"),
+    path("documents/", DocumentUploadView.as_view(), name="documents"),
+    path(
+        "documents/uploads/<uuid:upload_id>/",
+        DocumentUploadChunkView.as_view(),
+        name="document-upload",
+    ),
+    path(
+        "documents/uploads/<uuid:upload_id>/complete/",
+        DocumentUploadCompleteView.as_view(),
+        name="document-upload-complete",
+    ),
     path("messages/", MessageView.as_view(), name="messages"),
     path("groups/", GroupCreateView.as_view(), name="create-group"),
     path("groups/<int:pk>/", GroupDetailView.as_view(), name="group-detail"),
+    path(
+        "groups/<int:pk>/members/", GroupMembersView.as_view(), name="group-members"
+    ),
     path("create-chat/", ChatListCreateView.as_view(), name="create-chat"),
     path("friendships/", FriendshipView.as_view(), name="friendship-list-create"),
     path("friendships/accept/", FriendshipView.as_view(), name="friendship-accept"),
     path("friendships/delete/", FriendshipView.as_view(), name="friendship-delete"),
+    path(
+        "friendships/requests/",
+        FriendshipRequestsView.as_view(),
+        name="friendship-requests",
+    ),
+    path("friendships/bulk/", FriendshipBulkView.as_view(), name="friendship-bulk"),
     path("allChats/", CombinedChatGroupView.as_view(), name="all-chats"),
     # List all items and create new ones
     path(
@@ -72,6 +121,26 @@ urlpatterns = [
         MarketPlaceListCreateView.as_view(),
         name="marketplace-list-create",
     ),
+    path(
+        "marketplace/available/",
+        AvailableMarketPlaceListView.as_view(),
+        name="marketplace-available",
+    ),
+    path(
+        "marketplace/bulk/",
+        MarketPlaceBulkView.as_view(),
+        name="marketplace-bulk",
+    ),
+    path(
+        "marketplace/changes/",
+        MarketPlaceChangesView.as_view(),
+        name="marketplace-changes",
+    ),
+    path(
+        "marketplace/search/",
+        MarketPlaceSearchView.as_view(),
+        name="marketplace-search",
+    ),
     # Retrieve, update, or delete specific item
     path(
         "marketplace/<int:pk>/",
@@ -80,6 +149,12 @@ urlpatterns = [
     ),
     # User Management
     path("admin/users/", UserListView.as_view(), name="admin_user_list"),
+    path(
+        "admin/users/export/",
+        AdminUserExportView.as_view(),
+        name="admin_user_export",
+    ),
+    path("admin/users/bulk/", AdminUserBulkView.as_view(), name="admin_user_bulk"),
     path(
         "admin/users/<int:user_id>/",
         UserManagementView.as_view(),
@@ -91,11 +166,37 @@ urlpatterns = [
         AdminMarketplaceListView.as_view(),
         name="admin_marketplace_list",
     ),
+    path(
+        "admin/marketplace/export/",
+        AdminMarketplaceExportView.as_view(),
+        name="admin_marketplace_export",
+    ),
+    path(
+        "admin/marketplace/bulk/",
+        AdminMarketplaceBulkView.as_view(),
+        name="admin_marketplace_bulk",
+    ),
     path(
         "admin/marketplace/<int:item_id>/",
         AdminMarketplaceItemView.as_view(),
         name="admin_marketplace_item",
     ),
+    # Identity document review
+    path(
+        "admin/documents/", AdminDocumentQueueView.as_view(), name="admin_documents"
+    ),
+    path(
+        "admin/documents/<int:document_id>/decision/",
+        AdminDocumentDecisionView.as_view(),
+        name="admin_document_decision",
+    ),
+    path(
+        "admin/documents/<int:document_id>/download/",
+        AdminDocumentDownloadView.as_view(),
+        name="admin_document_download",
+    ),
     # Dashboard
+    path("admin/cache/", AdminCacheStatsView.as_view(), name="admin_cache_stats"),
+    path("admin/audit-log/", AuditLogView.as_view(), name="admin_audit_log"),
     path("admin/dashboard/", AdminDashboardView.as_view(), name="admin_dashboard"),
 ]
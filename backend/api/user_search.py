@@ -0,0 +1,126 @@
+import math
+import re
+
+from django.db import transaction
+from django.db.models import Count, Min, Q
+
+from .models import CustomUser, UserSearchTerm
+
+INDEXED_FIELDS = ("username", "first_name", "last_name")
+# Share of the query's trigrams a name must contain to count as a fuzzy match
+MIN_TRIGRAM_SIMILARITY = 0.3
+
+
+def normalize(value):
+    return (value or "").strip().lower()
+
+
+def trigrams(word):
+    """Trigrams of a word padded like pg_trgm: "bob" -> "  b", " bo", "bob", "ob " """
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def terms_for(user):
+    tokens = {normalize(getattr(user, field)) for field in INDEXED_FIELDS} - {""}
+    grams = set()
+    for token in tokens:
+        for word in re.findall(r"\w+", token):
+            grams |= trigrams(word)
+    return tokens, grams
+
+
+def index_users(users):
+    """(Re)build the search terms of the given users"""
+    users = list(users)
+    rows = []
+    for user in users:
+        tokens, grams = terms_for(user)
+        rows.extend(
+            UserSearchTerm(kind=UserSearchTerm.TOKEN, term=token[:150], user=user)
+            for token in tokens
+        )
+        rows.extend(
+            UserSearchTerm(kind=UserSearchTerm.TRIGRAM, term=gram, user=user)
+            for gram in grams
+        )
+    with transaction.atomic():
+        UserSearchTerm.objects.filter(user__in=users).delete()
+        UserSearchTerm.objects.bulk_create(rows, batch_size=1000)
+
+
+def prefix_search(query, exclude_user_id=None, after=None, limit=20):
+    """
+    Active users with a name starting with `query`, ordered by (first
+    matching name, id), once each. `after` is the (term, user_id) of the
+    last row of the previous page. Returns ([(term, user_id)], has_more).
+    """
+    terms = UserSearchTerm.objects.filter(
+        kind=UserSearchTerm.TOKEN,
+        term__startswith=normalize(query),
+        user__is_active=True,
+    )
+    if exclude_user_id is not None:
+        terms = terms.exclude(user_id=exclude_user_id)
+    # One row per user, keyed by the alphabetically first of their matches
+    matches = terms.values("user_id").annotate(first_term=Min("term"))
+    if after:
+        term, user_id = after
+        matches = matches.filter(
+            Q(first_term__gt=term) | Q(first_term=term, user_id__gt=user_id)
+        )
+    rows = list(
+        matches.order_by("first_term", "user_id").values_list(
+            "first_term", "user_id"
+        )[: limit + 1]
+    )
+    return rows[:limit], len(rows) > limit
+
+
+def fuzzy_search(query, exclude_user_id=None, after=None, limit=20):
+    """
+    Active users whose names share the most trigrams with `query`, ordered by
+    (shared trigrams desc, id). `after` is the (hits, user_id) of the last
+    row of the previous page. Returns ([(hits, user_id)], has_more).
+    """
+    grams = set()
+    for word in re.findall(r"\w+", normalize(query)):
+        grams |= trigrams(word)
+    if not grams:
+        return [], False
+    min_hits = max(1, math.ceil(len(grams) * MIN_TRIGRAM_SIMILARITY))
+
+    matches = (
+        UserSearchTerm.objects.filter(
+            kind=UserSearchTerm.TRIGRAM, term__in=grams, user__is_active=True
+        )
+        .values("user_id")
+        .annotate(hits=Count("id"))
+        .filter(hits__gte=min_hits)
+    )
+    if exclude_user_id is not None:
+        matches = matches.exclude(user_id=exclude_user_id)
+    if after:
+        hits, user_id = after
+        matches = matches.filter(Q(hits__lt=hits) | Q(hits=hits, user_id__gt=user_id))
+    rows = list(
+        matches.order_by("-hits", "user_id").values_list("hits", "user_id")[
+            : limit + 1
+        ]
+    )
+    return rows[:limit], len(rows) > limit
+
+
+def active_users_in_order(user_ids):
+    """
+    Load users by id in the given order, dropping accounts deactivated
+    since the ids were found
+    """
+    users = CustomUser.objects.filter(id__in=user_ids, is_active=True).in_bulk()
+    ordered = []
+    seen = set()
+    for user_id in user_ids:
+        if user_id in users and user_id not in seen:
+            seen.add(user_id)
+            ordered.append(users[user_id])
+    return ordered
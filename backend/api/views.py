@@ -1,8 +1,11 @@
 import ast
 import base64
+import csv
 import io
+import ipaddress
 import random
 from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
 
 import qrcode
 from cryptography.hazmat.primitives import hashes, serialization
@@ -11,31 +14,68 @@ from decouple import config
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.core.mail import message, send_mail
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Count,
+    DecimalField,
+    Max,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+)
+from django.db.models.functions import Cast
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.decorators import method_decorator
 from django_ratelimit.decorators import ratelimit
-from rest_framework import status
+from rest_framework import serializers, status
 from rest_framework.exceptions import PermissionDenied
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import AccessToken, RefreshToken, TokenError
 
+from . import audit, documents, metrics, moderation, stats
+from .budgets import QueryBudget, query_budget
+from .bulk import (
+    EXPORT_FIELDS,
+    IMPORT_FORMATS,
+    export_rows,
+    import_listings,
+    read_rows,
+)
+from .cache import catalog_cache, catalog_cache_params
+from .conditional import conditional_get
+from .exports import EXPORT_FORMATS, keyset_values, streaming_export
+from .friends import accept_requests, decline_requests, get_friend_ids
+from .imaging import schedule_variants
+from .memberships import has_member, with_member_count
 from .models import (
+    AuditEvent,
     Chat,
     CustomUser,
+    DocumentVerification,
+    FriendEdge,
     Friendship,
+    FriendSuggestion,
     Group,
     GroupMessage,
     MarketPlace,
+    MarketPlaceChange,
     Message,
     VerificationCode,
 )
+from .pagination import StandardResultsSetPagination, decode_cursor, encode_cursor
+from .profiling import timed
+from .search import search_marketplace
 from .serializers import (
     ChatSerializer,
+    DocumentVerificationSerializer,
     FriendshipSerializer,
+    GroupListSerializer,
     GroupMessageSerializer,
     GroupSerializer,
     LoginSerializer,
@@ -46,6 +86,7 @@ from .serializers import (
     UserListSerializer,
     UserProfileSerializer,
 )
+from .user_search import active_users_in_order, fuzzy_search, prefix_search
 
 
 class RegisterView(APIView):
@@ -87,13 +128,14 @@ class RegisterView(APIView):
                     print(f"Updated verification code for {email}")
 
                 # Send verification email
-                send_mail(
-                    subject="Welcome to Rivr - Verify your account",
-                    message=f"Please verify your account using the following code: {code}",
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[email],
-                    fail_silently=False,
-                )
+                with metrics.track_email():
+                    send_mail(
+                        subject="Welcome to Rivr - Verify your account",
+                        message=f"Please verify your account using the following code: {code}",
+                        from_email=settings.EMAIL_HOST_USER,
+                        recipient_list=[email],
+                        fail_silently=False,
+                    )
 
                 # Return response without including sensitive data
                 response_data = {
@@ -119,9 +161,15 @@ class RegisterView(APIView):
 class LoginView(APIView):
     permission_classes = [AllowAny]
 
-    @method_decorator(ratelimit(key="ip", rate="5/m", method="POST"))
+    @method_decorator(ratelimit(key="ip", rate="5/m", method="POST", block=False))
     def post(self, request):
         if getattr(request, "limited", False):
+            metrics.inc("login_rate_limited_total")
+            audit.record(
+                AuditEvent.LOGIN_RATE_LIMITED,
+                request,
+                target=request.data.get("email", ""),
+            )
             return Response(
                 {"error": "Too many login attempts"},
                 status=status.HTTP_429_TOO_MANY_REQUESTS,
@@ -135,6 +183,7 @@ class LoginView(APIView):
             user = authenticate(request, username=email, password=password)
 
             if user and user.is_active:
+                audit.record(AuditEvent.LOGIN_PASSWORD_OK, request, actor=user)
                 if not user.is_verified:
                     return Response(
                         {
@@ -147,6 +196,7 @@ class LoginView(APIView):
                     {"message": "Please enter your 2FA code", "email": email},
                     status=status.HTTP_200_OK,  # Prompt for 2FA
                 )
+            audit.record(AuditEvent.LOGIN_FAILED, request, target=email)
             return Response(
                 {"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED
             )
@@ -244,15 +294,35 @@ class FriendshipView(APIView):
     serializer_class = FriendshipSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_version(self, request):
+        version = self.queryset.filter(
+            friend=request.user, is_accepted=False
+        ).aggregate(
+            count=Count("id"),
+            last_id=Max("id"),
+            latest=Max("created_at"),
+            # The requesters' names, bios and pictures are in the response
+            requester_latest=Max("user__updated_at"),
+        )
+        timestamps = [
+            ts for ts in (version["latest"], version["requester_latest"]) if ts
+        ]
+        return max(timestamps, default=None), (version["count"], version["last_id"])
+
+    @conditional_get
     def get(self, request):
         username = request.user.username
         # Only show incoming requests where user is the recipient (friend)
-        friendships = self.queryset.filter(friend__username=username, is_accepted=False)
+        friendships = self.queryset.filter(
+            friend__username=username, is_accepted=False
+        ).select_related("user", "friend")
         if not friendships.exists():
             return Response(
                 {"detail": "No friendships found"}, status=status.HTTP_404_NOT_FOUND
             )
-        serializer = self.serializer_class(friendships, many=True)
+        serializer = self.serializer_class(
+            friendships, many=True, context={"request": request}
+        )
         print(f"Serialized friendships: {serializer.data}")
         return Response(serializer.data)
 
@@ -307,6 +377,90 @@ class FriendshipView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def user_ids_by_username(usernames):
+    """Map usernames to user ids, one query per chunk of names"""
+    names = list({str(name) for name in usernames})
+    ids = {}
+    for start in range(0, len(names), 900):
+        ids.update(
+            CustomUser.objects.filter(
+                username__in=names[start : start + 900]
+            ).values_list("username", "id")
+        )
+    return ids
+
+
+class FriendshipRequestsView(APIView):
+    permission_classes = [IsAuthenticated]
+    pagination_class = StandardResultsSetPagination
+
+    def get(self, request):
+        """Pending requests to (incoming) or from (outgoing) the user, paginated"""
+        direction = request.query_params.get("direction", "incoming")
+        if direction not in ("incoming", "outgoing"):
+            return Response(
+                {"error": "direction must be 'incoming' or 'outgoing'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        user = request.user
+        # Both counts come from a single aggregate over the user's pending rows
+        counts = Friendship.objects.filter(
+            Q(user=user) | Q(friend=user), is_accepted=False
+        ).aggregate(
+            incoming=Count("id", filter=Q(friend=user)),
+            outgoing=Count("id", filter=Q(user=user)),
+        )
+        if direction == "incoming":
+            pending = Friendship.objects.filter(friend=user, is_accepted=False)
+        else:
+            pending = Friendship.objects.filter(user=user, is_accepted=False)
+        pending = pending.select_related("user", "friend").order_by(
+            "-created_at", "-id"
+        )
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(pending, request, view=self)
+        serializer = FriendshipSerializer(
+            page, many=True, context={"request": request}
+        )
+        response = paginator.get_paginated_response(serializer.data)
+        response.data["counts"] = counts
+        return response
+
+
+class FriendshipBulkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Accept or decline many incoming requests at once, either those from
+        the listed usernames or, with "all": true, every pending request.
+        """
+        action = request.data.get("action")
+        if action not in ("accept", "decline"):
+            return Response(
+                {"error": "action must be 'accept' or 'decline'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        requester_ids = None
+        if not request.data.get("all"):
+            usernames = request.data.get("usernames")
+            if not isinstance(usernames, list) or not usernames:
+                return Response(
+                    {"error": "Provide a list of usernames or set all to true."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            requester_ids = list(user_ids_by_username(usernames).values())
+
+        if action == "accept":
+            processed = len(accept_requests(request.user, requester_ids))
+        else:
+            processed = decline_requests(request.user, requester_ids)
+        return Response(
+            {"action": action, "processed": processed}, status=status.HTTP_200_OK
+        )
+
+
 class ChatListCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -336,20 +490,22 @@ class MessageView(APIView):
     groupserializer = GroupMessageSerializer
     permission_classes = [IsAuthenticated]
 
+    @query_budget(max_queries=6)
     def get(self, request, pk=None, group=None):
-        sender_username = request.user.username
         receiver_username = request.query_params.get(
             "receiver"
         )  # Use query param for receiver
 
         if pk is not None:
             group_obj = get_object_or_404(Group, pk=pk)
-            if not group_obj.members.filter(username=sender_username).exists():
+            if not has_member(group_obj, request.user):
                 return Response(
                     {"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN
                 )
-            messages = GroupMessage.objects.filter(group=group_obj).order_by(
-                "timestamp"
+            messages = (
+                GroupMessage.objects.filter(group=group_obj)
+                .select_related("sender")
+                .order_by("timestamp")
             )
             if not messages.exists():
                 return Response(
@@ -373,17 +529,21 @@ class MessageView(APIView):
             return Response(serialized_messages)
 
         if receiver_username:
+            user = request.user
             try:
-                user = CustomUser.objects.get(username=sender_username)
                 receiver = CustomUser.objects.get(username=receiver_username)
             except CustomUser.DoesNotExist:
                 return Response(
                     {"detail": "User not found"}, status=status.HTTP_404_NOT_FOUND
                 )
-            messages = Message.objects.filter(
-                (Q(sender=user) & Q(receiver=receiver))
-                | (Q(sender=receiver) & Q(receiver=user))
-            ).order_by("timestamp")
+            messages = (
+                Message.objects.filter(
+                    (Q(sender=user) & Q(receiver=receiver))
+                    | (Q(sender=receiver) & Q(receiver=user))
+                )
+                .select_related("sender", "receiver")
+                .order_by("timestamp")
+            )
             response_data = []
             for msg in messages:
                 try:
@@ -414,6 +574,12 @@ class MessageView(APIView):
             serializer = MessageSerializer(data=data)
         if serializer:
             if serializer.is_valid():
+                group = serializer.validated_data.get("group")
+                if isinstance(group, Group) and not has_member(group, request.user):
+                    return Response(
+                        {"detail": "Not a member of this group"},
+                        status=status.HTTP_403_FORBIDDEN,
+                    )
                 message = serializer.save()
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -425,11 +591,81 @@ class MessageView(APIView):
 
 class CombinedChatGroupView(APIView):
     permission_classes = [IsAuthenticated]
+    query_budget = QueryBudget(max_queries=10)
+
+    def get_version(self, request):
+        user = request.user
+        chats = Chat.objects.filter(Q(user1=user) | Q(user2=user)).aggregate(
+            count=Count("id"),
+            last_id=Max("id"),
+            user1_latest=Max("user1__updated_at"),
+            user2_latest=Max("user2__updated_at"),
+        )
+        messages = Message.objects.filter(
+            Q(chat__user1=user) | Q(chat__user2=user)
+        ).aggregate(count=Count("id"), last_id=Max("id"), latest=Max("timestamp"))
+        groups = Group.objects.filter(members=user).aggregate(
+            count=Count("id"),
+            latest=Max("updated_at"),
+            creator_latest=Max("created_by__updated_at"),
+        )
+        group_messages = GroupMessage.objects.filter(group__members=user).aggregate(
+            last_id=Max("id"), latest=Max("timestamp")
+        )
+        timestamps = [
+            ts
+            for ts in (
+                chats["user1_latest"],
+                chats["user2_latest"],
+                messages["latest"],
+                groups["latest"],
+                groups["creator_latest"],
+                group_messages["latest"],
+            )
+            if ts
+        ]
+        parts = (
+            chats["count"],
+            chats["last_id"],
+            messages["count"],
+            messages["last_id"],
+            groups["count"],
+            group_messages["last_id"],
+        )
+        return max(timestamps, default=None), parts
 
+    @conditional_get
     def get(self, request):
         user = request.user
-        chats = Chat.objects.filter(Q(user1=user) | Q(user2=user))
-        groups = Group.objects.filter(members=user)
+        # Last messages come from subqueries rather than a query per row
+        chat_messages = Message.objects.filter(chat=OuterRef("pk")).order_by(
+            "-timestamp"
+        )
+        chats = (
+            Chat.objects.filter(Q(user1=user) | Q(user2=user))
+            .select_related("user1", "user2")
+            .prefetch_related(
+                Prefetch(
+                    "messages",
+                    queryset=Message.objects.select_related("sender", "receiver"),
+                )
+            )
+            .annotate(
+                last_message_content=Subquery(chat_messages.values("content")[:1]),
+                last_message_at=Subquery(chat_messages.values("timestamp")[:1]),
+            )
+        )
+        group_messages = GroupMessage.objects.filter(group=OuterRef("pk")).order_by(
+            "-timestamp"
+        )
+        groups = with_member_count(
+            Group.objects.filter(members=user)
+            .select_related("created_by")
+            .annotate(
+                last_message_content=Subquery(group_messages.values("content")[:1]),
+                last_message_at=Subquery(group_messages.values("timestamp")[:1]),
+            )
+        )
         if not (chats.exists() or groups.exists()):
             return Response(
                 {"detail": "No chats or groups found"}, status=status.HTTP_404_NOT_FOUND
@@ -437,25 +673,25 @@ class CombinedChatGroupView(APIView):
 
         chat_last_messages = {}
         for chat in chats:
-            last_message = chat.messages.order_by("-timestamp").first()
-            if last_message:
+            if chat.last_message_at:
                 chat_last_messages[chat.id] = {
-                    "content": last_message.content,
-                    "timestamp": last_message.timestamp.isoformat(),
+                    "content": chat.last_message_content,
+                    "timestamp": chat.last_message_at.isoformat(),
                 }
 
         group_last_messages = {}
         for group in groups:
-            last_message = group.messages.order_by("-timestamp").first()
-            if last_message:
-                decrypted_content = self.decrypt_group_message(last_message)
+            if group.last_message_at:
+                decrypted_content = self.decrypt_group_message(
+                    group, group.last_message_content
+                )
                 group_last_messages[group.id] = {
                     "content": decrypted_content,
-                    "timestamp": last_message.timestamp.isoformat(),
+                    "timestamp": group.last_message_at.isoformat(),
                 }
 
         chat_serializer = ChatSerializer(chats, many=True)
-        group_serializer = GroupSerializer(groups, many=True)
+        group_serializer = GroupListSerializer(groups, many=True)
 
         for chat_data in chat_serializer.data:
             chat_data["type"] = "chat"
@@ -491,11 +727,12 @@ class CombinedChatGroupView(APIView):
             }
         )
 
-    def decrypt_group_message(self, group_message):
+    @timed("crypto")
+    def decrypt_group_message(self, group, content):
         try:
-            ciphertext = bytes.fromhex(group_message.content)
+            ciphertext = bytes.fromhex(content)
             private_key = serialization.load_pem_private_key(
-                group_message.group.private_key.encode(),
+                group.private_key.encode(),
                 password=config("RSA_PASSPHRASE").encode(),
             )
             plain_text = private_key.decrypt(
@@ -516,12 +753,14 @@ class GroupCreateView(APIView):
 
     def get(self, request):
         user = request.user
-        groups = Group.objects.filter(members=user)
+        groups = with_member_count(
+            Group.objects.filter(members=user).select_related("created_by")
+        )
         if not groups.exists():
             return Response(
                 {"detail": "No groups found"}, status=status.HTTP_404_NOT_FOUND
             )
-        serializer = GroupSerializer(groups, many=True)
+        serializer = GroupListSerializer(groups, many=True)
         return Response(serializer.data)
 
     def post(self, request):
@@ -537,63 +776,346 @@ class GroupCreateView(APIView):
 class GroupDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        # Members are listed separately by GroupMembersView
+        return with_member_count(Group.objects.select_related("created_by"))
+
     def get(self, request, pk):
-        group = get_object_or_404(Group, pk=pk)
-        if not group.members.filter(username=request.user.username).exists():
+        group = get_object_or_404(self.get_queryset(), pk=pk)
+        if not has_member(group, request.user):
             return Response(
                 {"detail": "Not a member of this group"},
                 status=status.HTTP_403_FORBIDDEN,
             )
-        serializer = GroupSerializer(group)
+        serializer = GroupListSerializer(group)
         return Response(serializer.data)
 
     def put(self, request, pk):
         group = get_object_or_404(Group, pk=pk)
-        if not group.members.filter(username=request.user.username).exists():
+        if not has_member(group, request.user):
             return Response(
                 {"detail": "Not a member of this group"},
                 status=status.HTTP_403_FORBIDDEN,
             )
         serializer = GroupSerializer(group, data=request.data, partial=True)
         if serializer.is_valid():
-            group = serializer.update(group, request.data)
-            return Response(GroupSerializer(group).data)
+            serializer.update(group, request.data)
+            return Response(GroupListSerializer(self.get_queryset().get(pk=pk)).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk):
         group = get_object_or_404(Group, pk=pk)
-        if not group.members.filter(username=request.user.username).exists():
+        if not has_member(group, request.user):
             return Response(
                 {"detail": "Not a member of this group"},
                 status=status.HTTP_403_FORBIDDEN,
             )
         serializer = GroupSerializer(group, data=request.data, partial=True)
         if serializer.is_valid():
-            group = serializer.remove_member_by_name(group, request.data.get("member"))
-            return Response(GroupSerializer(group).data)
+            serializer.remove_member_by_name(group, request.data.get("member"))
+            return Response(GroupListSerializer(self.get_queryset().get(pk=pk)).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class GroupMembersView(APIView):
+    permission_classes = [IsAuthenticated]
+    pagination_class = StandardResultsSetPagination
+
+    @query_budget(max_queries=5)
+    def get(self, request, pk):
+        """The group's members ordered by username, one page at a time"""
+        group = get_object_or_404(Group, pk=pk)
+        if not has_member(group, request.user):
+            return Response(
+                {"detail": "Not a member of this group"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        # Only the columns UserListSerializer reads; keys and secrets stay behind
+        members = group.members.only(
+            "id", "username", "profile_picture", "profile_picture_variants_ready", "bio"
+        ).order_by("username")
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(members, request, view=self)
+        serializer = UserListSerializer(
+            page,
+            many=True,
+            context={"request": request, "friend_ids": get_friend_ids(request.user)},
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    def post(self, request, pk):
+        """Add and remove many members at once, given as lists of usernames"""
+        group = get_object_or_404(Group, pk=pk)
+        if not has_member(group, request.user):
+            return Response(
+                {"detail": "Not a member of this group"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        to_add = request.data.get("add", [])
+        to_remove = request.data.get("remove", [])
+        if not isinstance(to_add, list) or not isinstance(to_remove, list):
+            return Response(
+                {"error": "add and remove must be lists of usernames."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not to_add and not to_remove:
+            return Response(
+                {"error": "Nothing to add or remove."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        ids = user_ids_by_username(to_add + to_remove)
+        missing = sorted({str(name) for name in to_add + to_remove} - set(ids))
+        if missing:
+            return Response(
+                {"error": f"Users not found: {', '.join(missing)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        with transaction.atomic():
+            added = group.add_members(ids[str(name)] for name in to_add)
+            removed = group.remove_members(ids[str(name)] for name in to_remove)
+        return Response(
+            {"added": len(added), "removed": len(removed)}, status=status.HTTP_200_OK
+        )
+
+
 # List and Create View
 class MarketPlaceListCreateView(APIView):
     queryset = MarketPlace.objects.all()
     serializer_class = MarketPlaceSerializer
 
+    def get_version(self, request):
+        version = self.queryset.aggregate(
+            count=Count("id"),
+            last_id=Max("id"),
+            latest=Max("updated_at"),
+            # Listings show the seller's username
+            seller_latest=Max("created_by__updated_at"),
+        )
+        timestamps = [ts for ts in (version["latest"], version["seller_latest"]) if ts]
+        return max(timestamps, default=None), (version["count"], version["last_id"])
+
+    @query_budget(max_queries=6)
+    @conditional_get
     def get(self, request):
+        sequence, data = catalog_cache.get_or_build(
+            catalog_cache_params(request, "marketplace-list"),
+            lambda: self.build_listing(request),
+        )
+        response = Response(data)
+        response["X-Change-Sequence"] = str(sequence)
+        return response
+
+    def build_listing(self, request):
+        # Read the change sequence first: anything written while the list is
+        # being built is then replayed by the client's next changes/ poll.
+        sequence = MarketPlaceChange.settled_sequence()
         # List all marketplace items
-        items = self.queryset.all()
-        serializer = self.serializer_class(items, many=True)
-        return Response(serializer.data)
+        items = self.queryset.select_related("created_by")
+        serializer = self.serializer_class(
+            items, many=True, context={"request": request}
+        )
+        return sequence, list(serializer.data)
 
     def post(self, request):
         # Create a new marketplace item
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(
+            data=request.data, context={"request": request}
+        )
         if serializer.is_valid():
             item = serializer.save(created_by=request.data.get("created_by"))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MarketPlaceChangesView(APIView):
+    serializer_class = MarketPlaceSerializer
+    default_limit = 500
+    max_limit = 1000
+
+    def get(self, request):
+        """Changes after sequence `since`, with the current state of changed items"""
+        try:
+            since = int(request.query_params.get("since", 0))
+            limit = int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            return Response(
+                {"error": "since and limit must be integers."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = max(1, min(limit, self.max_limit))
+
+        # Fetch one extra row to know whether another page follows
+        changes = list(
+            MarketPlaceChange.objects.filter(id__gt=since).order_by("id")[: limit + 1]
+        )
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        # Ids are allocated at insert but become visible at commit, so a
+        # recent change may still be preceded by one that isn't visible yet.
+        # Those are returned, but the cursor only moves past changes older
+        # than the safety window; clients see recent ones again next time.
+        cutoff = MarketPlaceChange.settled_before()
+        next_since = since
+        for change in changes:
+            if change.created_at >= cutoff:
+                has_more = False
+                break
+            next_since = change.id
+
+        changed_ids = {change.item_id for change in changes}
+        items = MarketPlace.objects.filter(id__in=changed_ids).select_related(
+            "created_by"
+        )
+        serializer = self.serializer_class(
+            items, many=True, context={"request": request}
+        )
+        existing_ids = {item["id"] for item in serializer.data}
+
+        return Response(
+            {
+                "since": since,
+                "next_since": next_since,
+                "has_more": has_more,
+                "changes": [
+                    {
+                        "seq": change.id,
+                        "item_id": change.item_id,
+                        "action": change.action,
+                        "created_at": change.created_at,
+                    }
+                    for change in changes
+                ],
+                "items": serializer.data,
+                "deleted": sorted(changed_ids - existing_ids),
+            }
+        )
+
+
+class MarketPlaceBulkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_data_format(self, request, filename=None):
+        data_format = request.query_params.get("fmt")
+        if not data_format and filename and "." in filename:
+            data_format = filename.rsplit(".", 1)[1].lower()
+        return data_format or "csv"
+
+    def get(self, request):
+        """Stream marketplace listings as CSV or NDJSON"""
+        data_format = self.get_data_format(request)
+        if data_format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"Unsupported format: {data_format}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        items = MarketPlace.objects.all()
+        if request.query_params.get("mine", "").lower() == "true":
+            items = items.filter(created_by=request.user)
+        return streaming_export(
+            EXPORT_FIELDS, export_rows(items, request), data_format, "marketplace"
+        )
+
+    def post(self, request):
+        """Import listings for the current user from a CSV or NDJSON upload"""
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response(
+                {"error": "Upload a CSV or NDJSON file as 'file'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        data_format = self.get_data_format(request, upload.name)
+        if data_format not in IMPORT_FORMATS:
+            return Response(
+                {"error": f"Unsupported format: {data_format}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not request.user.is_verified:
+            return Response(
+                {"error": "User is not verified."}, status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            result = import_listings(
+                read_rows(upload.file, data_format),
+                seller=request.user,
+                strict=request.query_params.get("strict", "").lower() == "true",
+            )
+        except UnicodeDecodeError:
+            return Response(
+                {"error": "File must be UTF-8 encoded."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except csv.Error as e:
+            return Response(
+                {"error": f"Malformed CSV: {str(e)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except IntegrityError as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        response_status = (
+            status.HTTP_201_CREATED if result.created else status.HTTP_400_BAD_REQUEST
+        )
+        return Response(result.as_dict(), status=response_status)
+
+
+class MarketPlaceSearchView(APIView):
+    serializer_class = MarketPlaceSerializer
+    pagination_class = StandardResultsSetPagination
+
+    def get(self, request):
+        """Full-text search over item names and descriptions"""
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response(
+                {"error": "Search query 'q' is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        items = MarketPlace.objects.select_related("created_by")
+
+        sold_status = request.query_params.get("is_sold")
+        if sold_status is not None:
+            items = items.filter(is_sold=sold_status.lower() == "true")
+
+        min_price = request.query_params.get("min_price")
+        max_price = request.query_params.get("max_price")
+        if min_price is not None or max_price is not None:
+            try:
+                min_price = Decimal(min_price) if min_price is not None else None
+                max_price = Decimal(max_price) if max_price is not None else None
+                if any(
+                    value is not None and not value.is_finite()
+                    for value in (min_price, max_price)
+                ):
+                    raise InvalidOperation
+            except InvalidOperation:
+                return Response(
+                    {"error": "min_price and max_price must be finite numbers."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            # Prices are stored as text, so compare them numerically
+            items = items.annotate(
+                price_value=Cast(
+                    "price", DecimalField(max_digits=12, decimal_places=2)
+                )
+            )
+            if min_price is not None:
+                items = items.filter(price_value__gte=min_price)
+            if max_price is not None:
+                items = items.filter(price_value__lte=max_price)
+
+        items = search_marketplace(items, query).order_by("search_rank", "-id")
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(items, request, view=self)
+        serializer = self.serializer_class(
+            page, many=True, context={"request": request}
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+
 class MarketPlaceDetailView(APIView):
     queryset = MarketPlace.objects.all()
     serializer_class = MarketPlaceSerializer
@@ -628,8 +1150,12 @@ class UserMarketPlaceListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):  # Added request parameter
-        items = MarketPlace.objects.filter(created_by=request.user)
-        serializer = self.serializer_class(items, many=True)
+        items = MarketPlace.objects.filter(created_by=request.user).select_related(
+            "created_by"
+        )
+        serializer = self.serializer_class(
+            items, many=True, context={"request": request}
+        )
         return Response(serializer.data)
 
 
@@ -638,9 +1164,18 @@ class AvailableMarketPlaceListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):  # Added request parameter
-        items = MarketPlace.objects.filter(is_sold=False)
-        serializer = self.serializer_class(items, many=True)
-        return Response(serializer.data)
+        data = catalog_cache.get_or_build(
+            catalog_cache_params(request, "marketplace-available"),
+            lambda: self.build_listing(request),
+        )
+        return Response(data)
+
+    def build_listing(self, request):
+        items = MarketPlace.objects.filter(is_sold=False).select_related("created_by")
+        serializer = self.serializer_class(
+            items, many=True, context={"request": request}
+        )
+        return list(serializer.data)
 
 
 class VerifyTOTPView(APIView):
@@ -651,6 +1186,7 @@ class VerifyTOTPView(APIView):
 
         if serializer.is_valid():
             user = serializer.validated_data["user"]
+            audit.record(AuditEvent.TOTP_OK, request, actor=user)
 
             # Mark user as verified if not already
             if not user.is_verified:
@@ -682,6 +1218,9 @@ class VerifyTOTPView(APIView):
                 },
                 status=status.HTTP_200_OK,
             )
+        audit.record(
+            AuditEvent.TOTP_FAILED, request, target=request.data.get("email", "")
+        )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -697,6 +1236,9 @@ class RequestPasswordResetView(APIView):
 
         try:
             user = CustomUser.objects.get(email=email)
+            audit.record(
+                AuditEvent.PASSWORD_RESET_REQUESTED, request, actor=user, target=email
+            )
             # Generate a secure random code
             code = "".join([str(random.randint(0, 9)) for _ in range(6)])
 
@@ -713,13 +1255,14 @@ class RequestPasswordResetView(APIView):
             )
 
             # Send verification email
-            send_mail(
-                subject="Password Reset Request - Rivr",
-                message=f"Your password reset code is: {code}\nThis code will expire in 15 minutes.",
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[email],
-                fail_silently=False,
-            )
+            with metrics.track_email():
+                send_mail(
+                    subject="Password Reset Request - Rivr",
+                    message=f"Your password reset code is: {code}\nThis code will expire in 15 minutes.",
+                    from_email=settings.EMAIL_HOST_USER,
+                    recipient_list=[email],
+                    fail_silently=False,
+                )
 
             return Response(
                 {
@@ -766,6 +1309,9 @@ class VerifyPasswordResetView(APIView):
                 )
 
             if code != verification.code:
+                audit.record(
+                    AuditEvent.PASSWORD_RESET_CODE_FAILED, request, target=email
+                )
                 return Response(
                     {"error": "Invalid reset code"}, status=status.HTTP_400_BAD_REQUEST
                 )
@@ -817,6 +1363,7 @@ class ResetPasswordView(APIView):
 
             # Delete any existing verification codes for this email
             VerificationCode.objects.filter(email=user.email).delete()
+            audit.record(AuditEvent.PASSWORD_RESET_COMPLETED, request, actor=user)
 
             return Response(
                 {"message": "Password reset successfully"}, status=status.HTTP_200_OK
@@ -836,6 +1383,7 @@ class ResetPasswordView(APIView):
 
 class ListUserView(APIView):
     permission_classes = [IsAuthenticated]
+    query_budget = QueryBudget(max_queries=4)
 
     def get(self, request):
         try:
@@ -843,10 +1391,16 @@ class ListUserView(APIView):
                 id=request.user.id
             )
             serializer = UserListSerializer(
-                active_users, many=True, context={"request": request}
+                active_users,
+                many=True,
+                context={
+                    "request": request,
+                    "friend_ids": get_friend_ids(request.user),
+                },
             )
+            users = serializer.data
             return Response(
-                {"users": serializer.data, "count": active_users.count()},
+                {"users": users, "count": len(users)},
                 status=status.HTTP_200_OK,
             )
         except Exception as e:
@@ -856,6 +1410,153 @@ class ListUserView(APIView):
             )
 
 
+class UserSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+    default_limit = 20
+    max_limit = 50
+
+    def get(self, request):
+        """Typeahead search over usernames and names with keyset pagination"""
+        query = request.query_params.get("q", "").strip()
+        mode = request.query_params.get("mode", "prefix")
+        if not query:
+            return Response(
+                {"error": "Search query 'q' is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if mode not in ("prefix", "fuzzy"):
+            return Response(
+                {"error": "mode must be 'prefix' or 'fuzzy'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # Prefix pages end at a (name, id) pair, fuzzy ones at (hits, id)
+        cursor_types = (str, int) if mode == "prefix" else (int, int)
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+            after = decode_cursor(request.query_params.get("cursor"), cursor_types)
+        except ValueError:
+            return Response(
+                {"error": "Invalid limit or cursor."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = max(1, min(limit, self.max_limit))
+
+        search = prefix_search if mode == "prefix" else fuzzy_search
+        rows, has_more = search(
+            query, exclude_user_id=request.user.id, after=after, limit=limit
+        )
+        users = active_users_in_order([user_id for _, user_id in rows])
+        serializer = UserListSerializer(
+            users,
+            many=True,
+            context={
+                "request": request,
+                "friend_ids": get_friend_ids(request.user),
+            },
+        )
+        return Response(
+            {
+                "results": serializer.data,
+                "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class FriendListView(APIView):
+    permission_classes = [IsAuthenticated]
+    default_limit = 50
+    max_limit = 200
+
+    def get(self, request, user_id=None):
+        """A user's friends, keyset-paginated by friend id"""
+        if user_id is None:
+            user_id = request.user.id
+        elif not CustomUser.objects.filter(id=user_id, is_active=True).exists():
+            return Response(
+                {"error": "User not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+            after = decode_cursor(request.query_params.get("cursor"), (int,))
+        except ValueError:
+            return Response(
+                {"error": "Invalid limit or cursor."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = max(1, min(limit, self.max_limit))
+
+        edges = FriendEdge.objects.filter(user_id=user_id, friend__is_active=True)
+        if after:
+            edges = edges.filter(friend_id__gt=after[0])
+        edges = list(
+            edges.select_related("friend").order_by("friend_id")[: limit + 1]
+        )
+        has_more = len(edges) > limit
+        edges = edges[:limit]
+
+        serializer = UserListSerializer(
+            [edge.friend for edge in edges],
+            many=True,
+            context={
+                "request": request,
+                "friend_ids": get_friend_ids(request.user),
+            },
+        )
+        return Response(
+            {
+                "results": serializer.data,
+                "next_cursor": (
+                    encode_cursor([edges[-1].friend_id]) if has_more else None
+                ),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class FriendSuggestionView(APIView):
+    permission_classes = [IsAuthenticated]
+    default_limit = 20
+    max_limit = 50
+
+    def get(self, request):
+        """People you may know, read from the precomputed suggestion table"""
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+        except ValueError:
+            return Response(
+                {"error": "limit must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = max(1, min(limit, self.max_limit))
+
+        rows = (
+            FriendSuggestion.objects.filter(
+                user=request.user, suggested__is_active=True
+            )
+            .select_related("suggested")
+            .order_by("-mutual_count", "suggested_id")[:limit]
+        )
+        mutual_counts = {}
+        users = []
+        for row in rows:
+            mutual_counts[row.suggested_id] = row.mutual_count
+            users.append(row.suggested)
+
+        serializer = UserListSerializer(
+            users,
+            many=True,
+            context={
+                "request": request,
+                "friend_ids": get_friend_ids(request.user),
+            },
+        )
+        results = serializer.data
+        for user_data in results:
+            user_data["mutual_friends"] = mutual_counts[user_data["id"]]
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -909,6 +1610,7 @@ class UserProfileView(APIView):
             # Handle profile picture upload
             if "profile_picture" in request.FILES:
                 user.profile_picture = request.FILES["profile_picture"]
+                user.profile_picture_variants_ready = False
 
             # Update other fields
             serializer = UserProfileSerializer(
@@ -916,6 +1618,9 @@ class UserProfileView(APIView):
             )
             if serializer.is_valid():
                 serializer.save()
+                if "profile_picture" in request.FILES:
+                    # Thumbnails are rendered in the background worker pool
+                    schedule_variants(user.profile_picture.name)
                 return Response(serializer.data, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -930,6 +1635,210 @@ class UserProfileView(APIView):
             )
 
 
+class DocumentUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """The user's own verification documents, newest first"""
+        document_list = request.user.document_verifications.select_related(
+            "user", "reviewed_by"
+        ).order_by("-created_at")
+        serializer = DocumentVerificationSerializer(document_list, many=True)
+        return Response({"documents": serializer.data}, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        """
+        Start a resumable upload. The body declares document_type, filename,
+        content_type and the total size in bytes; the file itself follows in
+        PUT requests to the returned upload URL.
+        """
+        document_type = request.data.get("document_type")
+        if document_type not in dict(DocumentVerification.DOCUMENT_TYPES):
+            return Response(
+                {"error": "Invalid document_type."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        filename = str(request.data.get("filename") or "").strip()[:255]
+        if not filename:
+            return Response(
+                {"error": "filename is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        content_type = request.data.get("content_type")
+        try:
+            size = int(request.data.get("size"))
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "size must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            documents.validate_upload(content_type, size)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # Locking the user serialises this count with their other starts
+            CustomUser.objects.select_for_update().filter(pk=request.user.pk).exists()
+            open_uploads = DocumentVerification.objects.filter(
+                user=request.user, status=DocumentVerification.UPLOADING
+            ).count()
+            if open_uploads >= documents.MAX_OPEN_UPLOADS:
+                return Response(
+                    {
+                        "error": "Too many unfinished uploads; complete or "
+                        "cancel one first."
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
+            document = DocumentVerification.objects.create(
+                user=request.user,
+                document_type=document_type,
+                filename=filename,
+                content_type=content_type,
+                size=size,
+            )
+        serializer = DocumentVerificationSerializer(document)
+        return Response(
+            {**serializer.data, "max_chunk_size": documents.MAX_CHUNK_SIZE},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class DocumentUploadChunkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def _offset_response(self, document, status_code=status.HTTP_200_OK, **extra):
+        response = Response(
+            {"offset": document.received, "size": document.size, **extra},
+            status=status_code,
+        )
+        response["Upload-Offset"] = str(document.received)
+        return response
+
+    def get(self, request, upload_id):
+        """How many bytes have been stored, i.e. where to resume from"""
+        document = get_object_or_404(
+            DocumentVerification, upload_id=upload_id, user=request.user
+        )
+        return self._offset_response(document)
+
+    def put(self, request, upload_id):
+        """
+        Append the raw request body at the Upload-Offset header. The body is
+        encrypted and written to disk as it is read, never held in memory.
+        """
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            return Response(
+                {"error": "Upload-Offset header must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not length:
+            return Response(
+                {"error": "Content-Length is required."},
+                status=status.HTTP_411_LENGTH_REQUIRED,
+            )
+        uploads = DocumentVerification.objects.filter(
+            upload_id=upload_id, user=request.user
+        )
+        document = get_object_or_404(uploads)
+        if document.status != DocumentVerification.UPLOADING:
+            return Response(
+                {"error": "Upload already completed."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        try:
+            # The file lock, not a row lock, serialises writes to the upload,
+            # so no transaction is held open while the body streams in
+            with documents.locked_file(document) as f:
+                # Another chunk may have landed before the lock was taken
+                document = get_object_or_404(uploads)
+                if document.status != DocumentVerification.UPLOADING:
+                    return Response(
+                        {"error": "Upload already completed."},
+                        status=status.HTTP_409_CONFLICT,
+                    )
+                documents.append_chunk(document, f, request.stream, offset, length)
+                uploads.filter(status=DocumentVerification.UPLOADING).update(
+                    received=document.received, stored_size=document.stored_size
+                )
+        except documents.UploadBusy as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        except documents.OffsetMismatch as e:
+            return self._offset_response(
+                document, status.HTTP_409_CONFLICT, error=str(e)
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return self._offset_response(document)
+
+    def delete(self, request, upload_id):
+        """Abandon an unfinished upload"""
+        with transaction.atomic():
+            document = get_object_or_404(
+                DocumentVerification.objects.select_for_update(),
+                upload_id=upload_id,
+                user=request.user,
+            )
+            if document.status != DocumentVerification.UPLOADING:
+                return Response(
+                    {"error": "Only unfinished uploads can be cancelled."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            try:
+                # Not while a chunk is being written, which would outlive
+                # the row and leave its file behind
+                with documents.locked_file(document):
+                    documents.delete_file(document)
+                    document.delete()
+            except documents.UploadBusy as e:
+                return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class DocumentUploadCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        """
+        Verify the stored file and queue it for review. An optional "sha256"
+        of the original file is compared with the digest of what was stored.
+        """
+        with transaction.atomic():
+            document = get_object_or_404(
+                DocumentVerification.objects.select_for_update(),
+                upload_id=upload_id,
+                user=request.user,
+            )
+            if document.status != DocumentVerification.UPLOADING:
+                return Response(
+                    {"error": "Upload already completed."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            try:
+                digest = documents.finish_upload(document)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            expected = request.data.get("sha256")
+            if expected and str(expected).lower() != digest:
+                return Response(
+                    {"error": "Checksum mismatch; cancel and upload again."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            document.sha256 = digest
+            document.status = DocumentVerification.PENDING
+            document.submitted_at = timezone.now()
+            document.save(update_fields=["sha256", "status", "submitted_at"])
+        audit.record(
+            AuditEvent.DOCUMENT_SUBMITTED, request, target=str(document.upload_id)
+        )
+        serializer = DocumentVerificationSerializer(document)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 # User Management Views
 class UserListView(APIView):
     permission_classes = [AllowAny]
@@ -945,14 +1854,16 @@ class UserListView(APIView):
                 is_active = active_status.lower() == "true"
                 users = users.filter(is_active=is_active)
 
-            serializer = UserListSerializer(
-                users, many=True, context={"request": request}
-            )
+            context = {"request": request}
+            if request.user.is_authenticated:
+                context["friend_ids"] = get_friend_ids(request.user)
+            serializer = UserListSerializer(users, many=True, context=context)
+            data = serializer.data
 
             return Response(
                 {
-                    "users": serializer.data,
-                    "count": users.count(),
+                    "users": data,
+                    "count": len(data),
                 },
                 status=status.HTTP_200_OK,
             )
@@ -974,6 +1885,9 @@ class UserManagementView(APIView):
             # Instead of permanent deletion, deactivate the user
             user.is_active = False
             user.save()
+            audit.record(
+                AuditEvent.ADMIN_USER_DEACTIVATED, request, target=f"user:{user.id}"
+            )
 
             return Response(
                 {"message": f"User {user.username} has been deactivated"},
@@ -993,6 +1907,9 @@ class UserManagementView(APIView):
             # Reactivate the user
             user.is_active = True
             user.save()
+            audit.record(
+                AuditEvent.ADMIN_USER_REACTIVATED, request, target=f"user:{user.id}"
+            )
 
             return Response(
                 {"message": f"User {user.username} has been reactivated"},
@@ -1013,7 +1930,7 @@ class AdminMarketplaceListView(APIView):
         """Get all marketplace items"""
         try:
             # Get all items
-            items = MarketPlace.objects.all()
+            items = MarketPlace.objects.select_related("created_by")
 
             # Filter by sold status if specified
             sold_status = request.query_params.get("sold")
@@ -1021,7 +1938,9 @@ class AdminMarketplaceListView(APIView):
                 is_sold = sold_status.lower() == "true"
                 items = items.filter(is_sold=is_sold)
 
-            serializer = MarketPlaceSerializer(items, many=True)
+            serializer = MarketPlaceSerializer(
+                items, many=True, context={"request": request}
+            )
 
             return Response(
                 {"items": serializer.data, "count": items.count()},
@@ -1042,9 +1961,15 @@ class AdminMarketplaceItemView(APIView):
         try:
             item = get_object_or_404(MarketPlace, id=item_id)
             item.delete()
+            audit.record(
+                AuditEvent.ADMIN_ITEM_DELETED,
+                request,
+                target=f"item:{item_id}",
+                name=item.name,
+            )
 
             return Response(
-                {"message": f"Marketplace item '{item.title}' has been deleted"},
+                {"message": f"Marketplace item '{item.name}' has been deleted"},
                 status=status.HTTP_200_OK,
             )
         except Exception as e:
@@ -1054,18 +1979,357 @@ class AdminMarketplaceItemView(APIView):
             )
 
 
+class AdminUserExportView(APIView):
+    permission_classes = [IsAdminUser]
+    fields = [
+        "id",
+        "username",
+        "email",
+        "first_name",
+        "last_name",
+        "is_active",
+        "is_verified",
+        "is_approved",
+        "is_staff",
+        "date_joined",
+    ]
+
+    def get(self, request):
+        """Stream all users as CSV or NDJSON (?fmt=), optionally ?active=true|false"""
+        data_format = request.query_params.get("fmt", "csv")
+        if data_format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"Unsupported format: {data_format}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        users = CustomUser.objects.all()
+        active_status = request.query_params.get("active")
+        if active_status is not None:
+            users = users.filter(is_active=active_status.lower() == "true")
+        rows = (
+            dict(zip(self.fields, row)) for row in keyset_values(users, self.fields)
+        )
+        audit.record(AuditEvent.ADMIN_EXPORT, request, target="users")
+        return streaming_export(self.fields, rows, data_format, "users")
+
+
+class AdminMarketplaceExportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """Stream all listings as CSV or NDJSON (?fmt=), optionally ?sold=true|false"""
+        data_format = request.query_params.get("fmt", "csv")
+        if data_format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"Unsupported format: {data_format}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        items = MarketPlace.objects.all()
+        sold_status = request.query_params.get("sold")
+        if sold_status is not None:
+            items = items.filter(is_sold=sold_status.lower() == "true")
+        audit.record(AuditEvent.ADMIN_EXPORT, request, target="marketplace")
+        return streaming_export(
+            EXPORT_FIELDS, export_rows(items, request), data_format, "marketplace"
+        )
+
+
+class AdminUserBulkView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        """
+        Deactivate or reactivate many users at once, chosen by "ids" or by
+        a "filter" such as {"email_domain": "spam.example"}
+        """
+        action = request.data.get("action")
+        if action not in ("deactivate", "activate"):
+            return Response(
+                {"error": "action must be 'deactivate' or 'activate'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # Admins can't lock themselves or superusers out in bulk
+        users = CustomUser.objects.exclude(pk=request.user.pk).exclude(
+            is_superuser=True
+        )
+        try:
+            user_ids = moderation.select_ids(
+                users,
+                ids=request.data.get("ids"),
+                filters=request.data.get("filter"),
+                allowed=moderation.USER_FILTERS,
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        affected = moderation.set_users_active(user_ids, action == "activate")
+        audit.record(
+            AuditEvent.ADMIN_USERS_BULK,
+            request,
+            target=action,
+            filter=request.data.get("filter"),
+            matched=len(user_ids),
+            affected=affected,
+        )
+        return Response(
+            {"action": action, "matched": len(user_ids), "affected": affected},
+            status=status.HTTP_200_OK,
+        )
+
+
+class AdminMarketplaceBulkView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        """Delete many listings at once, chosen by ids or by a filter"""
+        if request.data.get("action") != "delete":
+            return Response(
+                {"error": "action must be 'delete'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            item_ids = moderation.select_ids(
+                MarketPlace.objects.all(),
+                ids=request.data.get("ids"),
+                filters=request.data.get("filter"),
+                allowed=moderation.LISTING_FILTERS,
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        affected = moderation.delete_listings(item_ids)
+        audit.record(
+            AuditEvent.ADMIN_ITEMS_BULK,
+            request,
+            target="delete",
+            filter=request.data.get("filter"),
+            matched=len(item_ids),
+            affected=affected,
+        )
+        return Response(
+            {"action": "delete", "matched": len(item_ids), "affected": affected},
+            status=status.HTTP_200_OK,
+        )
+
+
+class AuditLogView(APIView):
+    permission_classes = [IsAdminUser]
+    default_limit = 50
+    max_limit = 500
+
+    def get(self, request):
+        """
+        Audit events, newest first, keyset-paginated by id. Filters: action
+        (exact or a prefix ending in "."), actor, ip, since, until.
+        """
+        try:
+            limit = int(request.query_params.get("limit", self.default_limit))
+            before = decode_cursor(request.query_params.get("cursor"), (int,))
+        except ValueError:
+            return Response(
+                {"error": "Invalid limit or cursor."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = max(1, min(limit, self.max_limit))
+
+        events = AuditEvent.objects.all()
+        params = request.query_params
+        action = params.get("action")
+        if action:
+            if action.endswith("."):
+                events = events.filter(action__startswith=action)
+            else:
+                events = events.filter(action=action)
+        if params.get("actor"):
+            if not params["actor"].isdigit():
+                return Response(
+                    {"error": "actor must be a user id."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            events = events.filter(actor_id=int(params["actor"]))
+        if params.get("ip"):
+            try:
+                ip = ipaddress.ip_address(params["ip"])
+            except ValueError:
+                return Response(
+                    {"error": "ip must be an IPv4 or IPv6 address."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            events = events.filter(ip=str(ip))
+        for name, lookup in (("since", "created_at__gte"), ("until", "created_at__lt")):
+            if params.get(name):
+                moment = parse_datetime(params[name])
+                if moment is None:
+                    return Response(
+                        {"error": f"{name} must be an ISO 8601 datetime."},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+                events = events.filter(**{lookup: moment})
+        if before:
+            events = events.filter(id__lt=before[0])
+
+        rows = list(
+            events.order_by("-id").values(
+                "id", "created_at", "action", "actor_id", "ip", "target", "detail"
+            )[: limit + 1]
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return Response(
+            {
+                "results": rows,
+                "next_cursor": encode_cursor([rows[-1]["id"]]) if has_more else None,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class AdminDocumentQueueView(APIView):
+    permission_classes = [IsAdminUser]
+    pagination_class = StandardResultsSetPagination
+
+    def get(self, request):
+        """Documents awaiting review (or ?status=), oldest submission first"""
+        document_status = request.query_params.get(
+            "status", DocumentVerification.PENDING
+        )
+        if document_status not in dict(DocumentVerification.STATUS_CHOICES):
+            return Response(
+                {"error": f"Unknown status: {document_status}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        queue = (
+            DocumentVerification.objects.filter(status=document_status)
+            .select_related("user", "reviewed_by")
+            .order_by("submitted_at", "id")
+        )
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queue, request, view=self)
+        serializer = DocumentVerificationSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class AdminDocumentDecisionView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, document_id):
+        """Approve or reject a pending document; approval approves the user"""
+        decision = request.data.get("decision")
+        if decision not in ("approve", "reject"):
+            return Response(
+                {"error": "decision must be 'approve' or 'reject'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        with transaction.atomic():
+            document = get_object_or_404(
+                DocumentVerification.objects.select_for_update(), pk=document_id
+            )
+            if document.status != DocumentVerification.PENDING:
+                return Response(
+                    {"error": "Only pending documents can be reviewed."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            if decision == "approve":
+                document.status = DocumentVerification.APPROVED
+            else:
+                document.status = DocumentVerification.REJECTED
+            document.review_note = str(request.data.get("note") or "")
+            document.reviewed_by = request.user
+            document.reviewed_at = timezone.now()
+            document.save(
+                update_fields=["status", "review_note", "reviewed_by", "reviewed_at"]
+            )
+            if decision == "approve" and not document.user.is_approved:
+                document.user.is_approved = True
+                document.user.save(update_fields=["is_approved"])
+        audit.record(
+            AuditEvent.ADMIN_DOCUMENT_REVIEWED,
+            request,
+            target=document.user_id,
+            document=document.pk,
+            decision=decision,
+        )
+        serializer = DocumentVerificationSerializer(document)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class AdminDocumentDownloadView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, document_id):
+        """Stream the decrypted document"""
+        document = get_object_or_404(DocumentVerification, pk=document_id)
+        if document.status == DocumentVerification.UPLOADING:
+            return Response(
+                {"error": "Upload not completed."}, status=status.HTTP_409_CONFLICT
+            )
+        audit.record(
+            AuditEvent.ADMIN_DOCUMENT_DOWNLOADED,
+            request,
+            target=document.user_id,
+            document=document.pk,
+        )
+        response = StreamingHttpResponse(
+            documents.iter_plaintext(document), content_type=document.content_type
+        )
+        response["Content-Length"] = str(document.size)
+        response["Content-Disposition"] = (
+            f'attachment; filename="document-{document.pk}"'
+        )
+        return response
+
+
+class AdminCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """Hit-rate statistics of the shared response caches in this worker"""
+        return Response({"catalog": catalog_cache.stats()}, status=status.HTTP_200_OK)
+
+
 # Dashboard Analytics View
 class AdminDashboardView(APIView):
     permission_classes = [AllowAny]
+    default_days = 30
+    max_days = 366
 
     def get(self, request):
-        """Get dashboard analytics data"""
+        """
+        Dashboard totals plus daily buckets for ?start=&end= (YYYY-MM-DD,
+        default the last 30 days), read from the materialized rollups only
+        """
+        try:
+            end = request.query_params.get("end")
+            end = date.fromisoformat(end) if end else timezone.localdate()
+            start = request.query_params.get("start")
+            start = (
+                date.fromisoformat(start)
+                if start
+                else end - timedelta(days=self.default_days - 1)
+            )
+        except ValueError:
+            return Response(
+                {"error": "start and end must be dates in YYYY-MM-DD format."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if start > end:
+            return Response(
+                {"error": "start must not be after end."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if (end - start).days >= self.max_days:
+            return Response(
+                {"error": f"The date range may span at most {self.max_days} days."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         try:
-            # Count stats for dashboard
-            total_users = CustomUser.objects.count()
-            active_users = CustomUser.objects.filter(is_active=True).count()
-            total_items = MarketPlace.objects.count()
-            sold_items = MarketPlace.objects.filter(is_sold=True).count()
+            totals = stats.get_totals()
+            if totals is None:
+                # Counters missing or partly cleared: recount them
+                totals = stats.rebuild_totals()
+            total_users = totals[stats.USERS]
+            active_users = totals[stats.ACTIVE_USERS]
+            total_items = totals[stats.ITEMS]
+            sold_items = totals[stats.SOLD_ITEMS]
 
             return Response(
                 {
@@ -1075,6 +2339,9 @@ class AdminDashboardView(APIView):
                     "total_marketplace_items": total_items,
                     "sold_items": sold_items,
                     "available_items": total_items - sold_items,
+                    "start": start.isoformat(),
+                    "end": end.isoformat(),
+                    "daily": stats.get_daily(start, end),
                 },
                 status=status.HTTP_200_OK,
             )
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -6,8 +7,10 @@ from decouple import Config, RepositoryEnv, config
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# Load environment variables from .env file in the base directory
-env_config = Config(RepositoryEnv(os.path.join(BASE_DIR, ".env")))
+# Load environment variables from the .env file in the base directory, or
+# straight from the environment when there is none (e.g. settings_bench)
+ENV_FILE = os.path.join(BASE_DIR, ".env")
+env_config = Config(RepositoryEnv(ENV_FILE)) if os.path.exists(ENV_FILE) else config
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -44,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its timings cover the rest of the stack
+    "api.profiling.ProfilingMiddleware",
+    "api.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -52,6 +58,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # Innermost, so it only counts the view's queries
+    "api.budgets.QueryBudgetMiddleware",
 ]
 
 REST_FRAMEWORK = {
@@ -64,10 +72,17 @@ REST_FRAMEWORK = {
 }
 
 # Read RSA keys for JWT
-with open(os.path.join(BASE_DIR, ".jwt_private.pem"), "rb") as f:
+JWT_PRIVATE_KEY_PATH = env_config(
+    "JWT_PRIVATE_KEY_PATH", default=os.path.join(BASE_DIR, ".jwt_private.pem")
+)
+JWT_PUBLIC_KEY_PATH = env_config(
+    "JWT_PUBLIC_KEY_PATH", default=os.path.join(BASE_DIR, ".jwt_public.pem")
+)
+
+with open(JWT_PRIVATE_KEY_PATH, "rb") as f:
     PRIVATE_KEY = f.read()
 
-with open(os.path.join(BASE_DIR, ".jwt_public.pem"), "rb") as f:
+with open(JWT_PUBLIC_KEY_PATH, "rb") as f:
     PUBLIC_KEY = f.read()
 
 SIMPLE_JWT = {
@@ -116,6 +131,20 @@ DATABASES = {
 }
 
 
+# Cache
+# Point CACHE_BACKEND at a shared cache (e.g. Redis or Memcached) in production
+# so the marketplace catalog cache is shared between worker processes.
+
+CACHES = {
+    "default": {
+        "BACKEND": env_config(
+            "CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": env_config("CACHE_LOCATION", default="rivr"),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -169,3 +198,65 @@ EMAIL_PORT = env_config("EMAIL_PORT", cast=int)
 EMAIL_HOST_USER = env_config("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = env_config("EMAIL_HOST_PASSWORD")
 EMAIL_USE_TLS = env_config("EMAIL_USE_TLS", default=True, cast=bool)
+
+# Background workers rendering thumbnail variants of uploaded images
+IMAGE_VARIANT_WORKERS = env_config("IMAGE_VARIANT_WORKERS", default=2, cast=int)
+
+# Security audit log: events are queued and written in batches by a
+# background thread unless AUDIT_LOG_BUFFERED is off
+AUDIT_LOG_BUFFERED = env_config("AUDIT_LOG_BUFFERED", default=True, cast=bool)
+AUDIT_LOG_BATCH_SIZE = env_config("AUDIT_LOG_BATCH_SIZE", default=500, cast=int)
+AUDIT_LOG_FLUSH_INTERVAL = env_config(
+    "AUDIT_LOG_FLUSH_INTERVAL", default=1.0, cast=float
+)
+AUDIT_LOG_RETENTION_DAYS = env_config(
+    "AUDIT_LOG_RETENTION_DAYS", default=180, cast=int
+)
+
+# Identity documents: stored AES-GCM encrypted under DOCUMENT_ROOT. Without
+# DOCUMENT_ENCRYPTION_KEY (urlsafe base64 of 32 bytes) the key is derived
+# from SECRET_KEY
+DOCUMENT_ROOT = env_config(
+    "DOCUMENT_ROOT", default=os.path.join(MEDIA_ROOT, "documents")
+)
+DOCUMENT_ENCRYPTION_KEY = env_config("DOCUMENT_ENCRYPTION_KEY", default="")
+DOCUMENT_MAX_SIZE = env_config(
+    "DOCUMENT_MAX_SIZE", default=20 * 1024 * 1024, cast=int
+)
+DOCUMENT_MAX_CHUNK_SIZE = env_config(
+    "DOCUMENT_MAX_CHUNK_SIZE", default=8 * 1024 * 1024, cast=int
+)
+# Unfinished uploads a user may have at once; expired ones are removed by
+# the cleanup_stale_uploads command
+DOCUMENT_MAX_OPEN_UPLOADS = env_config(
+    "DOCUMENT_MAX_OPEN_UPLOADS", default=3, cast=int
+)
+DOCUMENT_UPLOAD_EXPIRY_HOURS = env_config(
+    "DOCUMENT_UPLOAD_EXPIRY_HOURS", default=24, cast=int
+)
+
+# Per-request profiling: Server-Timing headers on every response and a
+# cProfile report for staff requests with ?profile=1. Off in production.
+PROFILING_ENABLED = env_config("PROFILING_ENABLED", default=False, cast=bool)
+# Also save each ?profile=1 run here as a .prof file
+PROFILING_DUMP_DIR = env_config("PROFILING_DUMP_DIR", default="")
+
+# Prometheus metrics at /metrics, aggregated over worker processes through
+# per-process snapshot files in METRICS_DIR (empty it on deploy)
+METRICS_ENABLED = env_config("METRICS_ENABLED", default=False, cast=bool)
+METRICS_DIR = env_config(
+    "METRICS_DIR", default=os.path.join(tempfile.gettempdir(), "rivr-metrics")
+)
+METRICS_FLUSH_INTERVAL = env_config("METRICS_FLUSH_INTERVAL", default=5.0, cast=float)
+# Bearer token scrapers must send; /metrics is only served without one with
+# DEBUG on
+METRICS_TOKEN = env_config("METRICS_TOKEN", default="")
+
+# Check views' declared query budgets: "off", "log" a warning or "raise"
+QUERY_BUDGET_MODE = env_config("QUERY_BUDGET_MODE", default="log" if DEBUG else "off")
+
+# Seconds a marketplace change must age before sync cursors move past it;
+# longer than any transaction that writes to the change log
+MARKETPLACE_SYNC_SAFETY_WINDOW = env_config(
+    "MARKETPLACE_SYNC_SAFETY_WINDOW", default=5.0, cast=float
+)